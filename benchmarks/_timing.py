@@ -0,0 +1,22 @@
+# _timing.py
+# Best-of-N timing shared by the bench_*.py scripts
+# License: MIT
+
+import subprocess, time
+
+RUNS = 3
+
+def best_time(fn, runs=RUNS):
+    """The fastest of runs calls to fn(), and what the last one returned."""
+    best, result = None, None
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        result = fn()
+        t = time.perf_counter() - t0
+        best = t if best is None else min(best, t)
+    return best, result
+
+def best_of(exe, runs=RUNS, **run_args):
+    """The fastest of runs executions of exe, and its stdout. run_args go to
+    subprocess.run (text=True, env=...)."""
+    return best_time(lambda: subprocess.run([exe], capture_output=True, check=True, **run_args).stdout, runs)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# bench_alloc.py
+# Arena and bump allocation (inlined fast path, O(1) reset) vs. malloc/free
+# License: MIT
+
+import os, sys, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from plasmascriptc import LLVMBackend, PlasmaTransformer, parser
+from _timing import best_of
+
+ROUNDS, NODES = 2000, 5000
+
+# Each round builds a NODES-long linked list of 16-byte nodes, walks it and
+# then releases it: node by node with free(), or in one reset.
+PROGRAM = """
+Prog main() {{
+    {setup}
+    let total = 0
+    for r in range({rounds}) {{
+        let head = {alloc}
+        store(head, 0, r)
+        store(head, 8, head)
+        for i in range({nodes}) {{
+            let node = {alloc}
+            store(node, 0, i)
+            store(node, 8, head)
+            head = node
+        }}
+        for i in range({nodes} + 1) {{
+            total = total + load(head, 0)
+            let next = load_ptr(head, 8)
+            {release}
+            head = next
+        }}
+        {reset}
+    }}
+    Print [total]
+}}
+"""
+
+VARIANTS = {
+    "malloc/free": dict(setup="", alloc="malloc(16)", release="free(head)", reset=""),
+    "arena": dict(setup="let a = arena_init(4096)", alloc="arena_alloc(a, 16)", release="", reset="arena_reset(a)"),
+    "bump": dict(setup="let a = bump_init(4096)", alloc="bump_alloc(a, 16)", release="", reset="bump_reset(a)"),
+}
+
+def main():
+    level = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    results = {}
+    with tempfile.TemporaryDirectory() as d:
+        for name, parts in VARIANTS.items():
+            src = PROGRAM.format(rounds=ROUNDS, nodes=NODES, **parts)
+            exe = os.path.join(d, name.replace("/", "_"))
+            LLVMBackend(PlasmaTransformer().transform(parser.parse(src)).children, level).compile(exe)
+            results[name] = best_of(exe, text=True)
+    if len({out for _, out in results.values()}) != 1: print("output mismatch")
+    base = results["malloc/free"][0]
+    for name, (t, _) in results.items():
+        print(f"{name:<12} {t*1000:8.1f} ms  ({base / t:.2f}x)   {ROUNDS * (NODES + 1)} allocations")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# bench_assembler.py
+# Assembly latency for large generated programs: the built-in ELF64
+# assembler against the nasm executable (when it is on PATH)
+# License: MIT
+
+import os, shutil, subprocess, sys, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from plasmascriptc import NASMBackend, parser, PlasmaTransformer
+from plasmascriptc_elf import assemble
+from _timing import best_time
+
+SIZES = (100, 1000, 4000)
+
+def program(n):
+    funcs = "".join(f"""Func f{i}(a, b) {{
+    let t = a * {i % 7 + 2} + b / {i % 5 + 3}
+    while t > {i} {{
+        t = t - b % 11
+    }}
+    if a > b {{
+        t = t + a * b
+    }}
+    return t
+}}
+""" for i in range(n))
+    calls = "".join(f"    Print [f{i}({i}, 3)]\n" for i in range(n))
+    return funcs + f"Prog main() {{\n{calls}}}\nend\n"
+
+def main():
+    nasm = shutil.which("nasm")
+    print(f"{'functions':>10}{'asm lines':>11}{'builtin ms':>12}{'nasm ms':>10}")
+    with tempfile.TemporaryDirectory() as d:
+        for n in SIZES:
+            asm = NASMBackend(PlasmaTransformer().transform(parser.parse(program(n))).children, 2).build()
+            path = os.path.join(d, "p.asm")
+            with open(path, "w") as f: f.write(asm)
+            builtin = best_time(lambda: assemble(asm))[0]
+            run_nasm = lambda: subprocess.run([nasm, "-felf64", path, "-o", os.path.join(d, "p.o")], check=True)
+            external = f"{best_time(run_nasm)[0] * 1000:>10.1f}" if nasm else f"{'n/a':>10}"
+            print(f"{n:>10}{asm.count(chr(10)) + 1:>11}{builtin * 1000:>12.1f}{external}")
+
+if __name__ == "__main__":
+    main()
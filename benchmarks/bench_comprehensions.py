@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# bench_comprehensions.py
+# Natively compiled list comprehensions vs. the comprehension VM on 10^7 elements
+# License: MIT
+
+import os, subprocess, sys, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from plasmascriptc import LLVMBackend, PlasmaTransformer, parser
+from _timing import best_time
+
+N = 10_000_000
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# The VM only evaluates variables and constants inside a comprehension, so the
+# shared kernel is a plain copy; the native build also runs an arithmetic one.
+KERNELS = ["[x for x in xs]", "[x * x + 3 for x in xs]"]
+
+def native_program(stmt):
+    return f"Prog main() {{\n    let xs = [i for i in range({N})]\n    {stmt}\n    Print [sum(ys)]\n}}\n"
+
+def native_time(kernel, level, d):
+    exe = os.path.join(d, "comp")
+    ast = PlasmaTransformer().transform(parser.parse(native_program(f"let ys = {kernel}"))).children
+    LLVMBackend(ast, level).compile(exe)
+    base = os.path.join(d, "base")   # same program minus the kernel, to subtract the setup
+    ast = PlasmaTransformer().transform(parser.parse(native_program("let ys = xs"))).children
+    LLVMBackend(ast, level).compile(base)
+    run = lambda exe: subprocess.run([exe], capture_output=True, check=True)
+    return max(best_time(lambda: run(exe))[0] - best_time(lambda: run(base))[0], 1e-6)
+
+def load_vm():
+    # plasma_vm_comprehensions builds its (LALR-conflicting) parser at import
+    # time; only the VM itself is needed here, so load the code above that.
+    with open(os.path.join(HERE, "..", "plasma_vm_comprehensions.py")) as f:
+        src = f.read().split("parser = Lark(")[0]
+    ns = {}
+    exec(compile(src, "plasma_vm_comprehensions.py", "exec"), ns)
+    return ns["PlasmaVM"], ns["OpCode"]
+
+def vm_time():
+    PlasmaVM, Op = load_vm()
+    # let ys = [x for x in xs]
+    bytecode = [(Op.LOAD_VAR, "xs"), (Op.LIST_COMP, ((Op.LOAD_VAR, "x"), "x", None)), (Op.STORE_VAR, "ys")]
+    def run():
+        machine = PlasmaVM([], bytecode)
+        machine.globals["xs"] = xs
+        machine.run()
+    xs = list(range(N))
+    return best_time(run)[0]
+
+def main():
+    level = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    t_vm = vm_time()
+    print(f"{'VM':<5}{KERNELS[0]:<26}{t_vm*1000:9.1f} ms")
+    with tempfile.TemporaryDirectory() as d:
+        for kernel in KERNELS:
+            t = native_time(kernel, level, d)
+            print(f"{'-O' + str(level):<5}{kernel:<26}{t*1000:9.1f} ms  ({t_vm / t:.0f}x faster than the VM copy)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# bench_counted_loops.py
+# codegen_nasm on nested integer loops: loop-invariant code motion and
+# unrolling, static size and native run time (Linux, built-in assembler + ld)
+# License: MIT
+
+import os, subprocess, sys, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from plasmascriptc_elf import write_object
+from plasmascriptc_nasm import UNROLL, codegen_nasm
+from plasmascriptc_x86 import HOST_ABI, SYSV
+from _timing import best_of
+
+N = M = 6000
+
+def num(v): return {"type": "Number", "value": v}
+def var(v): return {"type": "Var", "value": v}
+def op(v): return {"type": "Op", "value": v}
+
+def program():
+    # total += a*b*i + j*(a+b) - (a*5+b) % 11 over i, j in 1..N x 1..M
+    step = ([var("total"), var("a"), var("b"), op("*"), var("i"), op("*"), op("+"),
+             var("j"), var("a"), var("b"), op("+"), op("*"), op("+"),
+             var("a"), num(5), op("*"), var("b"), op("+"), num(11), op("%"), op("-")])
+    return [
+        {"type": "FunctionDecl", "name": "main", "args": []},
+        {"type": "AssignExpr", "name": "a", "expr": [num(7)]},
+        {"type": "AssignExpr", "name": "b", "expr": [num(3)]},
+        {"type": "AssignExpr", "name": "total", "expr": [num(0)]},
+        {"type": "ForLoop", "var": "i", "start": "1", "end": str(N)},
+        {"type": "ForLoop", "var": "j", "start": "1", "end": str(M)},
+        {"type": "AssignExpr", "name": "total", "expr": step},
+        {"type": "BlockEnd"},
+        {"type": "BlockEnd"},
+        {"type": "Print", "value": "total"},
+        {"type": "ReturnExpr", "expr": [num(0)]},
+    ]
+
+def expected():
+    a, b = 7, 3
+    return sum(a * b * i for i in range(1, N + 1)) * M + sum(j * (a + b) for j in range(1, M + 1)) * N - (a * 5 + b) % 11 * N * M
+
+def main():
+    native = HOST_ABI is SYSV
+    print(f"{'variant':<20}{'ins':>6}{'hoisted':>9}{'ms':>10}")
+    with tempfile.TemporaryDirectory() as d:
+        for name, unroll, hoist in (("plain", 1, False), ("hoist", 1, True),
+                                    (f"unroll {UNROLL}", UNROLL, False), (f"hoist + unroll {UNROLL}", UNROLL, True)):
+            stats = {}
+            asm = codegen_nasm(program(), stats, unroll=unroll, hoist=hoist)
+            body = asm.split("print_int:")[0]   # the runtime is the same in every variant
+            ins = sum(1 for l in body.splitlines() if l.startswith("  "))
+            ms = "n/a"
+            if native:
+                exe = os.path.join(d, name.replace(" ", "_").replace("+", ""))
+                write_object(asm, exe + ".o")
+                subprocess.run(["ld", exe + ".o", "-o", exe], check=True)
+                t, out = best_of(exe)
+                if int(out) != expected(): raise Exception(f"{name} printed {out.strip()}, expected {expected()}")
+                ms = f"{t * 1000:.1f}"
+            print(f"{name:<20}{ins:>6}{stats.get('hoisted', 0):>9}{ms:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+# bench_loops.py
+# Natively compiled PlasmaScript loops vs. the same loops in C
+# License: MIT
+
+import os, subprocess, sys, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from plasmascriptc import LLVMBackend, parse_file
+from _timing import best_of
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def main():
+    level = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    with tempfile.TemporaryDirectory() as d:
+        ps_exe, c_exe = os.path.join(d, "loops_ps"), os.path.join(d, "loops_c")
+        LLVMBackend(parse_file(os.path.join(HERE, "loops.ps")), level).compile(ps_exe)
+        subprocess.run(["cc", f"-O{level}", "-march=native", os.path.join(HERE, "loops.c"), "-o", c_exe], check=True)
+        t_ps, out_ps = best_of(ps_exe, text=True)
+        t_c, out_c = best_of(c_exe, text=True)
+    if out_ps != out_c: print(f"output mismatch:\n{out_ps}\nvs\n{out_c}")
+    print(f"PlasmaScript -O{level}: {t_ps*1000:.1f} ms")
+    print(f"C (cc -O{level}):     {t_c*1000:.1f} ms")
+    print(f"ratio: {t_ps / t_c:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# bench_nasm_regalloc.py
+# Static instruction count and memory traffic of the NASM backend with
+# every value in a stack slot (-O0) vs. linear-scan allocation (-O2), and
+# native run times next to LLVM -O2 on System V hosts
+# License: MIT
+
+import glob, os, sys, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from plasmascriptc import LLVMBackend, NASMBackend, parse_file
+from plasmascriptc_x86 import HOST_ABI, SYSV
+from _timing import best_of
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+
+def measure(path, level):
+    backend = NASMBackend(parse_file(path), level)
+    backend.build()
+    return backend.stats
+
+def run_times(path, d):
+    """ms for NASM -O0, NASM -O2 and LLVM -O2 builds, which must print the same."""
+    base = os.path.join(d, os.path.basename(path))
+    NASMBackend(parse_file(path), 0).compile(base + ".n0")
+    NASMBackend(parse_file(path), 2).compile(base + ".n2")
+    LLVMBackend(parse_file(path), 2).compile(base + ".ll")
+    results = [best_of(base + ext) for ext in (".n0", ".n2", ".ll")]
+    if len({out for _, out in results}) != 1: raise Exception(f"NASM and LLVM builds of {path} disagree")
+    return [t * 1000 for t, _ in results]
+
+def main():
+    paths = sys.argv[1:] or ([os.path.join(HERE, p) for p in ("arith.ps", "loops.ps", "dispatch.ps")]
+                             + sorted(glob.glob(os.path.join(ROOT, "src", "*.ps"))))
+    print(f"{'program':<24}{'O0 ins':>8}{'O2 ins':>8}{'O0 mem':>8}{'O2 mem':>8}{'spills':>8}{'mem cut':>9}")
+    built = []
+    for path in paths:
+        try:
+            o0, o2 = measure(path, 0), measure(path, 2)
+        except Exception as e:
+            print(f"skip {os.path.basename(path)}: {str(e).splitlines()[0]}", file=sys.stderr)
+            continue
+        if not o0["instructions"]: continue
+        built.append(path)
+        print(f"{os.path.basename(path):<24}{o0['instructions']:>8}{o2['instructions']:>8}"
+              f"{o0['memory_accesses']:>8}{o2['memory_accesses']:>8}{o2['spill_slots']:>8}"
+              f"{o0['memory_accesses'] / max(o2['memory_accesses'], 1):>8.1f}x")
+    if HOST_ABI is not SYSV: return   # the native builds below are Linux executables
+    print()
+    print(f"{'program':<24}{'O0 ms':>8}{'O2 ms':>8}{'LLVM ms':>9}")
+    with tempfile.TemporaryDirectory() as d:
+        for path in built:
+            try:
+                n0, n2, ll = run_times(path, d)
+            except Exception as e:
+                print(f"skip {os.path.basename(path)}: {str(e).splitlines()[0]}", file=sys.stderr)
+                continue
+            print(f"{os.path.basename(path):<24}{n0:>8.1f}{n2:>8.1f}{ll:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# bench_opt_levels.py
+# IR size and runtime of the example programs at -O0..-O3
+# License: MIT
+
+import glob, os, sys, tempfile, time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from plasmascriptc import LLVMBackend, parse_file
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+RUNS = 20
+
+def bench(path, level, workdir):
+    exe = os.path.join(workdir, f"{os.path.basename(path)}.O{level}")
+    backend = LLVMBackend(parse_file(path), level)
+    t0 = time.perf_counter()
+    backend.compile(exe)
+    build = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(RUNS):
+        os.system(f"{exe} > /dev/null")
+    run = (time.perf_counter() - t0) / RUNS
+    return backend.stats["ir_before"], backend.stats["ir_after"], build, run
+
+def main():
+    paths = sys.argv[1:] or sorted(glob.glob(os.path.join(ROOT, "examples", "hello", "*.ps")))
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for path in paths:
+            for level in range(4):
+                try:
+                    rows.append((os.path.basename(path), level) + bench(path, level, workdir))
+                except Exception as e:
+                    print(f"skip {os.path.basename(path)} -O{level}: {str(e).splitlines()[0]}", file=sys.stderr)
+                    break
+    print(f"{'program':<28}{'opt':>4}{'IR in':>8}{'IR out':>8}{'build ms':>10}{'run ms':>9}")
+    for name, level, before, after, build, run in rows:
+        print(f"{name:<28}{'-O%d' % level:>4}{before:>8}{after:>8}{build*1000:>10.1f}{run*1000:>9.2f}")
+
+if __name__ == "__main__":
+    main()
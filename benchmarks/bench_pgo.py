@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# bench_pgo.py
+# Profile-guided builds (--pgo-instrument, run, llvm-profdata merge, --pgo-use)
+# vs. plain builds of the example programs
+# License: MIT
+
+import glob, os, subprocess, sys, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from plasmascriptc import LLVMBackend, parse_file
+from plasmascriptc_pgo import PROFDATA, load_profile
+from _timing import best_of
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+RUNS = 5
+
+def bench(path, level, d):
+    name = os.path.splitext(os.path.basename(path))[0]
+    exe = lambda kind: os.path.join(d, f"{name}.{kind}")
+    LLVMBackend(parse_file(path), level).compile(exe("plain"))
+    LLVMBackend(parse_file(path), level, pgo="instrument").compile(exe("instr"))
+    raw = os.path.join(d, f"{name}.proftext")
+    t_instr, _ = best_of(exe("instr"), RUNS, env=dict(os.environ, LLVM_PROFILE_FILE=raw))   # training runs
+    profdata = os.path.join(d, f"{name}.profdata")
+    subprocess.run([PROFDATA, "merge", "-o", profdata, raw], check=True)
+    LLVMBackend(parse_file(path), level, pgo=load_profile(profdata)).compile(exe("pgo"))
+    t_plain, out_plain = best_of(exe("plain"), RUNS)
+    t_pgo, out_pgo = best_of(exe("pgo"), RUNS)
+    if out_plain != out_pgo: raise Exception("PGO build changed the output")
+    return t_plain, t_instr, t_pgo
+
+def main():
+    level = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    paths = sys.argv[2:] or (sorted(glob.glob(os.path.join(ROOT, "examples", "hello", "*.ps")))
+                             + [os.path.join(HERE, p) for p in ("loops.ps", "dispatch.ps")])
+    rows = []
+    with tempfile.TemporaryDirectory() as d:
+        for path in paths:
+            try:
+                rows.append((os.path.basename(path),) + bench(path, level, d))
+            except Exception as e:
+                print(f"skip {os.path.basename(path)}: {str(e).splitlines()[0]}", file=sys.stderr)
+    print(f"{'program':<28}{'-O' + str(level) + ' ms':>10}{'instr ms':>10}{'pgo ms':>10}{'speedup':>9}")
+    for name, plain, instr, pgo in rows:
+        print(f"{name:<28}{plain*1000:>10.1f}{instr*1000:>10.1f}{pgo*1000:>10.1f}{plain / pgo:>8.2f}x")
+
+if __name__ == "__main__":
+    main()
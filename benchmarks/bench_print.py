@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# bench_print.py
+# Buffered Print runtime vs. one printf per line (the C twin in print.c)
+# License: MIT
+
+import os, subprocess, sys, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from plasmascriptc import LLVMBackend, parse_file
+from _timing import best_time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# stdout redirected to a file: stdio is fully buffered, so this isolates the
+# formatting cost. stdbuf -oL makes printf line-buffered as on a terminal,
+# i.e. one write(2) per Print; the PlasmaScript runtime ignores it.
+MODES = {"to file": [], "line-buffered": ["stdbuf", "-oL"]}
+
+def best_to_file(cmd, out_path):
+    def run():
+        with open(out_path, "w") as out: subprocess.run(cmd, stdout=out, check=True)
+    t, _ = best_time(run)
+    with open(out_path) as f: return t, f.read()
+
+def main():
+    level = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    with tempfile.TemporaryDirectory() as d:
+        ps_exe, c_exe, out = os.path.join(d, "print_ps"), os.path.join(d, "print_c"), os.path.join(d, "out.txt")
+        LLVMBackend(parse_file(os.path.join(HERE, "print.ps")), level).compile(ps_exe)
+        subprocess.run(["cc", f"-O{level}", os.path.join(HERE, "print.c"), "-o", c_exe], check=True)
+        for mode, prefix in MODES.items():
+            t_ps, out_ps = best_to_file(prefix + [ps_exe], out)
+            t_c, out_c = best_to_file(prefix + [c_exe], out)
+            if out_ps != out_c: print(f"output mismatch ({mode})")
+            print(f"{mode:<14} PlasmaScript {t_ps*1000:8.1f} ms   printf {t_c*1000:8.1f} ms   ({t_c / t_ps:.2f}x)")
+        print(f"{len(out_ps)} bytes, {len(out_ps) // (1 << 16) + 1} buffered writes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# bench_strength.py
+# Constant-operand lowering: the NASM backend's instruction mix and (on
+# System V hosts) native run time with and without strength reduction, and
+# LLVM builds with and without AST folding
+# License: MIT
+
+import os, sys, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from plasmascriptc import LLVMBackend, NASMBackend, parse_file
+from plasmascriptc_x86 import HOST_ABI, SYSV
+from _timing import best_of
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def nasm_mix(path, reduce):
+    backend = NASMBackend(parse_file(path), 2)
+    backend.strength_reduce = reduce
+    ops = [l.split()[0] for l in backend.build().splitlines() if l.startswith("  ")]
+    return len(ops), ops.count("idiv"), ops.count("imul")
+
+def nasm_time(path, reduce, d):
+    exe = os.path.join(d, f"{os.path.basename(path)}.nasm.{int(reduce)}")
+    backend = NASMBackend(parse_file(path), 2)
+    backend.strength_reduce = reduce
+    backend.compile(exe)
+    return best_of(exe)
+
+def llvm_time(path, level, fold, d):
+    exe = os.path.join(d, f"{os.path.basename(path)}.O{level}.{int(fold)}")
+    backend = LLVMBackend(parse_file(path), level)
+    backend.fold = fold
+    backend.compile(exe)
+    return best_of(exe)
+
+def main():
+    paths = sys.argv[1:] or [os.path.join(HERE, p) for p in ("intloops.ps", "loops.ps", "arith.ps")]
+    print(f"{'program':<16}{'NASM ins':>10}{'idiv':>6}{'imul':>6}   reduced:{'ins':>6}{'idiv':>6}{'imul':>6}")
+    for path in paths:
+        plain, reduced = nasm_mix(path, False), nasm_mix(path, True)
+        print(f"{os.path.basename(path):<16}{plain[0]:>10}{plain[1]:>6}{plain[2]:>6}{'':>12}{reduced[0]:>6}{reduced[1]:>6}{reduced[2]:>6}")
+    with tempfile.TemporaryDirectory() as d:
+        if HOST_ABI is SYSV:   # native NASM builds are Linux executables
+            print()
+            print(f"{'program':<16}{'NASM plain ms':>14}{'reduced ms':>12}")
+            for path in paths:
+                (t_off, out_off), (t_on, out_on) = nasm_time(path, False, d), nasm_time(path, True, d)
+                if out_off != out_on: raise Exception(f"strength reduction changed the output of {path}")
+                print(f"{os.path.basename(path):<16}{t_off*1000:>14.1f}{t_on*1000:>12.1f}")
+        print()
+        print(f"{'program':<16}{'level':>6}{'no fold ms':>12}{'fold ms':>10}")
+        for path in paths:
+            for level in (0, 2):
+                (t_off, out_off), (t_on, out_on) = llvm_time(path, level, False, d), llvm_time(path, level, True, d)
+                if out_off != out_on: raise Exception(f"folding changed the output of {path}")
+                print(f"{os.path.basename(path):<16}{'-O' + str(level):>6}{t_off*1000:>12.1f}{t_on*1000:>10.1f}")
+
+if __name__ == "__main__":
+    main()
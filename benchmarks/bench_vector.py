@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# bench_vector.py
+# Element-wise comprehensions in the NASM backend: how many become AVX2
+# loops, and native run times of scalar vs. AVX2 builds next to LLVM -O2
+# (System V hosts)
+# License: MIT
+
+import os, sys, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from plasmascriptc import LLVMBackend, NASMBackend, parse_file
+from plasmascriptc_x86 import HOST_ABI, SYSV
+from _timing import best_of
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def nasm(path, vectorize):
+    backend = NASMBackend(parse_file(path), 2)
+    backend.vectorize = vectorize
+    return backend
+
+def main():
+    paths = sys.argv[1:] or [os.path.join(HERE, "lists.ps")]
+    print(f"{'program':<16}{'vector loops':>13}{'scalar ins':>12}{'AVX2 ins':>10}")
+    for path in paths:
+        scalar, vector = nasm(path, False), nasm(path, True)
+        scalar.build(); vector.build()
+        print(f"{os.path.basename(path):<16}{vector.stats['vector_loops']:>13}"
+              f"{scalar.stats['instructions']:>12}{vector.stats['instructions']:>10}")
+    if HOST_ABI is not SYSV: return   # the native builds below are Linux executables
+    print()
+    print(f"{'program':<16}{'scalar ms':>10}{'AVX2 ms':>9}{'LLVM ms':>9}")
+    with tempfile.TemporaryDirectory() as d:
+        for path in paths:
+            base = os.path.join(d, os.path.basename(path))
+            nasm(path, False).compile(base + ".scalar")
+            nasm(path, True).compile(base + ".avx2")
+            LLVMBackend(parse_file(path), 2).compile(base + ".llvm")
+            results = [best_of(base + ext) for ext in (".scalar", ".avx2", ".llvm")]
+            if len({out for _, out in results}) != 1: raise Exception(f"builds of {path} disagree")
+            print(f"{os.path.basename(path):<16}" + "".join(f"{t * 1000:>{w}.1f}" for (t, _), w in zip(results, (10, 9, 9))))
+
+if __name__ == "__main__":
+    main()
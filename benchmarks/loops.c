@@ -0,0 +1,27 @@
+/* C twin of loops.ps */
+#include <stdio.h>
+
+static long long lcg(long long n) {
+    long long acc = 0;
+    for (long long i = 0; i < n; i++)
+        acc = (acc * 31 + i) % 1000003;
+    return acc;
+}
+
+static long long collatz_total(long long n) {
+    long long total = 0;
+    for (long long k = 1; k < n; k++) {
+        long long x = k;
+        while (x != 1) {
+            if (x % 2 == 0) x = x / 2; else x = 3 * x + 1;
+            total++;
+        }
+    }
+    return total;
+}
+
+int main(void) {
+    printf("%lld\n", lcg(100000000));
+    printf("%lld\n", collatz_total(1000000));
+    return 0;
+}
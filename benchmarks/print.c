@@ -0,0 +1,11 @@
+/* C twin of print.ps: one printf per Print */
+#include <stdio.h>
+
+int main(void) {
+    for (long long i = 0; i < 2000000; i++) {
+        printf("%lld\n", i);
+        printf("%s\n", "tick");
+        printf("%g\n", i * 0.5);
+    }
+    return 0;
+}
@@ -3,7 +3,9 @@
 # Author: Violet + ChatGPT
 # License: MIT
 
+import sys
 from lark import Lark, Transformer, v_args
+from plasma_timing import active as timing_active, count, phase, runner_args, tree_size
 
 plasma_grammar = r"""
 ?start: statement+
@@ -227,10 +229,16 @@ class PlasmaInterpreter(Transformer):
 parser = Lark(plasma_grammar, start="start", parser="lalr")
 
 def run_plasma(code):
-    tree = parser.parse(code)
-    PlasmaInterpreter().transform(tree)
+    with phase("parse"): tree = parser.parse(code)
+    if timing_active(): count(ast_nodes=tree_size(tree))
+    with phase("run"): PlasmaInterpreter().transform(tree)
 
 if __name__ == "__main__":
+    args = runner_args("plasma_interpreter.py")
+    if args.infile:
+        with open(args.infile) as f: run_plasma(f.read())
+        sys.exit()
+
     code = '''
     ; PlasmaScript demo
 
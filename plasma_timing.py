@@ -0,0 +1,165 @@
+# plasma_timing.py
+# PlasmaScript --time-report — wall time, CPU time and peak memory per
+# compiler phase, plus size counts, for plasmascriptc and the VM runners
+# License: MIT
+
+import argparse, atexit, json, os, sys, time
+from contextlib import contextmanager
+try:
+    import resource   # peak RSS; not on Windows, where memory shows as n/a
+except ImportError:
+    resource = None
+
+# Phases are recorded into one process-wide report, like clang's
+# -ftime-report timers, so deep code (LLVMBackend.build, the assembler
+# driver, a VM's compile_and_run) only has to name its phase. Without
+# --time-report, REPORT is None and phase()/count() cost a function call.
+#
+# CPU time includes child processes (clang/gcc/ld, nasm), which is where an
+# external tool's time goes. Peak memory is this process's RSS high-water
+# mark when the phase ends, so a phase that set a new peak shows growth.
+# Children's peaks aren't reported: Linux counts the forked copy of the
+# compiler in them, so a small ld looks as big as we are.
+#
+# Parallel builds compile modules in pool workers. Each job records into a
+# worker report, take()s it, and the parent merge()s it: those phases are
+# listed apart, since workers overlap each other and the parent's own wall.
+REPORT = None
+
+def _maxrss_kib(who):
+    if resource is None: return None
+    rss = resource.getrusage(who).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss   # bytes on macOS
+
+def _cpu():
+    if resource is None:
+        t = os.times()
+        return time.process_time() + t.children_user + t.children_system
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+class TimeReport:
+    def __init__(self, tool):
+        self.tool = tool
+        self.phases = {}   # name -> totals, in the order phases first ran
+        self.counts = {}
+        self.worker_phases = {}   # the same, summed over pool workers
+        self.workers = set()      # their pids
+        self.start_wall, self.start_cpu = time.perf_counter(), _cpu()
+
+    def add(self, name, wall, cpu):
+        p = self.phases.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0})
+        p["calls"] += 1
+        p["wall_s"] += wall
+        p["cpu_s"] += cpu
+        p["peak_kib"] = _maxrss_kib(resource.RUSAGE_SELF) if resource else None
+
+    def merge(self, worker):
+        self.workers.add(worker["pid"])
+        for name, w in worker["phases"].items():
+            p = self.worker_phases.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_kib": None})
+            for k in ("calls", "wall_s", "cpu_s"): p[k] += w[k]
+            if w["peak_kib"]: p["peak_kib"] = max(p["peak_kib"] or 0, w["peak_kib"])
+        for k, v in worker["counts"].items(): self.counts[k] = self.counts.get(k, 0) + v
+
+    def as_dict(self):
+        wall = time.perf_counter() - self.start_wall
+        return {"tool": self.tool,
+                "wall_s": wall,
+                "unattributed_s": wall - sum(p["wall_s"] for p in self.phases.values()),
+                "cpu_s": _cpu() - self.start_cpu,
+                "peak_kib": _maxrss_kib(resource.RUSAGE_SELF) if resource else None,
+                "phases": [{"phase": name, **p} for name, p in self.phases.items()],
+                "workers": len(self.workers),
+                "worker_phases": [{"phase": name, **p} for name, p in self.worker_phases.items()],
+                "counts": dict(self.counts)}
+
+    def text(self):
+        d = self.as_dict()
+        mib = lambda kib: f"{kib / 1024:>10.1f}" if kib else f"{'n/a':>10}"
+        row = lambda p: (f"{p['phase']:<16}{p['calls']:>6}{p['wall_s'] * 1000:>10.1f}{p['cpu_s'] * 1000:>10.1f}"
+                         f"{p['wall_s'] / d['wall_s'] * 100 if d['wall_s'] else 0.0:>7.1f}%{mib(p['peak_kib'])}")
+        lines = [f"{d['tool']} time report",
+                 f"{'phase':<16}{'calls':>6}{'wall ms':>10}{'cpu ms':>10}{'wall %':>8}{'peak MiB':>10}"]
+        lines += [row(p) for p in d["phases"]]
+        other = d["unattributed_s"] / d["wall_s"] * 100 if d["wall_s"] else 0.0
+        lines.append(f"{'(other)':<16}{'':>6}{d['unattributed_s'] * 1000:>10.1f}{'':>10}{other:>7.1f}%")
+        lines.append(f"{'total':<16}{'':>6}{d['wall_s'] * 1000:>10.1f}{d['cpu_s'] * 1000:>10.1f}{'':>8}{mib(d['peak_kib'])}")
+        if d["worker_phases"]:
+            lines.append(f"in {d['workers']} worker process{'es' if d['workers'] > 1 else ''}, overlapping the above "
+                         "(cpu ms is theirs alone, peak MiB the largest worker's):")
+            lines += [row(p) for p in d["worker_phases"]]
+        if d["counts"]:
+            lines.append("counts: " + ", ".join(f"{k} {v}" for k, v in d["counts"].items()))
+        return "\n".join(lines)
+
+@contextmanager
+def phase(name):
+    if REPORT is None:
+        yield
+        return
+    wall, cpu = time.perf_counter(), _cpu()
+    try:
+        yield
+    finally:
+        REPORT.add(name, time.perf_counter() - wall, _cpu() - cpu)
+
+def count(**counts):
+    """Add to the report's counts; repeated phases (one per module) sum up."""
+    if REPORT is None: return
+    for k, v in counts.items(): REPORT.counts[k] = REPORT.counts.get(k, 0) + v
+
+def active():
+    return REPORT is not None
+
+def enable(tool, text=True, json_path=None):
+    """Start the process-wide report and print it when the process exits:
+    a table on stderr, and/or JSON to json_path ("-" for stdout)."""
+    global REPORT
+    REPORT = report = TimeReport(tool)
+    def finish():
+        if text: print(report.text(), file=sys.stderr)
+        if json_path == "-": print(json.dumps(report.as_dict()))
+        elif json_path:
+            with open(json_path, "w") as f: json.dump(report.as_dict(), f, indent=1)
+    atexit.register(finish)
+    return report
+
+def start_worker():
+    """In a pool worker, record into a fresh report that is never printed. A
+    forked worker would otherwise add to its copy of the parent's."""
+    global REPORT
+    REPORT = TimeReport(None)
+
+def take():
+    """This worker's phases and counts since the last take(), for merge()."""
+    worker = {"pid": os.getpid(), "phases": REPORT.phases, "counts": REPORT.counts}
+    REPORT.phases, REPORT.counts = {}, {}
+    return worker
+
+def merge(worker):
+    if REPORT is not None: REPORT.merge(worker)
+
+def add_arguments(ap):
+    ap.add_argument("--time-report", action="store_true",
+                    help="print wall time, CPU time and peak memory per phase on stderr when done")
+    ap.add_argument("--time-report-json", metavar="FILE",
+                    help="write the time report as JSON to FILE ('-' for stdout)")
+
+def enable_from(args, tool):
+    if args.time_report or args.time_report_json:
+        enable(tool, text=args.time_report, json_path=args.time_report_json)
+
+def runner_args(tool, argv=None):
+    """Command line of the VM runners: an optional program to run in place of
+    the built-in samples, and the --time-report flags."""
+    ap = argparse.ArgumentParser(prog=tool, usage=f"{tool} [file.ps] [--time-report] [--time-report-json FILE]")
+    ap.add_argument("infile", nargs="?", help="run this program instead of the built-in samples")
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+    enable_from(args, tool)
+    return args
+
+def tree_size(tree):
+    """Nodes of a Lark parse tree."""
+    return sum(1 for _ in tree.iter_subtrees())
@@ -3,7 +3,9 @@
 # Author: Violet + ChatGPT
 # License: MIT
 
+import sys
 from lark import Lark, Transformer
+from plasma_timing import active as timing_active, count, phase, runner_args, tree_size
 
 # -------------------------
 # 1. Grammar
@@ -322,13 +324,19 @@ class PlasmaVM:
 parser = Lark(plasma_grammar, start="start", parser="lalr")
 
 def compile_and_run(code):
-    tree = parser.parse(code)
+    with phase("parse"): tree = parser.parse(code)
     compiler = Compiler()
-    compiler.transform(tree)
+    with phase("compile"): compiler.transform(tree)
+    if timing_active(): count(ast_nodes=tree_size(tree), bytecode=len(compiler.bytecode), constants=len(compiler.consts))
     vm = PlasmaVM(compiler.consts, compiler.bytecode)
-    vm.run()
+    with phase("run"): vm.run()
 
 if __name__ == "__main__":
+    args = runner_args("plasma_vm_comprehensions.py")
+    if args.infile:
+        with open(args.infile) as f: compile_and_run(f.read())
+        sys.exit()
+
     code = '''
     let numbers = [1, 2, 3, 4, 5]
 
@@ -4,42 +4,57 @@
 # Author: Violet + ChatGPT
 # License: MIT
 
-import os, subprocess, sys
+import argparse, ctypes, ctypes.util, math, os, subprocess, sys, tempfile, time
 import llvmlite.ir as ir
 import llvmlite.binding as llvm
-from lark import Lark, Transformer
+from lark import Lark, Transformer, Tree
+from plasmascriptc_runtime import REGION_P, RUNTIME_FUNCS, RUNTIME_SIGS, runtime_ir
+from plasmascriptc_pgo import add_profile_summary, annotate_function, emit_profile_writer, instrument_function, load_profile
+from plasmascriptc_elf import DEFAULT_ASSEMBLER, write_object
+from plasma_timing import active as timing_active, add_arguments as add_timing_arguments, count, enable_from as enable_timing, phase
+from plasmascriptc_peephole import peephole
+from plasmascriptc_x86 import (ABIS, AVX2_CHECK, AVX2_STATE, CC, AsmStream, HOST_ABI, NEGATE, Addr, Ins, Label, VReg, allocate, db, fits_imm32,
+                              print_function, signed_magic, stats as asm_stats)
 
 # -------------------------
 # Grammar
 # -------------------------
 plasma_grammar = r"""
 ?start: program
-?program: (statement)+
+program: (statement)+
 
-?statement: comment
-          | import_stmt
+?statement: import_stmt
           | extern_stmt
           | export_func
           | func_def
           | inline_dgm
           | var_decl
+          | assign_stmt
           | print_stmt
+          | if_stmt
+          | for_stmt
+          | while_stmt
           | return_stmt
           | end_stmt
           | expr
 
-comment: ";" /[^\n]/*
-
 import_stmt: "Import" STRING
 extern_stmt: "Extern" STRING "Func" NAME "(" [params] ")"    -> extern_decl
 export_func: "Export" "Func" NAME "(" [params] ")" block     -> export_def
 
-var_decl: "let" NAME "=" expr
+var_decl: "let" NAME [":" NAME] "=" expr
+assign_stmt: NAME "=" expr
 print_stmt: "Print" "[" expr "]"
 
-func_def: ("Prog"|"Main"|"Func") NAME? "(" [params] ")" block
-params: NAME (":" NAME)? ("," NAME (":" NAME)?)*
+func_def: func_kw [NAME] "(" [params] ")" block
+        | "Func" NAME "(" [params] ")" block  -> named_func
+!func_kw: "Prog" | "Main"
+params: param ("," param)*
+param: NAME [":" NAME]
 
+if_stmt: "if" expr block ["else" (block | if_stmt)]
+for_stmt: "for" NAME "in" expr block
+while_stmt: "while" expr block
 return_stmt: "return" expr
 end_stmt: "end" | "run"
 
@@ -48,202 +63,2235 @@ dgm_call: "dgm" "(" args ")"
 
 block: "{" statement* "}"
 
-?expr: atom
-     | expr OP expr   -> binop
-     | "-" expr       -> neg
-     | func_call
-     | tuple_lit
+?expr: sum
+     | expr comp_op sum   -> binop
+?sum: product
+    | sum add_op product  -> binop
+?product: unary
+        | product mul_op unary -> binop
+?unary: atom
+      | "-" unary       -> neg
+      | func_call
+      | tuple_lit
+      | lambda
+      | "(" expr ")"
+      | unary "[" expr "]" -> index
 
 func_call: NAME "(" [args] ")"
+lambda: "Func" "(" [params] ")" block -> lambda_expr
 args: expr ("," expr)*
 
 ?atom: NUMBER        -> number
      | STRING        -> string
      | NAME          -> var
      | list_lit
+     | list_comp
      | "true"        -> true
      | "false"       -> false
 
 list_lit: "[" [args] "]"
-tuple_lit: "(" args ")" -> tuple_expr
+list_comp: "[" expr "for" NAME "in" expr ["if" expr] "]"
+tuple_lit: "(" expr "," args ")" -> tuple_expr
 
-OP: "==" | "!=" | "<" | ">" | "<=" | ">=" | "+" | "-" | "*" | "/" | "%"
+!comp_op: "==" | "!=" | "<=" | ">=" | "<" | ">"
+!add_op: "+" | "-"
+!mul_op: "*" | "/" | "%"
 
 NAME: /[a-zA-Z_][a-zA-Z0-9_]*/
 STRING: ESCAPED_STRING
-NUMBER: /\d+/
+NUMBER: /0[xX][0-9a-fA-F]+|\d+\.\d+|\d+/
+COMMENT: /;[^\n]*/
 
 %import common.ESCAPED_STRING
 %import common.WS
 %ignore WS
+%ignore COMMENT
 """
 
 # -------------------------
 # AST Nodes
 # -------------------------
-class ImportNode: 
+class ImportNode:
     def __init__(self, lib): self.lib = lib.strip('"')
 class ExternNode:
     def __init__(self, linkage, name, params): self.linkage, self.name, self.params = linkage, name, params
-class ExportFuncNode:
-    def __init__(self, name, params, body): self.name, self.params, self.body = name, params, body
 class InlineDgmNode:
     def __init__(self, codes): self.codes = codes
 class FuncNode:
-    def __init__(self, name, params, body): self.name, self.params, self.body = name, params, body
+    def __init__(self, name, params, body, export=False):
+        self.name, self.params, self.body, self.export = name, params, body, export
 class PrintNode:
     def __init__(self, expr): self.expr = expr
 class ReturnNode:
     def __init__(self, expr): self.expr = expr
+class LetNode:
+    def __init__(self, name, annot, expr): self.name, self.annot, self.expr = name, annot, expr
+class AssignNode:
+    def __init__(self, name, expr): self.name, self.expr = name, expr
+class IfNode:
+    def __init__(self, cond, then_body, else_body): self.cond, self.then_body, self.else_body = cond, then_body, else_body
+class ForNode:
+    def __init__(self, var, iterable, body): self.var, self.iterable, self.body = var, iterable, body
+class WhileNode:
+    def __init__(self, cond, body): self.cond, self.body = cond, body
+
+class NumberNode:
+    def __init__(self, value): self.value = value
+class StringNode:
+    def __init__(self, value): self.value = value
+class BoolNode:
+    def __init__(self, value): self.value = value
+class VarNode:
+    def __init__(self, name): self.name = name
+class BinOpNode:
+    def __init__(self, left, op, right): self.left, self.op, self.right = left, op, right
+class NegNode:
+    def __init__(self, expr): self.expr = expr
+class CallNode:
+    def __init__(self, name, args): self.name, self.args = name, args
+class TupleNode:
+    def __init__(self, items): self.items = items
+class LambdaNode:
+    def __init__(self, params, body):
+        self.params, self.body = params, body
+        self.name, self.captures, self.escapes = None, [], True   # filled in by lift_lambdas
+class ListNode:
+    def __init__(self, items): self.items = items
+class ListCompNode:
+    def __init__(self, expr, var, source, cond): self.expr, self.var, self.source, self.cond = expr, var, source, cond
+class IndexNode:
+    def __init__(self, target, index): self.target, self.index = target, index
 
 # -------------------------
 # Transformer
 # -------------------------
+def _unescape(tok):
+    return bytes(str(tok)[1:-1], "utf8").decode("unicode_escape")
+
 class PlasmaTransformer(Transformer):
     def import_stmt(self, items): return ImportNode(str(items[0]))
     def extern_decl(self, items):
-        return ExternNode(str(items[0]).strip('"'), str(items[1]), [str(x) for x in items[2:]])
+        return ExternNode(str(items[0]).strip('"'), str(items[1]), items[2] or [])
     def export_def(self, items):
-        return ExportFuncNode(str(items[0]), [], items[-1])
+        return FuncNode(str(items[0]), items[1] or [], items[-1], export=True)
+    def func_kw(self, items): return str(items[0])
     def func_def(self, items):
-        kw = str(items[0])
-        name = "main" if kw in ("Prog","Main") else str(items[1])
-        body = items[-1]
-        return FuncNode(name, [], body)
+        _, _, params, body = items
+        return FuncNode("main", params or [], body)
+    def named_func(self, items): return FuncNode(str(items[0]), items[1] or [], items[2])
+    def params(self, items): return list(items)
+    def param(self, items): return (str(items[0]), str(items[1]) if items[1] else None)
+    def args(self, items): return list(items)
+    def var_decl(self, items):
+        return LetNode(str(items[0]), str(items[1]) if items[1] else None, items[2])
+    def assign_stmt(self, items): return AssignNode(str(items[0]), items[1])
+    def if_stmt(self, items):
+        cond, then, other = items
+        if other is None: other = []
+        elif isinstance(other, IfNode): other = [other]
+        else: other = other.children
+        return IfNode(cond, then.children, other)
+    def for_stmt(self, items): return ForNode(str(items[0]), items[1], items[2].children)
+    def while_stmt(self, items): return WhileNode(items[0], items[1].children)
     def print_stmt(self, items): return PrintNode(items[0])
     def return_stmt(self, items): return ReturnNode(items[0])
     def inline_dgm(self, items):
         codes = []
         for d in items: codes.extend(d)
         return InlineDgmNode(codes)
-    def dgm_call(self, items): return [int(str(x)) for x in items]
+    def dgm_call(self, items): return [n.value for n in items[0]]
+
+    def number(self, items):
+        s = str(items[0])
+        if "." in s: return NumberNode(float(s))
+        return NumberNode(int(s, 16) if s[:2] in ("0x","0X") else int(s))
+    def string(self, items): return StringNode(_unescape(items[0]))
+    def true(self, _): return BoolNode(True)
+    def false(self, _): return BoolNode(False)
+    def var(self, items): return VarNode(str(items[0]))
+    def binop(self, items): return BinOpNode(items[0], items[1], items[2])
+    def add_op(self, items): return str(items[0])
+    mul_op = comp_op = add_op
+    def neg(self, items): return NegNode(items[0])
+    def func_call(self, items): return CallNode(str(items[0]), items[1] or [])
+    def tuple_expr(self, items): return TupleNode([items[0]] + items[1])
+    def lambda_expr(self, items): return LambdaNode(items[0] or [], items[1])
+    def list_lit(self, items): return ListNode(items[0] or [])
+    def list_comp(self, items): return ListCompNode(items[0], str(items[1]), items[2], items[3])
+    def index(self, items): return IndexNode(items[0], items[1])
+
+# -------------------------
+# Reachability (dead function elimination)
+# -------------------------
+def iter_nodes(node):
+    yield node
+    children = node.children if isinstance(node, Tree) else vars(node).values()
+    for c in children:
+        for x in (c if isinstance(c, list) else [c]):
+            if isinstance(x, Tree) or (hasattr(x, "__dict__") and not isinstance(x, str)):
+                yield from iter_nodes(x)
+
+def tree_shake(ast, interfaces=None):
+    """Drop functions, externs and imports not reachable from main or an Export.
+    Returns the kept nodes and the names that were dropped."""
+    interfaces = interfaces or {}
+    funcs = {n.name: n for n in ast if isinstance(n, FuncNode)}
+    work = [n.name for n in funcs.values() if n.export or n.name == "main"]
+    seen = set()
+    while work:
+        name = work.pop()
+        if name in seen: continue
+        seen.add(name)
+        if name in funcs:   # calls, and functions referenced as values
+            work.extend(n.name for n in iter_nodes(funcs[name].body) if isinstance(n, (CallNode, VarNode)))
+    # Native libraries carry no symbol list, so they stay only while some Extern is still live.
+    externs_live = any(isinstance(n, ExternNode) and n.name in seen for n in ast)
+    kept, dropped = [], []
+    for n in ast:
+        if isinstance(n, (FuncNode, ExternNode)) and n.name not in seen:
+            dropped.append(n.name)
+        elif isinstance(n, ImportNode) and n.lib in interfaces and not seen & set(interfaces[n.lib]["exports"]):
+            dropped.append(n.lib)
+        elif isinstance(n, ImportNode) and n.lib not in interfaces and not externs_live:
+            dropped.append(f"-l{n.lib}")
+        else:
+            kept.append(n)
+    return kept, dropped
+
+# -------------------------
+# map() inlining
+# -------------------------
+# map(xs, Func (x) { return e }) is the VMs' list builtin. With a lambda
+# that is just one return it means [e for x in xs], so both backends compile
+# it as that comprehension, element-wise loops included; x is renamed so it
+# can't clash with the caller's variables. Any other map stays a call.
+def _inline_map(node, count):
+    for k, v in list(vars(node).items()):
+        if isinstance(v, Tree): v.children = [_inline_map(x, count) for x in v.children]
+        elif isinstance(v, list): setattr(node, k, [_inline_map(x, count) if hasattr(x, "__dict__") else x for x in v])
+        elif hasattr(v, "__dict__") and not isinstance(v, str): setattr(node, k, _inline_map(v, count))
+    if not (isinstance(node, CallNode) and node.name == "map" and len(node.args) == 2): return node
+    lst, lam = node.args
+    if not isinstance(lam, LambdaNode) or len(lam.params) != 1: return node
+    body, (param, _) = lam.body.children, lam.params[0]
+    if len(body) != 1 or not isinstance(body[0], ReturnNode): return node
+    if any(isinstance(n, LambdaNode) or isinstance(n, CallNode) and n.name == param for n in iter_nodes(body[0].expr)):
+        return node
+    var = f"__map{count[0]}"
+    count[0] += 1
+    for n in iter_nodes(body[0].expr):
+        if isinstance(n, VarNode) and n.name == param: n.name = var
+    return ListCompNode(body[0].expr, var, lst, None)
+
+def inline_maps(ast):
+    """Rewrite map calls over one-return lambdas in place; returns how many."""
+    if any(isinstance(n, (FuncNode, ExternNode)) and n.name == "map" for n in ast): return 0
+    count = [0]
+    for n in ast:
+        if isinstance(n, FuncNode): _inline_map(n, count)
+    return count[0]
+
+# -------------------------
+# Closures (lambda lifting and escape analysis)
+# -------------------------
+# Every Func(...) { } expression becomes a top-level function that takes its
+# environment (the captured variables, copied by value like the VMs do) as a
+# leading pointer. The environment lives on the creating function's stack
+# unless the closure escapes: returned, passed or copied anywhere, or
+# referenced from another lambda. Escaping environments, and those that
+# capture closures, are malloc'd and reference-counted (see _lifetime).
+def scan(node):
+    """Like iter_nodes, but yields a nested LambdaNode without entering it."""
+    yield node
+    if isinstance(node, LambdaNode): return
+    children = node.children if isinstance(node, Tree) else vars(node).values()
+    for c in children:
+        for x in (c if isinstance(c, list) else [c]):
+            if isinstance(x, Tree) or (hasattr(x, "__dict__") and not isinstance(x, str)):
+                yield from scan(x)
+
+def _scope_names(params, body):
+    names = {p for p, _ in params}
+    for n in list(scan(body))[1:]:
+        if isinstance(n, (LetNode, AssignNode)): names.add(n.name)
+        elif isinstance(n, (ForNode, ListCompNode)): names.add(n.var)
+    return names
+
+def _free_names(lam):
+    used = set()
+    for n in list(scan(lam.body))[1:]:
+        if isinstance(n, (VarNode, CallNode, AssignNode)): used.add(n.name)
+        elif isinstance(n, LambdaNode): used |= _free_names(n)
+    return used - _scope_names(lam.params, lam.body)
+
+def lift_lambdas(ast, prefix):
+    """Name every lambda, record its captures and whether it escapes, and
+    append one FuncNode per lambda to the program."""
+    lifted, work = [], [(n, set()) for n in ast if isinstance(n, FuncNode)]
+    while work:
+        func, captured = work.pop()
+        scope = _scope_names(func.params, func.body) | captured
+        nodes = list(scan(func.body))[1:]
+        lambdas = [n for n in nodes if isinstance(n, LambdaNode)]
+        if not lambdas: continue
+        bound = {id(n.expr): n.name for n in nodes if isinstance(n, (LetNode, AssignNode)) and isinstance(n.expr, LambdaNode)}
+        values = {n.name for n in nodes if isinstance(n, VarNode)}
+        nested = set().union(*(_free_names(lam) for lam in lambdas))
+        for lam in lambdas:
+            lam.name = f"{prefix}lambda{len(lifted)}"
+            lam.captures = sorted(_free_names(lam) & scope)
+            var = bound.get(id(lam))
+            lam.escapes = var is None or var in values or var in nested
+            node = FuncNode(lam.name, lam.params, lam.body)
+            node.captures = lam.captures
+            lifted.append(node)
+            work.append((node, set(lam.captures)))
+    ast.extend(lifted)
+    return lifted
+
+# -------------------------
+# Type Inference
+# -------------------------
+# Flow-based: every variable, parameter and return value holds a type from
+# the lattice below; uses only ever widen it (int -> float), so iterating the
+# program until nothing changes reaches a fixed point. Tuples are Python
+# tuples of element types; lists are "list:<elt>" over a numeric element
+# type; function values are "fn:a|b", the set of functions they may hold,
+# whose signatures are unified. Slots nobody constrains default to "int".
+ANNOTATIONS = {"number": "int", "text": "text", "bool": "bool", "ptr": "ptr", "rc": "rc", "rc_shared": "rc_shared"}
+C_ANNOTATIONS = {"f32": "float", "f64": "float"}   # Extern "C" parameters only; see C_WIDTHS
+NUMERIC = ("bool", "int", "float")
+COMPARE_OPS = ("==", "!=", "<", ">", "<=", ">=")
+BUILTINS = ("len", "sum")
+# Raw memory, region allocators and refcounted objects: name -> (parameter
+# types, result). "word" is anything that fits a 64-bit slot; refcounted
+# objects are pointers too, and rc_shared ones count atomically.
+POINTERS = ("ptr", "rc", "rc_shared")
+MEMORY_BUILTINS = {
+    "malloc": (("int",), "ptr"), "free": (("ptr",), "int"),
+    "store": (("ptr", "int", "word"), "int"), "load": (("ptr", "int"), "int"), "load_ptr": (("ptr", "int"), "ptr"),
+    "arena_init": (("int",), "arena"), "arena_alloc": (("arena", "int"), "ptr"), "arena_reset": (("arena",), "int"),
+    "bump_init": (("int",), "bump"), "bump_alloc": (("bump", "int"), "ptr"), "bump_reset": (("bump",), "int"),
+    "rc_alloc": (("int",), "rc"), "rc_alloc_shared": (("int",), "rc_shared"),
+    "retain": (("rc",), "int"), "release": (("rc",), "int"),
+}
+
+def is_range(e):
+    return isinstance(e, CallNode) and e.name == "range" and 1 <= len(e.args) <= 3
+
+def list_of(elt):
+    if elt is None: return None
+    if elt not in NUMERIC: raise NotImplementedError(f"native lists hold numbers or bools, not {elt}")
+    return f"list:{elt}"
+
+def elem_type(t):
+    return t[5:] if isinstance(t, str) and t.startswith("list:") else None
+
+def is_fn(t):
+    return isinstance(t, str) and t.startswith("fn:")
+
+def has_closure(t):
+    return is_fn(t) or (isinstance(t, tuple) and any(has_closure(x) for x in t))
+
+def fn_members(t):
+    return t[3:].split("|")
+
+def join_types(a, b):
+    if a is None: return b
+    if b is None or a == b: return a
+    if a in NUMERIC and b in NUMERIC:
+        return max(a, b, key=NUMERIC.index)
+    if isinstance(a, tuple) and isinstance(b, tuple) and len(a) == len(b):
+        return tuple(join_types(x, y) for x, y in zip(a, b))
+    if is_fn(a) and is_fn(b):
+        return "fn:" + "|".join(sorted(set(fn_members(a)) | set(fn_members(b))))
+    raise Exception(f"Type error: cannot unify {a} with {b}")
+
+def type_from_json(t):
+    return tuple(type_from_json(x) for x in t) if isinstance(t, list) else t
+
+def _default(t):
+    if t is None: return "int"
+    if isinstance(t, tuple): return tuple(_default(x) for x in t)
+    return t
+
+class TypeInference:
+    def __init__(self, ast, interfaces=()):
+        self.ast = ast
+        self.funcs = {n.name: n for n in ast if isinstance(n, (FuncNode, ExternNode))}
+        self.vars = {name: {} for name in self.funcs}   # fname -> {var: type}
+        self.rets = {name: None for name in self.funcs}
+        self.imported = {}   # fname -> ([param types], ret), fixed by the exporting module
+        self.foreign = {}    # closure members defined in an imported module, same shape
+        for iface in interfaces:
+            for table, sigs in ((self.imported, iface["exports"]), (self.foreign, iface.get("closures", {}))):
+                for fname, sig in sigs.items():
+                    table[fname] = ([type_from_json(t) for t in sig["params"]], type_from_json(sig["ret"]))
+        self.fn_types = set()
+        self.changed = False
+
+    def run(self):
+        for name, node in self.funcs.items():
+            for pname, annot in node.params:
+                self.vars[name][pname] = self._annot(annot, isinstance(node, ExternNode))
+            for c in getattr(node, "captures", ()): self.vars[name].setdefault(c, None)
+        self.changed = True
+        while self.changed:
+            self.changed = False
+            for name, node in self.funcs.items():
+                if isinstance(node, FuncNode): self._block(name, node.body.children)
+            for t in list(self.fn_types): self._unify(t)
+        for name in self.funcs:
+            self.vars[name] = {k: _default(t) for k, t in self.vars[name].items()}
+            if isinstance(self.funcs[name], FuncNode): self.rets[name] = _default(self.rets[name])
+        if "main" in self.rets: self.rets["main"] = "int"
+        for name, node in self.funcs.items():
+            if isinstance(node, FuncNode): self._block(name, node.body.children)
+        return self
+
+    def param_types(self, name):
+        return [self.vars[name][p] for p, _ in self.funcs[name].params]
+
+    def sig(self, name):
+        if name in self.funcs: return self.param_types(name), self.rets[name]
+        if name in self.imported: return self.imported[name]
+        if name in self.foreign: return self.foreign[name]
+        raise Exception(f"Undefined function {name}")
+
+    def _unify(self, t):
+        # Every function a value may hold gets the same signature, so a call
+        # through it has one calling convention.
+        sigs = [self.sig(m) for m in fn_members(t)]
+        if len({len(p) for p, _ in sigs}) > 1: raise Exception(f"Type error: {t} mixes functions of different arity")
+        params = [None] * len(sigs[0][0])
+        ret = None
+        for ps, r in sigs:
+            params = [join_types(a, b) for a, b in zip(params, ps)]
+            ret = join_types(ret, r)
+        for m, (ps, r) in zip(fn_members(t), sigs):
+            if m not in self.funcs:
+                if (list(ps), r) != (params, ret): raise Exception(f"Type error: {m} does not fit {t}")
+                continue
+            for (pname, _), p in zip(self.funcs[m].params, params): self._widen(self.vars[m], pname, p)
+            if ret != self.rets[m]:
+                self.rets[m] = ret; self.changed = True
+
+    def _annot(self, annot, extern=False):
+        if annot is None: return None
+        if extern and annot in C_ANNOTATIONS: return C_ANNOTATIONS[annot]
+        if annot not in ANNOTATIONS: raise Exception(f"Unknown type annotation {annot}")
+        return ANNOTATIONS[annot]
+
+    def _widen(self, slots, key, t):
+        new = join_types(slots.get(key), t)
+        if is_fn(new): self.fn_types.add(new)
+        if new != slots.get(key):
+            slots[key] = new
+            self.changed = True
+
+    def _block(self, fname, stmts):
+        for stmt in stmts:
+            if isinstance(stmt, LetNode):
+                self.vars[fname].setdefault(stmt.name, None)
+                self._widen(self.vars[fname], stmt.name, self._annot(stmt.annot))
+                self._widen(self.vars[fname], stmt.name, self._expr(fname, stmt.expr))
+            elif isinstance(stmt, ReturnNode):
+                t = self._expr(fname, stmt.expr)
+                new = join_types(self.rets[fname], t)
+                if new != self.rets[fname]:
+                    self.rets[fname] = new; self.changed = True
+            elif isinstance(stmt, AssignNode):
+                if stmt.name not in self.vars[fname]: raise Exception(f"Assignment to undeclared variable {stmt.name}")
+                self._widen(self.vars[fname], stmt.name, self._expr(fname, stmt.expr))
+            elif isinstance(stmt, PrintNode):
+                self._expr(fname, stmt.expr)
+            elif isinstance(stmt, IfNode):
+                self._expr(fname, stmt.cond)
+                self._block(fname, stmt.then_body)
+                self._block(fname, stmt.else_body)
+            elif isinstance(stmt, WhileNode):
+                self._expr(fname, stmt.cond)
+                self._block(fname, stmt.body)
+            elif isinstance(stmt, ForNode):
+                self._bind_iter(fname, stmt.var, stmt.iterable)
+                self._block(fname, stmt.body)
+            elif not isinstance(stmt, (InlineDgmNode, ImportNode)):
+                self._expr(fname, stmt)
+
+    def _bind_iter(self, fname, var, iterable):
+        # Loop and comprehension variables live in the enclosing function's scope.
+        self.vars[fname].setdefault(var, None)
+        if is_range(iterable):
+            for arg in iterable.args:
+                if self._expr(fname, arg) not in ("int", "bool", None):
+                    raise Exception(f"Type error: range() bounds must be integers, got {arg.type}")
+            self._widen(self.vars[fname], var, "int")
+            return
+        t = self._expr(fname, iterable)
+        if t is not None and elem_type(t) is None:
+            raise NotImplementedError(f"can only iterate over range(...) or a list, not {t}")
+        self._widen(self.vars[fname], var, elem_type(t))
+
+    def _expr(self, fname, e):
+        e.type = t = self._expr_type(fname, e)
+        if is_fn(t): self.fn_types.add(t)
+        return t
+
+    def _expr_type(self, fname, e):
+        if isinstance(e, NumberNode): return "float" if isinstance(e.value, float) else "int"
+        if isinstance(e, StringNode): return "text"
+        if isinstance(e, BoolNode): return "bool"
+        if isinstance(e, VarNode):
+            if e.name in self.vars[fname]: return self.vars[fname][e.name]
+            if isinstance(self.funcs.get(e.name), FuncNode) and e.name != "main" or e.name in self.imported:
+                return f"fn:{e.name}"   # a function used as a value
+            raise Exception(f"Undefined variable {e.name}")
+        if isinstance(e, LambdaNode):
+            for c in e.captures: self._widen(self.vars[e.name], c, self.vars[fname][c])
+            return f"fn:{e.name}"
+        if isinstance(e, NegNode): return self._expr(fname, e.expr)
+        if isinstance(e, TupleNode): return tuple(self._expr(fname, x) for x in e.items)
+        if isinstance(e, ListNode):
+            elt = None
+            for x in e.items: elt = join_types(elt, self._expr(fname, x))
+            return list_of(elt) if e.items else "list:int"
+        if isinstance(e, ListCompNode):
+            self._bind_iter(fname, e.var, e.source)
+            if e.cond is not None: self._expr(fname, e.cond)
+            return list_of(self._expr(fname, e.expr))
+        if isinstance(e, IndexNode):
+            t, i = self._expr(fname, e.target), self._expr(fname, e.index)
+            if i not in ("int", "bool", None): raise Exception(f"Type error: list index must be an integer, got {i}")
+            if t is not None and elem_type(t) is None: raise Exception(f"Type error: cannot index {t}")
+            return elem_type(t)
+        if isinstance(e, CallNode) and e.name in MEMORY_BUILTINS and e.name not in self.funcs:
+            params, ret = MEMORY_BUILTINS[e.name]
+            if len(e.args) != len(params):
+                raise Exception(f"{e.name} expects {len(params)} arguments, got {len(e.args)}")
+            for p, arg in zip(params, e.args):
+                t = self._expr(fname, arg)
+                allowed = {"word": ("int", "bool") + POINTERS, "int": ("int", "bool"),
+                           "ptr": POINTERS, "rc": ("rc", "rc_shared")}.get(p, (p,))
+                if t not in allowed + (None,): raise Exception(f"Type error: {e.name} expects {p}, got {t}")
+            return ret
+        if isinstance(e, CallNode) and e.name in BUILTINS and e.name not in self.funcs:
+            if len(e.args) != 1: raise Exception(f"{e.name} expects 1 argument, got {len(e.args)}")
+            t = self._expr(fname, e.args[0])
+            if t is not None and elem_type(t) is None: raise Exception(f"Type error: {e.name} expects a list, got {t}")
+            if e.name == "len" or t is None: return "int"
+            return "int" if elem_type(t) == "bool" else elem_type(t)
+        if isinstance(e, BinOpNode):
+            l, r = self._expr(fname, e.left), self._expr(fname, e.right)
+            if e.op in COMPARE_OPS:
+                join_types(l, r)
+                return "bool"
+            if e.op == "+" and "text" in (l, r):
+                join_types(l, r)
+                return "text"
+            t = join_types(l, r)
+            if t not in NUMERIC + (None,): raise Exception(f"Type error: {t} {e.op} {t}")
+            return "int" if t == "bool" else t
+        if isinstance(e, CallNode) and e.name in self.vars[fname]:
+            t = self.vars[fname][e.name]
+            for arg in e.args: self._expr(fname, arg)
+            if t is None: return None
+            if not is_fn(t): raise Exception(f"Type error: {e.name} is {t}, not a function")
+            ret = None
+            for m in fn_members(t):
+                params, r = self.sig(m)
+                if len(params) != len(e.args): raise Exception(f"{e.name} expects {len(params)} arguments, got {len(e.args)}")
+                if m in self.funcs:
+                    for (pname, _), arg in zip(self.funcs[m].params, e.args): self._widen(self.vars[m], pname, arg.type)
+                ret = join_types(ret, r)
+            return ret
+        if isinstance(e, CallNode) and e.name in self.imported:
+            params, ret = self.imported[e.name]
+            if len(e.args) != len(params):
+                raise Exception(f"{e.name} expects {len(params)} arguments, got {len(e.args)}")
+            for p, arg in zip(params, e.args):
+                if join_types(p, self._expr(fname, arg)) != p:
+                    raise Exception(f"Type error: {e.name} expects {p}, got {arg.type}")
+            return ret
+        if isinstance(e, CallNode):
+            if e.name not in self.funcs: raise Exception(f"Undefined function {e.name}")
+            callee = self.funcs[e.name]
+            if len(e.args) != len(callee.params):
+                raise Exception(f"{e.name} expects {len(callee.params)} arguments, got {len(e.args)}")
+            for (pname, _), arg in zip(callee.params, e.args):
+                self._widen(self.vars[e.name], pname, self._expr(fname, arg))
+            return self.rets[e.name]
+        raise NotImplementedError(e)
+
+# -------------------------
+# Constant folding
+# -------------------------
+# Runs on the typed AST ahead of either backend. Literal arithmetic and
+# comparisons are evaluated with the backends' semantics (64-bit wraparound,
+# division truncating toward zero, fmod for float %), and x + 0, x * 1,
+# x / 1 and friends lose their operation. Anything that would trap at run
+# time (division by zero, INT64_MIN / -1) is left alone.
+INT64_MIN, INT64_MAX = -2**63, 2**63 - 1
+
+def _wrap(v):
+    return (v - INT64_MIN) % 2**64 + INT64_MIN
+
+def _literal(e):
+    if isinstance(e, BoolNode): return int(e.value)
+    if isinstance(e, NumberNode) and (isinstance(e.value, float) or INT64_MIN <= e.value <= INT64_MAX): return e.value
+    return None
+
+def _const(value, t):
+    node = BoolNode(value) if t == "bool" else NumberNode(float(value) if t == "float" else value)
+    node.type = t
+    return node
+
+def _pure(e):
+    # no calls, and no division that might trap
+    return all(isinstance(n, (NumberNode, BoolNode, VarNode, NegNode)) or isinstance(n, BinOpNode) and n.op not in "/%"
+               for n in iter_nodes(e))
+
+def _eval_const(op, a, b, operand):
+    if op in COMPARE_OPS:
+        return {"==": a == b, "!=": a != b, "<": a < b, ">": a > b, "<=": a <= b, ">=": a >= b}[op]
+    if operand == "float":
+        a, b = float(a), float(b)
+        if op in ("/", "%") and b == 0: return None
+        return {"+": a + b, "-": a - b, "*": a * b, "/": a / b if b else None, "%": math.fmod(a, b)}[op]
+    if op in ("/", "%"):
+        if b == 0 or (a == INT64_MIN and b == -1): return None
+        q = abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1)
+        return q if op == "/" else a - b * q
+    return _wrap({"+": a + b, "-": a - b, "*": a * b}[op])
+
+def _fold_binop(e):
+    a, b = _literal(e.left), _literal(e.right)
+    if a is not None and b is not None:
+        value = _eval_const(e.op, a, b, join_types(e.left.type, e.right.type))
+        return e if value is None else _const(value, e.type)
+    if e.type != "int": return e
+    keep = None
+    if (e.op in ("+", "-") and b == 0) or (e.op in ("*", "/") and b == 1): keep = e.left
+    elif (e.op == "+" and a == 0) or (e.op == "*" and a == 1): keep = e.right
+    if keep is not None and keep.type == "int": return keep
+    if ((e.op == "*" and 0 in (a, b)) or (e.op == "%" and b in (1, -1))) and _pure(e.left) and _pure(e.right):
+        return _const(0, "int")
+    return e
+
+def _fold(node, count):
+    for k, v in list(vars(node).items()):
+        if isinstance(v, Tree): v.children = [_fold(x, count) for x in v.children]
+        elif isinstance(v, list): setattr(node, k, [_fold(x, count) if hasattr(x, "__dict__") else x for x in v])
+        elif hasattr(v, "__dict__") and not isinstance(v, str): setattr(node, k, _fold(v, count))
+    out = node
+    if isinstance(node, BinOpNode) and hasattr(node, "type"): out = _fold_binop(node)
+    elif isinstance(node, NegNode) and hasattr(node, "type") and _literal(node.expr) is not None:
+        value = -_literal(node.expr)
+        out = _const(value if node.type == "float" else _wrap(value), node.type)
+    if out is not node: count[0] += 1
+    return out
+
+def fold_constants(ast):
+    """Fold every function body in place; returns how many operations went away."""
+    count = [0]
+    for n in ast:
+        if isinstance(n, FuncNode): _fold(n, count)
+    return count[0]
+
+# -------------------------
+# Refcount elision
+# -------------------------
+# retain(x) ... release(x) in one statement list cancels out as long as nothing
+# in between could drop a reference to x: no reassignment of x, no other
+# release, no call into user code or C, no return. x was live before the
+# retain, so its count never reaches zero at the release we remove.
+def _rc_call(stmt, name):
+    if isinstance(stmt, CallNode) and stmt.name == name and stmt.args and isinstance(stmt.args[0], VarNode):
+        return stmt.args[0].name
+    return None
+
+def _rc_transparent(stmt, var, user_funcs):
+    for n in iter_nodes(stmt):
+        if isinstance(n, (LetNode, AssignNode)) and n.name == var: return False
+        if isinstance(n, ReturnNode): return False
+        if isinstance(n, CallNode) and (n.name == "release" or n.name in user_funcs
+                                        or n.name not in BUILTINS + tuple(MEMORY_BUILTINS)): return False
+    return True
+
+def _elide_block(stmts, user_funcs):
+    dead = set()
+    for i, stmt in enumerate(stmts):
+        var = _rc_call(stmt, "retain")
+        if var is None or i in dead: continue
+        for j in range(i + 1, len(stmts)):
+            if j in dead: continue
+            if _rc_call(stmts[j], "release") == var:
+                dead.update((i, j))
+                break
+            if not _rc_transparent(stmts[j], var, user_funcs): break
+    stmts[:] = [s for i, s in enumerate(stmts) if i not in dead]
+    count = len(dead) // 2
+    for stmt in stmts:
+        for body in ("then_body", "else_body", "body"):
+            if isinstance(getattr(stmt, body, None), list): count += _elide_block(getattr(stmt, body), user_funcs)
+    return count
+
+def elide_refcounts(ast, user_funcs):
+    """Remove redundant retain/release pairs in place; returns how many."""
+    return sum(_elide_block(n.body.children, user_funcs) for n in ast if isinstance(n, FuncNode))
 
 # -------------------------
 # LLVM Backend
 # -------------------------
+I1, I8, I32, I64 = ir.IntType(1), ir.IntType(8), ir.IntType(32), ir.IntType(64)
+F64 = ir.DoubleType()
+I8P = I8.as_pointer()
+LLVM_TYPES = {"bool": I1, "int": I64, "float": F64, "text": I8P, "ptr": I8P, "arena": REGION_P, "bump": REGION_P,
+              "rc": I8P, "rc_shared": I8P}
+RC_HEADER = 16   # i64 count, padded so payloads keep malloc's 16-byte alignment
+C_TYPES = dict(LLVM_TYPES, int=I32)   # Extern "C" ABI: number -> int
+C_WIDTHS = {"f32": ir.FloatType(), "f64": F64}   # a float parameter's C type must be spelled out
+
+CLOSURE = ir.LiteralStructType([I8P, I8P])   # {function, environment}
+ENV_IMMORTAL = 1 << 62   # count of a stack environment, which release never frees
+
+def llvm_type(t, abi=LLVM_TYPES):
+    if isinstance(t, tuple): return ir.LiteralStructType([llvm_type(x, abi) for x in t])
+    if elem_type(t): return ir.LiteralStructType([I64, llvm_type(elem_type(t)).as_pointer()])   # {len, data}
+    if is_fn(t): return CLOSURE
+    return abi[t]
+
+INLINE_THRESHOLDS = {2: 225, 3: 250}   # clang's -O2/-O3 defaults
+LINKER = os.environ.get("PLASMA_LD", "cc")  # only ever links objects, never compiles
+
+def link_objects(objects, output, libs=()):
+    with phase("link"):
+        subprocess.run([LINKER] + objects + ["-o", output] + [f"-l{lib}" for lib in libs], check=True)
+
+def ir_instruction_count(mod):
+    return sum(1 for f in mod.functions for b in f.blocks for _ in b.instructions)
+
 class LLVMBackend:
-    def __init__(self, ast):
+    def __init__(self, ast, opt_level=2, name="plasmascript", interfaces=None, pgo=None):
         self.ast = ast
-        self.module = ir.Module(name="plasmascript")
+        self.opt_level = opt_level
+        self.pgo = pgo   # None, "instrument", or a plasmascriptc_pgo.Profile to optimize with
+        self.fold = True   # constant folding on the typed AST, at every level like clang's front end
+        self.interfaces = interfaces or {}   # Import name -> interface of a compiled PlasmaScript module
+        self.module = ir.Module(name=name)
         self.module.triple = llvm.get_default_triple()
-        self.printf = None
+        self.tm = self._target_machine()
+        self.module.data_layout = str(self.tm.target_data)
+        self.stats = {}
+        self.strings = {}   # interned constant pool: text -> i8* constant
         self.imports = set()
+        self.funcs = {}
+        self.types = None
+        self.builder = None
+        self.fname = None
+        self.locals = {}
+        self.envs = {}
 
     def build(self):
-        self._declare_printf()
-        for node in self.ast:
-            if isinstance(node, ImportNode): self.imports.add(node.lib)
-            elif isinstance(node, ExternNode): self._declare_extern(node)
-            elif isinstance(node, ExportFuncNode): self._export_func(node)
-            elif isinstance(node, FuncNode): self._func(node)
-        return str(self.module)
-
-    def _declare_printf(self):
-        ty = ir.FunctionType(ir.IntType(32), [ir.PointerType(ir.IntType(8))], var_arg=True)
-        self.printf = ir.Function(self.module, ty, name="printf")
+        t0 = time.perf_counter()
+        with phase("typecheck"):
+            self.stats["maps"] = inline_maps(self.ast)
+            self.ast, self.stats["dropped"] = tree_shake(self.ast, self.interfaces)
+            self.stats["lambdas"] = len(lift_lambdas(self.ast, f"{self.module.name}."))
+            deps = [self.interfaces[n.lib] for n in self.ast if isinstance(n, ImportNode) and n.lib in self.interfaces]
+            self.types = TypeInference(self.ast, deps).run()
+            if self.fold: self.stats["folded"] = fold_constants(self.ast)
+            self.stats["rc_elided"] = elide_refcounts(self.ast, self.types.funcs)
+        t1 = time.perf_counter()
+        with phase("codegen"):
+            for iface in deps: self._declare_imported(iface)
+            for node in self.ast:
+                if isinstance(node, ImportNode):
+                    if node.lib not in self.interfaces: self.imports.add(node.lib)
+                elif isinstance(node, ExternNode): self._declare_extern(node)
+                elif isinstance(node, FuncNode): self._declare_func(node)
+            for node in self.ast:
+                if isinstance(node, FuncNode): self._define_func(node)
+            if self.pgo is not None: self._apply_pgo()
+            ir_text = str(self.module)
+        self.stats["typecheck_s"], self.stats["codegen_s"] = t1 - t0, time.perf_counter() - t1
+        count(functions=sum(isinstance(n, FuncNode) for n in self.ast), constants=len(self.strings))
+        return ir_text
+
+    def _declare_imported(self, iface):
+        for fname, (params, ret) in self.types.imported.items():
+            if fname in iface["exports"]:
+                fnty = ir.FunctionType(llvm_type(ret), [llvm_type(t) for t in params])
+                self.funcs[fname] = ir.Function(self.module, fnty, name=fname)
+
+    def interface(self):
+        exports = {n.name: {"params": self.types.param_types(n.name), "ret": self.types.rets[n.name]}
+                   for n in self.ast if isinstance(n, FuncNode) and n.export}
+        # Exported functions can hand out closures over any of these, so
+        # importers need their signatures to unify and call them.
+        closures = {m: {"params": self.types.param_types(m), "ret": self.types.rets[m]}
+                    for t in self.types.fn_types for m in fn_members(t) if m in self.types.funcs}
+        uses = [n.lib for n in self.ast if isinstance(n, ImportNode) and n.lib in self.interfaces]
+        return {"module": self.module.name, "exports": exports, "closures": closures,
+                "libs": sorted(self.imports), "uses": uses}
+
+    def _apply_pgo(self):
+        # Both sides run on the IR as generated, before optimization, so the
+        # counters of an instrumented build line up with the branches here.
+        defined = [self.funcs[n.name] for n in self.ast if isinstance(n, FuncNode)]
+        if self.pgo == "instrument":
+            emit_profile_writer(self.module, [instrument_function(fn) for fn in defined])
+        else:
+            self.stats["pgo_annotated"] = sum(annotate_function(fn, self.pgo) for fn in defined)
+            add_profile_summary(self.module, self.pgo)
 
     def _declare_extern(self, node):
-        fnty = ir.FunctionType(ir.VoidType(), [ir.IntType(32)])
-        ir.Function(self.module, fnty, name=node.name)
+        params = []
+        for (pname, annot), t in zip(node.params, self.types.param_types(node.name)):
+            if annot in C_WIDTHS: params.append(C_WIDTHS[annot])
+            elif t == "float": raise Exception(f'Extern "C" {node.name}: float parameter {pname} needs a C width, {pname}: f32 or {pname}: f64')
+            else: params.append(llvm_type(t, C_TYPES))
+        fnty = ir.FunctionType(ir.VoidType(), params)
+        self.funcs[node.name] = ir.Function(self.module, fnty, name=node.name)
 
-    def _export_func(self, node):
-        fnty = ir.FunctionType(ir.IntType(32), [ir.IntType(32), ir.IntType(32)])
-        fn = ir.Function(self.module, fnty, name=node.name)
-        fn.attributes.add("dllexport")
-        block = fn.append_basic_block("entry")
-        builder = ir.IRBuilder(block)
-        result = builder.add(fn.args[0], fn.args[1])
-        builder.ret(result)
+    def _declare_func(self, node):
+        ret = I32 if node.name == "main" else llvm_type(self.types.rets[node.name])
+        params = [llvm_type(t) for t in self.types.param_types(node.name)]
+        if hasattr(node, "captures"): params = [I8P] + params   # lifted lambda: environment first
+        fn = ir.Function(self.module, ir.FunctionType(ret, params), name=node.name)
+        if not node.export and node.name != "main": fn.linkage = "internal"
+        self.funcs[node.name] = fn
 
-    def _func(self, node):
-        fnty = ir.FunctionType(ir.IntType(32), [])
-        fn = ir.Function(self.module, fnty, name=node.name)
+    def _define_func(self, node):
+        fn = self.funcs[node.name]
         block = fn.append_basic_block("entry")
-        builder = ir.IRBuilder(block)
-        for stmt in node.body.children:
-            if isinstance(stmt, PrintNode):
-                s = "Hello PlasmaScript!\n\0"
-                cstr = ir.Constant(ir.ArrayType(ir.IntType(8), len(s)), bytearray(s.encode("utf8")))
-                gv = ir.GlobalVariable(self.module, cstr.type, name="msg")
-                gv.linkage = 'internal'; gv.global_constant = True; gv.initializer = cstr
-                ptr = builder.bitcast(gv, ir.IntType(8).as_pointer())
-                builder.call(self.printf, [ptr])
-            elif isinstance(stmt, InlineDgmNode):
-                asm = "\n".join([f"mov eax, {c}" for c in stmt.codes])
-                builder.asm(ir.FunctionType(ir.VoidType(), []), asm, "", side_effect=True)
-        builder.ret(ir.Constant(ir.IntType(32), 0))
+        self.builder = ir.IRBuilder(block)
+        self.fname = node.name
+        self.locals = {}
+        for name, t in self.types.vars[node.name].items():
+            self.locals[name] = self.builder.alloca(llvm_type(t), name=name)
+            if has_closure(t): self.builder.store(ir.Constant(llvm_type(t), None), self.locals[name])
+        # Non-escaping environments get entry-block slots like locals: one
+        # per lambda site, reused across loop iterations.
+        self.envs = {}
+        for lam in scan(node.body):
+            if isinstance(lam, LambdaNode) and lam.captures and not self._env_on_heap(lam):
+                slot = self.envs[id(lam)] = self.builder.alloca(self._boxed_env_type(lam), name="env")
+                self.builder.store(ir.Constant(I64, ENV_IMMORTAL), self.builder.gep(slot, [ir.Constant(I32, 0), ir.Constant(I32, 0)]))
+                self.builder.store(ir.Constant(I8P, None), self.builder.gep(slot, [ir.Constant(I32, 0), ir.Constant(I32, 1)]))
+        args = fn.args
+        if hasattr(node, "captures"):
+            env, args = args[0], args[1:]
+            env.name = "env"
+            if node.captures:
+                env = self.builder.bitcast(env, self._env_type(node.name, node.captures).as_pointer())
+                for i, c in enumerate(node.captures):
+                    self._set_local(c, self.builder.load(self.builder.gep(env, [ir.Constant(I32, 0), ir.Constant(I32, i)])), owned=False)
+        for (pname, _), arg in zip(node.params, args):
+            arg.name = pname
+            self._set_local(pname, arg, owned=False)
+        self._block(node.body.children)
+        if not self.builder.block.is_terminated:
+            self._release_locals()
+            if node.name == "main": self._flush()
+            self.builder.ret(ir.Constant(fn.function_type.return_type, None))
+
+    def _block(self, stmts):
+        for stmt in stmts:
+            if self.builder.block.is_terminated: break   # code after return is unreachable
+            self._stmt(stmt)
+
+    def _stmt(self, stmt):
+        if isinstance(stmt, ReturnNode):
+            val = self._eval_owned(stmt.expr)
+            self._release_locals()
+            if self.builder.function.name == "main": self._flush()
+            self.builder.ret(self._coerce(val, self.builder.function.function_type.return_type))
+        elif isinstance(stmt, (LetNode, AssignNode)):
+            self._set_local(stmt.name, self._eval_owned(stmt.expr))
+        elif isinstance(stmt, IfNode):
+            self._if(stmt)
+        elif isinstance(stmt, WhileNode):
+            self._while(stmt)
+        elif isinstance(stmt, ForNode):
+            if is_range(stmt.iterable): self._for_range(stmt)
+            else: self._for_list(stmt)
+        elif isinstance(stmt, PrintNode):
+            self._print(stmt.expr)
+        elif isinstance(stmt, InlineDgmNode):
+            asm = "\n".join([".intel_syntax noprefix"] + [f"mov eax, {c}" for c in stmt.codes] + [".att_syntax"])
+            self.builder.asm(ir.FunctionType(ir.VoidType(), []), asm, "~{eax}", [], side_effect=True)
+        else:
+            self._drop_temps([stmt], [self._eval_expr(stmt)])
+
+    def _truth(self, expr):
+        val = self._eval_expr(expr)
+        if val.type == I1: return val
+        if val.type == F64: return self.builder.fcmp_unordered("!=", val, ir.Constant(F64, 0))
+        return self.builder.icmp_signed("!=", val, ir.Constant(val.type, 0))
+
+    def _if(self, stmt):
+        fn = self.builder.function
+        then_bb, else_bb, end_bb = fn.append_basic_block("if.then"), fn.append_basic_block("if.else"), fn.append_basic_block("if.end")
+        self.builder.cbranch(self._truth(stmt.cond), then_bb, else_bb)
+        for bb, body in ((then_bb, stmt.then_body), (else_bb, stmt.else_body)):
+            self.builder.position_at_end(bb)
+            self._block(body)
+            if not self.builder.block.is_terminated: self.builder.branch(end_bb)
+        self.builder.position_at_end(end_bb)
+
+    def _loop_md(self, vectorize=False):
+        # Self-referential loop ID; mustprogress lets LICM, unrolling and the
+        # vectorizer treat the loop as finite. Only counted loops get one: a
+        # while loop may legitimately spin forever.
+        hints = [self.module.add_metadata([ir.MetaDataString(self.module, "llvm.loop.mustprogress")])]
+        if vectorize:
+            hints.append(self.module.add_metadata([ir.MetaDataString(self.module, "llvm.loop.vectorize.enable"), ir.Constant(I1, 1)]))
+        loop_id = ir.MDValue(self.module, [], name=str(len(self.module.metadata)))
+        loop_id.operands = (loop_id, *hints)
+        return loop_id
+
+    def _while(self, stmt):
+        fn = self.builder.function
+        cond_bb, body_bb, end_bb = fn.append_basic_block("while.cond"), fn.append_basic_block("while.body"), fn.append_basic_block("while.end")
+        self.builder.branch(cond_bb)
+        self.builder.position_at_end(cond_bb)
+        self.builder.cbranch(self._truth(stmt.cond), body_bb, end_bb)
+        self.builder.position_at_end(body_bb)
+        self._block(stmt.body)
+        if not self.builder.block.is_terminated:
+            self.builder.branch(cond_bb)   # no _loop_md: not provably finite
+        self.builder.position_at_end(end_bb)
+
+    def _range_args(self, call):
+        # range(end) / range(start, end) / range(start, end, step), half-open like the VMs
+        args = [self._coerce(self._eval_expr(a), I64) for a in call.args]
+        if len(args) == 1: return ir.Constant(I64, 0), args[0], ir.Constant(I64, 1)
+        return args[0], args[1], args[2] if len(args) == 3 else ir.Constant(I64, 1)
+
+    def _range_len(self, start, end, step):
+        b = self.builder
+        ascending = b.icmp_signed(">", step, ir.Constant(I64, 0))
+        span = b.select(ascending, b.sub(end, start), b.sub(start, end))
+        stride = b.select(ascending, step, b.neg(step))
+        n = b.sdiv(b.add(span, b.sub(stride, ir.Constant(I64, 1))), stride)
+        return b.select(b.icmp_signed(">", span, ir.Constant(I64, 0)), n, ir.Constant(I64, 0))
+
+    def _for_range(self, stmt):
+        start, end, step = self._range_args(stmt.iterable)
+        fn, var = self.builder.function, self.locals[stmt.var]
+        cond_bb, body_bb, end_bb = fn.append_basic_block("for.cond"), fn.append_basic_block("for.body"), fn.append_basic_block("for.end")
+        self.builder.store(start, var)
+        self.builder.branch(cond_bb)
+        self.builder.position_at_end(cond_bb)
+        i = self.builder.load(var, name=stmt.var)
+        up = self.builder.icmp_signed("<", i, end)
+        down = self.builder.icmp_signed(">", i, end)
+        ascending = self.builder.icmp_signed(">", step, ir.Constant(I64, 0))
+        self.builder.cbranch(self.builder.select(ascending, up, down), body_bb, end_bb)
+        self.builder.position_at_end(body_bb)
+        self._block(stmt.body)
+        if not self.builder.block.is_terminated:
+            nxt = self.builder.add(self.builder.load(var), step, flags=["nsw"])
+            self.builder.store(nxt, var)
+            self.builder.branch(cond_bb).set_metadata("llvm.loop", self._loop_md())
+        self.builder.position_at_end(end_bb)
+
+    def _counted(self, n, body, vectorize=False):
+        """Emit `for i in 0..n: body(i)` with i in a phi; body may terminate its block."""
+        fn, entry = self.builder.function, self.builder.block
+        cond_bb, body_bb, end_bb = fn.append_basic_block("loop.cond"), fn.append_basic_block("loop.body"), fn.append_basic_block("loop.end")
+        self.builder.branch(cond_bb)
+        self.builder.position_at_end(cond_bb)
+        i = self.builder.phi(I64, name="i")
+        i.add_incoming(ir.Constant(I64, 0), entry)
+        self.builder.cbranch(self.builder.icmp_signed("<", i, n), body_bb, end_bb)
+        self.builder.position_at_end(body_bb)
+        body(i)
+        if not self.builder.block.is_terminated:
+            i.add_incoming(self.builder.add(i, ir.Constant(I64, 1), flags=["nuw", "nsw"]), self.builder.block)
+            self.builder.branch(cond_bb).set_metadata("llvm.loop", self._loop_md(vectorize))
+        self.builder.position_at_end(end_bb)
+
+    def _for_list(self, stmt):
+        lst = self._eval_expr(stmt.iterable)
+        data = self.builder.extract_value(lst, 1)
+        def body(i):
+            self.builder.store(self.builder.load(self.builder.gep(data, [i])), self.locals[stmt.var])
+            self._block(stmt.body)
+        self._counted(self.builder.extract_value(lst, 0), body)
+
+    def _alloc_list(self, ty, n):
+        malloc = self._libc("malloc", I8P, [I64])
+        malloc.return_value.add_attribute("noalias")
+        size = ir.Constant(I64, ty.elements[1].pointee.get_abi_size(self.tm.target_data))
+        return self.builder.bitcast(self.builder.call(malloc, [self.builder.mul(n, size)]), ty.elements[1])
+
+    def _make_list(self, ty, n, data):
+        return self.builder.insert_value(self.builder.insert_value(ir.Constant(ty, ir.Undefined), n, 0), data, 1)
+
+    def _alias_scopes(self):
+        # Scoped-noalias metadata: loads from the source and stores to the fresh
+        # output buffer never alias, so the vectorizer needs no runtime checks.
+        tag = self.module.get_unique_name("comp")
+        domain = self.module.add_metadata([ir.MetaDataString(self.module, tag)])
+        src, out = (self.module.add_metadata([ir.MetaDataString(self.module, f"{tag}.{r}"), domain]) for r in ("src", "out"))
+        return self.module.add_metadata([src]), self.module.add_metadata([out])
+
+    def _list_comp(self, expr):
+        b, ty = self.builder, llvm_type(expr.type)
+        src_scope, out_scope = self._alias_scopes()
+        if is_range(expr.source):
+            start, _, step = args = self._range_args(expr.source)
+            n = self._range_len(*args)
+            item = lambda i: b.add(start, b.mul(i, step, flags=["nsw"]), flags=["nsw"])
+        else:
+            lst = self._eval_expr(expr.source)
+            n, data = b.extract_value(lst, 0), b.extract_value(lst, 1)
+            def item(i):
+                val = b.load(b.gep(data, [i]))
+                val.set_metadata("alias.scope", src_scope); val.set_metadata("noalias", out_scope)
+                return val
+        buf = self._alloc_list(ty, n)   # pre-sized for the unfiltered case
+        count = b.alloca(I64, name="count") if expr.cond is not None else None
+        if count is not None: b.store(ir.Constant(I64, 0), count)
+        def store(val, at):
+            st = b.store(self._coerce(val, ty.elements[1].pointee), b.gep(buf, [at]))
+            st.set_metadata("alias.scope", out_scope); st.set_metadata("noalias", src_scope)
+        def body(i):
+            b.store(item(i), self.locals[expr.var])
+            if count is None: return store(self._eval_expr(expr.expr), i)
+            keep_bb, next_bb = b.function.append_basic_block("comp.keep"), b.function.append_basic_block("comp.next")
+            b.cbranch(self._truth(expr.cond), keep_bb, next_bb)
+            b.position_at_end(keep_bb)
+            j = b.load(count)
+            store(self._eval_expr(expr.expr), j)
+            b.store(b.add(j, ir.Constant(I64, 1)), count)
+            b.branch(next_bb)
+            b.position_at_end(next_bb)
+        # Only force vectorization of straight-line element-wise bodies; a filter
+        # or an opaque call would just make LLVM warn that it gave up.
+        simple = count is None and not any(isinstance(x, (CallNode, ListCompNode)) for x in iter_nodes(expr.expr))
+        self._counted(n, body, vectorize=simple)
+        return self._make_list(ty, b.load(count) if count is not None else n, buf)
+
+    def _builtin(self, expr):
+        lst = self._eval_expr(expr.args[0])
+        n = self.builder.extract_value(lst, 0)
+        if expr.name == "len": return n
+        ty, data = llvm_type(expr.type), self.builder.extract_value(lst, 1)
+        acc = self.builder.alloca(ty, name="sum")
+        self.builder.store(ir.Constant(ty, 0), acc)
+        add = self.builder.fadd if expr.type == "float" else self.builder.add
+        def body(i):
+            self.builder.store(add(self.builder.load(acc), self._coerce(self.builder.load(self.builder.gep(data, [i])), ty)), acc)
+        self._counted(n, body)
+        return self.builder.load(acc)
+
+    def _memory(self, expr):
+        b, name = self.builder, expr.name
+        args = [self._eval_expr(a) for a in expr.args]
+        done = ir.Constant(I64, 0)
+        if name == "malloc":
+            return b.call(self._libc("malloc", I8P, [I64]), [self._coerce(args[0], I64)])
+        if name == "free":
+            b.call(self._libc("free", ir.VoidType(), [I8P]), args)
+            return done
+        if name in ("store", "load", "load_ptr"):
+            # byte offsets with no alignment assumed; ints take 4-byte slots
+            # (malloc(8) holds two of them, as in src/closures_memory.ps),
+            # pointers 8
+            addr = b.gep(args[0], [self._coerce(args[1], I64)])
+            if name == "store":
+                val = args[2] if args[2].type == I8P else b.trunc(self._coerce(args[2], I64), I32)
+                b.store(val, b.bitcast(addr, val.type.as_pointer()), align=1)
+                return done
+            if name == "load_ptr": return b.load(b.bitcast(addr, I8P.as_pointer()), align=1)
+            return b.sext(b.load(b.bitcast(addr, I32.as_pointer()), align=1), I64)
+        if name.startswith("rc_alloc"):
+            raw = b.call(self._libc("malloc", I8P, [I64]), [b.add(self._coerce(args[0], I64), ir.Constant(I64, RC_HEADER))])
+            b.store(ir.Constant(I64, 1), b.bitcast(raw, I64.as_pointer()))
+            return b.gep(raw, [ir.Constant(I64, RC_HEADER)])
+        if name in ("retain", "release"):
+            self._refcount(name, args[0], expr.args[0].type == "rc_shared")
+            return done
+        if name.endswith("_init"):
+            return self._rt("plasma_region_new", self._coerce(args[0], I64))
+        if name.endswith("_reset"):
+            self._rt("plasma_region_reset", args[0])
+            return done
+        return self._region_alloc(args[0], self._coerce(args[1], I64), 16 if name == "arena_alloc" else 8)
+
+    def _refcount(self, op, obj, atomic):
+        b = self.builder
+        raw = b.gep(obj, [ir.Constant(I64, -RC_HEADER)])
+        count = b.bitcast(raw, I64.as_pointer())
+        one = ir.Constant(I64, 1)
+        if op == "retain":
+            if atomic: b.atomic_rmw("add", count, one, "monotonic")
+            else: b.store(b.add(b.load(count), one), count)
+            return
+        if atomic:
+            # acq_rel: our writes happen before the free, whichever thread frees
+            dead = b.icmp_unsigned("==", b.atomic_rmw("sub", count, one, "acq_rel"), one)
+        else:
+            left = b.sub(b.load(count), one)
+            b.store(left, count)
+            dead = b.icmp_unsigned("==", left, ir.Constant(I64, 0))
+        fn = b.function
+        free_bb, done_bb = fn.append_basic_block("rc.free"), fn.append_basic_block("rc.done")
+        b.cbranch(dead, free_bb, done_bb).set_weights([1, 100])
+        b.position_at_end(free_bb)
+        b.call(self._libc("free", ir.VoidType(), [I8P]), [raw])
+        b.branch(done_bb)
+        b.position_at_end(done_bb)
+
+    def _region_alloc(self, region, n, align):
+        # Inline fast path: round up, bump, compare against the chunk end. Only
+        # a full chunk leaves the function, through the cold plasma_region_refill.
+        b, fn = self.builder, self.builder.function
+        size = b.and_(b.add(n, ir.Constant(I64, align - 1)), ir.Constant(I64, -align))
+        cur_p = b.gep(region, [ir.Constant(I32, 0), ir.Constant(I32, 0)])
+        end_p = b.gep(region, [ir.Constant(I32, 0), ir.Constant(I32, 1)])
+        cur = b.load(cur_p)
+        nxt = b.gep(cur, [size])
+        fits = b.icmp_unsigned("<=", b.ptrtoint(nxt, I64), b.ptrtoint(b.load(end_p), I64))
+        fast_bb, slow_bb, done_bb = fn.append_basic_block("bump.fast"), fn.append_basic_block("bump.refill"), fn.append_basic_block("bump.done")
+        b.cbranch(fits, fast_bb, slow_bb).set_weights([2000, 1])
+        b.position_at_end(fast_bb)
+        b.store(nxt, cur_p)
+        b.branch(done_bb)
+        b.position_at_end(slow_bb)
+        refilled = self._rt("plasma_region_refill", region, size)
+        b.branch(done_bb)
+        b.position_at_end(done_bb)
+        p = b.phi(I8P)
+        p.add_incoming(cur, fast_bb); p.add_incoming(refilled, slow_bb)
+        return p
+
+    def _coerce(self, val, ty):
+        if val.type == ty: return val
+        if isinstance(ty, (ir.FloatType, ir.DoubleType)):
+            if isinstance(val.type, ir.DoubleType): return self.builder.fptrunc(val, ty)   # to an Extern f32
+            return self.builder.sitofp(val, ty) if val.type != I1 else self.builder.uitofp(val, ty)
+        if isinstance(ty, ir.IntType) and isinstance(val.type, ir.IntType):
+            if val.type.width > ty.width: return self.builder.trunc(val, ty)
+            return self.builder.zext(val, ty) if val.type == I1 else self.builder.sext(val, ty)
+        if isinstance(ty, ir.LiteralStructType):
+            out = ir.Constant(ty, ir.Undefined)
+            for i, elt in enumerate(ty.elements):
+                out = self.builder.insert_value(out, self._coerce(self.builder.extract_value(val, i), elt), i)
+            return out
+        raise Exception(f"Type error: cannot convert {val.type} to {ty}")
+
+    def _cstring(self, s, name="str"):
+        # One private unnamed_addr global per distinct text, shared by string
+        # literals and format strings alike; unnamed_addr also lets LLVM and the
+        # linker merge it with identical constants from other modules.
+        if s not in self.strings:
+            data = bytearray((s + "\0").encode("utf8"))
+            cstr = ir.Constant(ir.ArrayType(I8, len(data)), data)
+            gv = ir.GlobalVariable(self.module, cstr.type, name=self.module.get_unique_name(name))
+            gv.linkage = "private"; gv.unnamed_addr = True; gv.global_constant = True; gv.initializer = cstr
+            self.strings[s] = gv.bitcast(I8P)
+        return self.strings[s]
+
+    def _eval_expr(self, expr):
+        t = expr.type
+        if isinstance(expr, NumberNode):
+            return ir.Constant(llvm_type(t), expr.value)
+        elif isinstance(expr, StringNode):
+            return self._cstring(expr.value)
+        elif isinstance(expr, BoolNode):
+            return ir.Constant(I1, int(expr.value))
+        elif isinstance(expr, VarNode):
+            if expr.name not in self.locals: return self._closure(self._thunk(expr.name), ir.Constant(I8P, None))
+            return self.builder.load(self.locals[expr.name], name=expr.name)
+        elif isinstance(expr, LambdaNode):
+            return self._make_closure(expr)
+        elif isinstance(expr, NegNode):
+            val = self._eval_expr(expr.expr)
+            return self.builder.fneg(val) if t == "float" else self.builder.neg(val)
+        elif isinstance(expr, TupleNode):
+            ty = llvm_type(t)
+            out = ir.Constant(ty, ir.Undefined)
+            for i, (item, elt) in enumerate(zip(expr.items, ty.elements)):
+                out = self.builder.insert_value(out, self._coerce(self._eval_owned(item), elt), i)
+            return out
+        elif isinstance(expr, ListNode):
+            ty = llvm_type(t)
+            buf = self._alloc_list(ty, ir.Constant(I64, len(expr.items)))
+            for i, item in enumerate(expr.items):
+                self.builder.store(self._coerce(self._eval_expr(item), ty.elements[1].pointee), self.builder.gep(buf, [ir.Constant(I64, i)]))
+            return self._make_list(ty, ir.Constant(I64, len(expr.items)), buf)
+        elif isinstance(expr, ListCompNode):
+            return self._list_comp(expr)
+        elif isinstance(expr, IndexNode):
+            lst = self._eval_expr(expr.target)
+            i = self._coerce(self._eval_expr(expr.index), I64)
+            return self.builder.load(self.builder.gep(self.builder.extract_value(lst, 1), [i]))
+        elif isinstance(expr, BinOpNode):
+            return self._binop(expr)
+        elif isinstance(expr, CallNode) and expr.name in BUILTINS and expr.name not in self.funcs:
+            return self._builtin(expr)
+        elif isinstance(expr, CallNode) and expr.name in MEMORY_BUILTINS and expr.name not in self.funcs:
+            return self._memory(expr)
+        elif isinstance(expr, CallNode) and expr.name in self.locals:
+            return self._call_closure(expr)
+        elif isinstance(expr, CallNode):
+            fn = self.funcs[expr.name]
+            vals = [self._eval_expr(a) for a in expr.args]
+            if isinstance(self.types.funcs.get(expr.name), ExternNode):
+                self._flush()   # keep our buffered output ahead of anything C prints
+            result = self.builder.call(fn, [self._coerce(v, p) for v, p in zip(vals, fn.function_type.args)])
+            self._drop_temps(expr.args, vals)
+            if isinstance(fn.function_type.return_type, ir.VoidType):
+                return ir.Constant(I64, 0)
+            return result
+        raise NotImplementedError(expr)
+
+    def _env_type(self, name, captures):
+        # Laid out with the lambda's own slot types, which are at least as wide
+        # as the creator's.
+        return ir.LiteralStructType([llvm_type(self.types.vars[name][c]) for c in captures])
+
+    def _closure(self, fn, env):
+        out = self.builder.insert_value(ir.Constant(CLOSURE, ir.Undefined), self.builder.bitcast(fn, I8P), 0)
+        return self.builder.insert_value(out, env, 1)
+
+    def _boxed_env_type(self, lam):
+        # The captures behind an RC_HEADER: {i64 count, i8* drop function}
+        return ir.LiteralStructType([I64, I8P, self._env_type(lam.name, lam.captures)])
+
+    def _env_on_heap(self, lam):
+        # A captured closure is released with its environment, so that
+        # environment needs a count even when it doesn't escape.
+        return lam.escapes or any(has_closure(self.types.vars[lam.name][c]) for c in lam.captures)
+
+    def _make_closure(self, lam):
+        env = ir.Constant(I8P, None)
+        if lam.captures:
+            ty = self._boxed_env_type(lam)
+            if self._env_on_heap(lam):
+                malloc = self._libc("malloc", I8P, [I64])
+                slot = self.builder.bitcast(self.builder.call(malloc, [ir.Constant(I64, ty.get_abi_size(self.tm.target_data))]), ty.as_pointer())
+                self.builder.store(ir.Constant(I64, 1), self.builder.gep(slot, [ir.Constant(I32, 0), ir.Constant(I32, 0)]))
+                self.builder.store(self._env_drop(lam), self.builder.gep(slot, [ir.Constant(I32, 0), ir.Constant(I32, 1)]))
+            else:
+                slot = self.envs[id(lam)]
+            for i, (c, elt) in enumerate(zip(lam.captures, ty.elements[2].elements)):
+                val = self._coerce(self.builder.load(self.locals[c]), elt)
+                self._lifetime("retain", val, self.types.vars[lam.name][c])
+                self.builder.store(val, self.builder.gep(slot, [ir.Constant(I32, 0), ir.Constant(I32, 2), ir.Constant(I32, i)]))
+            env = self.builder.bitcast(self.builder.gep(slot, [ir.Constant(I32, 0), ir.Constant(I32, 2)]), I8P)
+        return self._closure(self.funcs[lam.name], env)
+
+    def _env_drop(self, lam):
+        """The function release calls before freeing lam's environment: it
+        releases the captured closures. Null when nothing needs releasing."""
+        types = [self.types.vars[lam.name][c] for c in lam.captures]
+        if not any(has_closure(t) for t in types): return ir.Constant(I8P, None)
+        drop = self.module.globals.get(f"{lam.name}.drop")
+        if drop is None:
+            drop = ir.Function(self.module, ir.FunctionType(ir.VoidType(), [I8P]), name=f"{lam.name}.drop")
+            drop.linkage = "internal"
+            b = ir.IRBuilder(drop.append_basic_block("entry"))
+            env = b.bitcast(drop.args[0], self._env_type(lam.name, lam.captures).as_pointer())
+            for i, t in enumerate(types):
+                if has_closure(t): self._lifetime("release", b.load(b.gep(env, [ir.Constant(I32, 0), ir.Constant(I32, i)])), t, b)
+            b.ret_void()
+        return self.builder.bitcast(drop, I8P)
+
+    # Closure lifetimes. A closure-typed local (or tuple holding closures)
+    # owns one reference to each environment in it, dropped when the local is
+    # overwritten or the function returns. Arguments are borrowed; calls,
+    # lambdas and tuples produce owned values, which a caller that only passed
+    # them along or threw them away releases. Thunks have a null environment
+    # and stack environments an ENV_IMMORTAL count, so every closure can be
+    # retained and released alike.
+    def _lifetime(self, op, val, t, b=None):
+        """retain or release every closure environment in val, of type t."""
+        b = b or self.builder
+        if is_fn(t):
+            b.call(self._env_rc(op), [b.extract_value(val, 1)])
+        elif isinstance(t, tuple):
+            for i, x in enumerate(t):
+                if has_closure(x): self._lifetime(op, b.extract_value(val, i), x, b)
+
+    def _env_rc(self, op):
+        # Out of line, unlike _refcount: environments are few and short-lived,
+        # and the null and drop checks would bloat every call site.
+        fn = self.module.globals.get(f"plasma.env_{op}")
+        if fn is not None: return fn
+        fn = ir.Function(self.module, ir.FunctionType(ir.VoidType(), [I8P]), name=f"plasma.env_{op}")
+        fn.linkage = "internal"
+        b = ir.IRBuilder(fn.append_basic_block("entry"))
+        env = fn.args[0]
+        live_bb, done_bb = fn.append_basic_block("live"), fn.append_basic_block("done")
+        b.cbranch(b.icmp_unsigned("==", env, ir.Constant(I8P, None)), done_bb, live_bb)
+        b.position_at_end(live_bb)
+        raw = b.gep(env, [ir.Constant(I64, -RC_HEADER)])
+        count = b.bitcast(raw, I64.as_pointer())
+        if op == "retain":
+            b.store(b.add(b.load(count), ir.Constant(I64, 1)), count)
+            b.branch(done_bb)
+        else:
+            left = b.sub(b.load(count), ir.Constant(I64, 1))
+            b.store(left, count)
+            free_bb = fn.append_basic_block("free")
+            b.cbranch(b.icmp_unsigned("==", left, ir.Constant(I64, 0)), free_bb, done_bb).set_weights([1, 100])
+            b.position_at_end(free_bb)
+            drop = b.load(b.bitcast(b.gep(raw, [ir.Constant(I64, 8)]), I8P.as_pointer()))
+            drop_bb, free_raw_bb = fn.append_basic_block("drop"), fn.append_basic_block("free.raw")
+            b.cbranch(b.icmp_unsigned("==", drop, ir.Constant(I8P, None)), free_raw_bb, drop_bb)
+            b.position_at_end(drop_bb)
+            b.call(b.bitcast(drop, fn.function_type.as_pointer()), [env])
+            b.branch(free_raw_bb)
+            b.position_at_end(free_raw_bb)
+            b.call(self._libc("free", ir.VoidType(), [I8P]), [raw])
+            b.branch(done_bb)
+        b.position_at_end(done_bb)
+        b.ret_void()
+        return fn
+
+    def _owned(self, expr):
+        return isinstance(expr, (LambdaNode, TupleNode, CallNode))
+
+    def _eval_owned(self, expr):
+        """Evaluate expr into a value holding its own references."""
+        val = self._eval_expr(expr)
+        if has_closure(expr.type) and not self._owned(expr): self._lifetime("retain", val, expr.type)
+        return val
+
+    def _drop_temps(self, exprs, vals):
+        for e, v in zip(exprs, vals):
+            if has_closure(e.type) and self._owned(e): self._lifetime("release", v, e.type)
+
+    def _set_local(self, name, val, owned=True):
+        ptr, t = self.locals[name], self.types.vars[self.fname][name]
+        val = self._coerce(val, ptr.type.pointee)
+        if has_closure(t):
+            if not owned: self._lifetime("retain", val, t)
+            self._lifetime("release", self.builder.load(ptr), t)
+        self.builder.store(val, ptr)
+
+    def _release_locals(self):
+        for name, t in self.types.vars[self.fname].items():
+            if has_closure(t): self._lifetime("release", self.builder.load(self.locals[name]), t)
+
+    def _thunk(self, name):
+        """A named function as a closure: an env-taking wrapper that drops the env."""
+        thunk = self.module.globals.get(f"{name}.closure")
+        if thunk is None:
+            fn = self.funcs[name]
+            fnty = ir.FunctionType(fn.function_type.return_type, [I8P] + list(fn.function_type.args))
+            thunk = ir.Function(self.module, fnty, name=f"{name}.closure")
+            thunk.linkage = "internal"
+            b = ir.IRBuilder(thunk.append_basic_block("entry"))
+            b.ret(b.call(fn, thunk.args[1:]))
+        return thunk
+
+    def _call_closure(self, expr):
+        params, ret = self.types.sig(fn_members(self.types.vars[self.fname][expr.name])[0])
+        fnty = ir.FunctionType(llvm_type(ret), [I8P] + [llvm_type(t) for t in params])
+        clo = self.builder.load(self.locals[expr.name])
+        vals = [self._eval_expr(a) for a in expr.args]
+        callee = self.builder.bitcast(self.builder.extract_value(clo, 0), fnty.as_pointer())
+        result = self.builder.call(callee, [self.builder.extract_value(clo, 1)] + [self._coerce(v, p) for v, p in zip(vals, fnty.args[1:])])
+        self._drop_temps(expr.args, vals)
+        return result
+
+    def _binop(self, expr):
+        l, r = self._eval_expr(expr.left), self._eval_expr(expr.right)
+        if "text" in (expr.left.type, expr.right.type):
+            if expr.op == "+": return self._concat(l, r)
+            if expr.op in COMPARE_OPS:
+                strcmp = self._libc("strcmp", I32, [I8P, I8P])
+                return self.builder.icmp_signed(expr.op, self.builder.call(strcmp, [l, r]), ir.Constant(I32, 0))
+            raise NotImplementedError(f"text {expr.op} text")
+        operand = join_types(expr.left.type, expr.right.type)
+        # bools compare for equality as i1; anything else widens to int, since
+        # a signed i1 true is -1 and would order below false
+        if operand == "bool" and expr.op not in ("==", "!="): operand = "int"
+        ty = llvm_type(operand)
+        l, r = self._coerce(l, ty), self._coerce(r, ty)
+        if operand == "float":
+            if expr.op in COMPARE_OPS: return self.builder.fcmp_ordered(expr.op, l, r)
+            return {"+": self.builder.fadd, "-": self.builder.fsub, "*": self.builder.fmul,
+                    "/": self.builder.fdiv, "%": self.builder.frem}[expr.op](l, r)
+        if expr.op in COMPARE_OPS: return self.builder.icmp_signed(expr.op, l, r)
+        return {"+": self.builder.add, "-": self.builder.sub, "*": self.builder.mul,
+                "/": self.builder.sdiv, "%": self.builder.srem}[expr.op](l, r)
+
+    def _libc(self, name, ret, args):
+        if name not in self.module.globals:
+            ir.Function(self.module, ir.FunctionType(ret, args), name=name)
+        return self.module.globals[name]
+
+    def _concat(self, l, r):
+        strlen = self._libc("strlen", I64, [I8P])
+        malloc = self._libc("malloc", I8P, [I64])
+        memcpy = self._libc("memcpy", I8P, [I8P, I8P, I64])
+        ln, rn = self.builder.call(strlen, [l]), self.builder.call(strlen, [r])
+        size = self.builder.add(self.builder.add(ln, rn), ir.Constant(I64, 1))
+        buf = self.builder.call(malloc, [size])
+        self.builder.call(memcpy, [buf, l, ln])
+        tail = self.builder.gep(buf, [ln])
+        self.builder.call(memcpy, [tail, r, self.builder.add(rn, ir.Constant(I64, 1))])
+        return buf
+
+    def _rt(self, name, *args):
+        # Calls into plasmascriptc_runtime, linked in by optimize()
+        ret, params = RUNTIME_SIGS[name]
+        return self.builder.call(self._libc(name, ret, params), list(args))
+
+    # Print goes through the buffered runtime: no format parsing, and one
+    # write(2) per 64 KiB of output.
+    def _flush(self):
+        self._rt("plasma_flush")
+
+    def _write(self, pieces):
+        # Adjacent literal pieces are merged into one pooled constant.
+        lit = ""
+        for piece in pieces + [None]:
+            if isinstance(piece, str):
+                lit += piece; continue
+            if lit:
+                self._rt("plasma_write", self._cstring(lit), ir.Constant(I64, len(lit.encode("utf8"))))
+                lit = ""
+            if piece is not None:
+                kind, val = piece
+                self._rt({"int": "plasma_put_int", "float": "plasma_put_float", "text": "plasma_put_str"}[kind], val)
+
+    def _print(self, expr):
+        val = self._eval_expr(expr)
+        if elem_type(expr.type): return self._print_list(expr.type, val)
+        self._write(self._format(expr.type, val) + ["\n"])
+
+    def _print_list(self, t, val):
+        # [a, b, c] like the VMs' Python lists
+        data = self.builder.extract_value(val, 1)
+        self._write(["["])
+        def body(i):
+            first = self.builder.icmp_signed("==", i, ir.Constant(I64, 0))
+            self._rt("plasma_write", self._cstring(", "), self.builder.select(first, ir.Constant(I64, 0), ir.Constant(I64, 2)))
+            self._write(self._format(elem_type(t), self.builder.load(self.builder.gep(data, [i]))))
+        self._counted(self.builder.extract_value(val, 0), body)
+        self._write(["]\n"])
+
+    def _format(self, t, val):
+        """Pieces to print: literal strs and (kind, value) pairs."""
+        if isinstance(t, tuple):
+            pieces = ["("]
+            for i, elt in enumerate(t):
+                if i: pieces.append(", ")
+                pieces += self._format(elt, self.builder.extract_value(val, i))
+            return pieces + [")"]
+        if is_fn(t): raise NotImplementedError("Print of a function value")
+        if t == "text": return [("text", val)]
+        if t == "float": return [("float", val)]
+        if t == "bool": return [("text", self.builder.select(val, self._cstring("true"), self._cstring("false")))]
+        return [("int", val)]
+
+    def _target_machine(self, reloc="pic", codemodel="default"):
+        llvm.initialize_native_target()
+        llvm.initialize_native_asmprinter()
+        llvm.initialize_native_asmparser()
+        target = llvm.Target.from_triple(self.module.triple)
+        return target.create_target_machine(cpu=llvm.get_host_cpu_name(),
+                                            features=llvm.get_host_cpu_features().flatten(),
+                                            opt=self.opt_level, reloc=reloc, codemodel=codemodel)
+
+    def optimize(self):
+        with phase("optimize"):
+            mod = llvm.parse_assembly(str(self.module))
+            mod.verify()
+            if any(name in self.module.globals for name in RUNTIME_FUNCS):
+                mod.link_in(runtime_ir(self.module.triple, self.module.data_layout))
+            self.stats["ir_before"] = ir_instruction_count(mod)   # with the runtime, like ir_after
+            if self.opt_level > 0:
+                pto = llvm.create_pipeline_tuning_options(speed_level=self.opt_level)
+                pto.loop_vectorization = pto.slp_vectorization = self.opt_level >= 2
+                if self.opt_level in INLINE_THRESHOLDS:
+                    pto.inlining_threshold = INLINE_THRESHOLDS[self.opt_level]
+                pb = llvm.create_pass_builder(self.tm, pto)
+                pb.getModulePassManager().run(mod, pb)
+            self.stats["ir_after"] = ir_instruction_count(mod)
+        count(ir_instructions=self.stats["ir_before"], ir_optimized=self.stats["ir_after"])
+        return mod
+
+    def emit_object(self, path):
+        mod = self.optimize()
+        with phase("emit"), open(path, "wb") as f: f.write(self.tm.emit_object(mod))
+
 
     def compile(self, output="plasmascript.exe"):
-        with open("output.ll", "w") as f: f.write(str(self.module))
-        subprocess.run(["clang", "output.ll", "-o", output] + [f"-l{lib}" for lib in self.imports])
-        print(f"✅ LLVM build: {output}")
+        self.build()
+        fd, obj = tempfile.mkstemp(prefix="plasmascript-", suffix=".o")
+        os.close(fd)
+        try:
+            self.emit_object(obj)
+            link_objects([obj], output, sorted(self.imports))
+        finally:
+            os.remove(obj)
+        print(f"✅ LLVM build: {output} (-O{self.opt_level}, IR {self.stats['ir_before']} -> {self.stats['ir_after']} instructions)")
+
+    def run_jit(self, objects=()):
+        t0 = time.perf_counter()
+        self.build()
+        mod = self.optimize()
+        for lib in self.imports:
+            path = ctypes.util.find_library(lib)
+            if path is None: raise Exception(f"Cannot find library {lib} for JIT")
+            llvm.load_library_permanently(path)
+        with phase("jit"):
+            # PIC code loaded next to the cached objects gets mis-relocated by RuntimeDyld
+            engine = llvm.create_mcjit_compiler(mod, self._target_machine("default", "jitdefault"))
+            for obj in objects: engine.add_object_file(obj)
+            engine.finalize_object()
+            engine.run_static_constructors()
+            entry = ctypes.CFUNCTYPE(ctypes.c_int)(engine.get_function_address("main"))
+        t1 = time.perf_counter()
+        with phase("execute"):
+            status = entry()
+            ctypes.CDLL(None).fflush(None)   # flush anything Extern C code printed before reporting
+        t2 = time.perf_counter()
+        self.stats["compile_ms"], self.stats["run_ms"] = (t1 - t0) * 1000, (t2 - t1) * 1000
+        print(f"✅ JIT run: compile {self.stats['compile_ms']:.1f} ms, execute {self.stats['run_ms']:.1f} ms, exit {status}", file=sys.stderr)
+        return status
 
 # -------------------------
 # NASM Backend
 # -------------------------
+# Instruction selection for the int, bool and text subset: every value gets
+# a virtual register, plasmascriptc_x86 allocates them with linear scan and
+# prints NASM. Floats, lists and closures are LLVM-only. -O0 keeps every
+# value in its stack slot, the memory round-trip baseline.
+NASM_TYPES = ("int", "bool", "text", "list:int")
+LANES = 4   # 64-bit lanes in a ymm register
+
+class CompileError(Exception):
+    """A program the chosen backend can't compile; main reports it in one line."""
+
 class NASMBackend:
-    def __init__(self, ast):
+    def __init__(self, ast, opt_level=2, abi=HOST_ABI):
         self.ast = ast
-        self.data = []
-        self.text = []
+        self.opt_level = opt_level
+        self.abi = abi
+        self.out = None     # AsmStream; functions are written out as they are finished
+        self.ndata = 0      # lines in the data section
         self.externs = set()
+        self.imports = set()   # libraries to link
         self.globals = set(["main"])
+        self.strings = {}   # text -> data label
+        self.stats = {}
+        self.types = None
+        self.code = []      # machine instructions of the function being selected
+        self.vars = {}      # variable -> VReg
+        self.vregs = 0
+        self.labels = 0
+        self.terminated = False
+        self.fold = True   # constant folding on the typed AST
+        self.strength_reduce = opt_level > 0   # shifts, lea and multiply-high for constant operands
+        self.vectorize = opt_level > 0   # AVX2 loops for element-wise comprehensions, behind a CPUID check
+        self.avx2 = False   # whether the generated code calls __plasma_avx2
 
     def build(self):
+        asm = self.emit()
+        try:
+            return asm.getvalue()
+        finally:
+            asm.close()
+
+    def emit(self):
+        """Generate the program into an AsmStream (self.out) one function at a time."""
+        self.out = AsmStream()
+        self.out.write("data", ["section .data"])
+        with phase("typecheck"):
+            self.stats["maps"] = inline_maps(self.ast)
+            self.ast, self.stats["dropped"] = tree_shake(self.ast)
+            if any(isinstance(x, LambdaNode) for n in self.ast for x in iter_nodes(n)):
+                raise CompileError("NASM backend: closures need -backend llvm")
+            self.types = TypeInference(self.ast).run()
+            if self.fold: self.stats["folded"] = fold_constants(self.ast)
+        self.stats.update(instructions=0, memory_accesses=0, spill_slots=0, peephole_removed=0, peephole={}, vector_loops=0)
+        with phase("codegen"):
+            for node in self.ast:
+                if isinstance(node, ExternNode): self.externs.add(node.name)
+                elif isinstance(node, ImportNode): self.imports.add(node.lib)
+                elif isinstance(node, FuncNode): self._func(node)
+            self._generate()
+        count(functions=sum(isinstance(n, FuncNode) for n in self.ast), constants=self.ndata,
+              asm_instructions=self.stats["instructions"])
+        return self.out
+
+    def _check_type(self, t):
+        if t not in NASM_TYPES: raise CompileError(f"NASM backend: {t} values need -backend llvm")
+
+    def _vreg(self):
+        self.vregs += 1
+        return VReg(self.vregs)
+
+    def _label(self):
+        self.labels += 1
+        return Label(f".L{self.labels}")
+
+    def _emit(self, op, *args):
+        self.code.append(Ins(op, *args))
+
+    def _place(self, label):
+        self._emit("label", label)
+        self.terminated = False
+
+    def _func(self, node):
+        self.code, self.vars, self.terminated = [], {}, False
+        if len(node.params) > len(self.abi.args):
+            raise CompileError(f"NASM backend: {node.name} takes more than {len(self.abi.args)} arguments")
+        for name, t in self.types.vars[node.name].items():
+            self._check_type(t)
+            self.vars[name] = self._vreg()
+        self._check_type(self.types.rets[node.name])
+        for (pname, _), reg in zip(node.params, self.abi.args):
+            self._emit("mov", self.vars[pname], reg)
+        self._block(node.body.children)
+        if not self.terminated:
+            self._emit("mov", "rax", 0)
+            self._emit("ret")
+        loc, nslots = allocate(self.code, self.abi, spill_all=self.opt_level == 0)
+        lines = print_function(node.name, self.code, self.abi, loc, nslots)
+        if self.opt_level > 0: lines = peephole(lines, self.stats)
+        for k, v in asm_stats(lines).items(): self.stats[k] += v
+        self.stats["spill_slots"] += nslots
+        if node.export: self.globals.add(node.name)
+        self.out.write("text", lines + [""])
+
+    def _block(self, stmts):
+        for stmt in stmts:
+            if self.terminated: break   # code after return is unreachable
+            self._stmt(stmt)
+
+    def _stmt(self, stmt):
+        if isinstance(stmt, ReturnNode):
+            self._emit("mov", "rax", self._expr(stmt.expr))
+            self._emit("ret")
+            self.terminated = True
+        elif isinstance(stmt, (LetNode, AssignNode)):
+            self._emit("mov", self.vars[stmt.name], self._expr(stmt.expr))
+        elif isinstance(stmt, IfNode):
+            self._if(stmt)
+        elif isinstance(stmt, WhileNode):
+            self._while(stmt)
+        elif isinstance(stmt, ForNode):
+            if is_range(stmt.iterable): self._for_range(stmt)
+            else: self._for_list(stmt)
+        elif isinstance(stmt, PrintNode):
+            self._print(stmt.expr)
+        elif isinstance(stmt, InlineDgmNode):
+            self._emit("asm", [f"mov eax, {c}" for c in stmt.codes], ("rax",))
+        elif not isinstance(stmt, ImportNode):
+            self._expr(stmt)
+
+    def _branch_unless(self, cond, target):
+        # Compares feed the jump directly instead of going through setcc.
+        if isinstance(cond, BinOpNode) and cond.op in COMPARE_OPS and "text" not in (cond.left.type, cond.right.type):
+            self._emit("jcc", NEGATE[self._compare(cond)], target)
+            return
+        val = self._reg(self._expr(cond))
+        self._emit("test", val, val)
+        self._emit("jcc", "e", target)
+
+    def _if(self, stmt):
+        else_l, end_l = self._label(), self._label()
+        self._branch_unless(stmt.cond, else_l)
+        self._block(stmt.then_body)
+        if not self.terminated: self._emit("jmp", end_l)
+        self._place(else_l)
+        self._block(stmt.else_body)
+        self._place(end_l)
+
+    def _while(self, stmt):
+        head, end = self._label(), self._label()
+        self._place(head)
+        self._branch_unless(stmt.cond, end)
+        self._block(stmt.body)
+        if not self.terminated: self._emit("jmp", head)
+        self._place(end)
+
+    def _for_range(self, stmt):
+        # range(end) / range(start, end) / range(start, end, step), half-open like the VMs;
+        # the bounds are evaluated once, so they are copied out of their variables.
+        args = [self._expr(a) for a in stmt.iterable.args]
+        if len(args) == 1: args = [0] + args
+        start, end, step = args[0], self._src(self._copy(args[1])), self._copy(args[2]) if len(args) == 3 else 1
+        i, head, done = self.vars[stmt.var], self._label(), self._label()
+        self._emit("mov", i, start)
+        self._place(head)
+        if isinstance(step, int):
+            self._emit("cmp", i, end)
+            self._emit("jcc", "ge" if step > 0 else "le", done)
+        else:
+            down, body = self._label(), self._label()
+            self._emit("test", step, step)
+            self._emit("jcc", "le", down)
+            self._emit("cmp", i, end)
+            self._emit("jcc", "ge", done)
+            self._emit("jmp", body)
+            self._place(down)
+            self._emit("cmp", i, end)
+            self._emit("jcc", "le", done)
+            self._place(body)
+        self._block(stmt.body)
+        if not self.terminated:
+            self._emit("add", i, self._src(step))
+            self._emit("jmp", head)
+        self._place(done)
+
+    def _reg(self, val):
+        """val in a register; immediates are materialized."""
+        if not isinstance(val, int): return val
+        v = self._vreg()
+        self._emit("mov", v, val)
+        return v
+
+    def _src(self, val):
+        # x86 ALU immediates are sign-extended 32-bit
+        return self._reg(val) if isinstance(val, int) and not fits_imm32(val) else val
+
+    def _copy(self, val):
+        if isinstance(val, int): return val
+        v = self._vreg()
+        self._emit("mov", v, val)
+        return v
+
+    def _expr(self, e):
+        """Select e; returns a VReg or an int immediate."""
+        if isinstance(e, NumberNode):
+            self._check_type(e.type)
+            return e.value
+        if isinstance(e, BoolNode): return int(e.value)
+        if isinstance(e, StringNode):
+            v = self._vreg()
+            self._emit("lea", v, Addr(sym=self._string(e.value)))
+            return v
+        if isinstance(e, VarNode):
+            if e.name not in self.vars: raise CompileError("NASM backend: function values need -backend llvm")
+            return self.vars[e.name]
+        if isinstance(e, NegNode):
+            val = self._expr(e.expr)
+            return -val if isinstance(val, int) else self._expr_neg(val)
+        if isinstance(e, BinOpNode): return self._binop(e)
+        if isinstance(e, ListNode): return self._list(e)
+        if isinstance(e, ListCompNode): return self._list_comp(e)
+        if isinstance(e, IndexNode): return self._load(self._reg(self._expr(e.target)), self._expr(e.index))
+        if isinstance(e, CallNode) and e.name in BUILTINS and e.name not in self.types.funcs: return self._builtin(e)
+        if isinstance(e, CallNode): return self._call(e)
+        raise CompileError(f"NASM backend: {type(e).__name__} needs -backend llvm")
+
+    def _compare(self, e):
+        """cmp for a comparison; returns its condition code."""
+        l, r = self._reg(self._expr(e.left)), self._src(self._expr(e.right))
+        self._emit("cmp", l, r)
+        return CC[e.op]
+
+    def _binop(self, e):
+        if "text" in (e.left.type, e.right.type): raise CompileError(f"NASM backend: text {e.op} text")
+        if e.op in COMPARE_OPS:
+            v = self._vreg()
+            self._emit("set", self._compare(e), v)
+            return v
+        l, r = self._expr(e.left), self._expr(e.right)
+        if self.strength_reduce and e.op == "*" and isinstance(l, int) != isinstance(r, int):
+            return self._mul_const(r, l) if isinstance(l, int) else self._mul_const(l, r)
+        if self.strength_reduce and e.op in ("/", "%") and isinstance(r, int) and not isinstance(l, int) and 0 < abs(r) < 2**62:
+            return self._div_const(l, r, e.op)
+        v = self._vreg()
+        if e.op in ("/", "%"):
+            # idiv divides rdx:rax; the quotient lands in rax, the remainder in rdx
+            d = self._reg(r)
+            self._emit("mov", "rax", l)
+            self._emit("cqo")
+            self._emit("idiv", d)
+            self._emit("mov", v, "rax" if e.op == "/" else "rdx")
+            return v
+        self._emit("mov", v, l)
+        self._emit({"+": "add", "-": "sub", "*": "imul"}[e.op], v, self._src(r))
+        return v
+
+    def _mul_const(self, x, c):
+        # x * c as shifts and lea: c = ±2^k times 1, 3, 5 or 9
+        n = abs(c)
+        k = (n & -n).bit_length() - 1
+        if c == 1: return x
+        if n == 0: return 0
+        if n >> k not in (1, 3, 5, 9):
+            v = self._vreg()
+            self._emit("mov", v, x)
+            self._emit("imul", v, self._src(c))
+            return v
+        v = self._vreg()
+        if n >> k == 1: self._emit("mov", v, x)
+        else: self._emit("lea", v, Addr(base=x, index=x, scale=(n >> k) - 1))
+        if k: self._emit("shl", v, k)
+        if c < 0: self._emit("neg", v)
+        return v
+
+    def _div_const(self, x, c, op):
+        """x / c or x % c, truncating like idiv, for a constant 0 < |c| < 2^62."""
+        n = abs(c)
+        if n == 1:
+            if op == "%": return 0
+            return x if c == 1 else self._expr_neg(x)
+        q = self._vreg()
+        if n & (n - 1) == 0:
+            # Shift, after biasing negative dividends by n - 1 so the result rounds toward zero.
+            k = n.bit_length() - 1
+            self._emit("mov", q, x)
+            self._emit("sar", q, 63)
+            self._emit("shr", q, 64 - k)
+            self._emit("add", q, x)
+            if op == "%":
+                self._emit("and", q, self._src(-n))
+                r = self._copy(x)
+                self._emit("sub", r, q)
+                return r
+            self._emit("sar", q, k)
+        else:
+            # Multiply by the magic reciprocal and keep the high half (Granlund & Montgomery).
+            m, shift = signed_magic(n)
+            self._emit("mov", "rax", m)
+            self._emit("imulh", x)
+            self._emit("mov", q, "rdx")
+            if m < 0: self._emit("add", q, x)
+            if shift: self._emit("sar", q, shift)
+            sign = self._copy(q)
+            self._emit("shr", sign, 63)
+            self._emit("add", q, sign)
+            if op == "%":
+                r = self._copy(x)
+                self._emit("sub", r, self._mul_const(q, n))
+                return r
+        return self._expr_neg(q) if c < 0 and op == "/" else q
+
+    def _expr_neg(self, x):
+        v = self._copy(x)
+        self._emit("neg", v)
+        return v
+
+    def _call(self, e):
+        if e.name in self.vars: raise CompileError("NASM backend: calls through function values need -backend llvm")
+        if e.name not in self.types.funcs: raise CompileError(f"NASM backend: {e.name}() needs -backend llvm")
+        if len(e.args) > len(self.abi.args):
+            raise CompileError(f"NASM backend: calls with more than {len(self.abi.args)} arguments")
+        extern = isinstance(self.types.funcs[e.name], ExternNode)
+        return self._native_call(e.name, [self._expr(a) for a in e.args], void=extern, c_call=extern)
+
+    def _native_call(self, name, args, void=False, c_call=False):
+        # Arguments are all selected before any argument register is written.
+        for reg, val in zip(self.abi.args, args): self._emit("mov", reg, val)
+        if c_call and self.abi.varargs_al: self._emit("mov", "rax", 0)   # the callee may be varargs; no vector args
+        self._emit("call", Label(name), len(args), c_call)
+        v = self._vreg()
+        self._emit("mov", v, 0 if void else "rax")   # Extern functions return nothing, like in the LLVM backend
+        return v
+
+    # -------------------------
+    # Lists
+    # -------------------------
+    # A list is one malloc'd block, the length followed by the elements, and
+    # its value is the block's address. Like the LLVM backend's buffers it is
+    # never freed.
+    def _alloc_list(self, n):
+        if isinstance(n, int): size = 8 * n + 8
+        else:
+            size = self._copy(n)
+            self._emit("shl", size, 3)
+            self._emit("add", size, 8)
+        self.externs.add("malloc")
+        lst = self._native_call("malloc", [size], c_call=True)
+        self._emit("mov", Addr(base=lst), n)
+        return lst
+
+    def _load(self, lst, i):
+        v = self._vreg()
+        self._emit("mov", v, Addr(base=lst, disp=8 + 8 * i) if isinstance(i, int) else Addr(base=lst, index=self._reg(i), scale=8, disp=8))
+        return v
+
+    def _length(self, lst):
+        n = self._vreg()
+        self._emit("mov", n, Addr(base=lst))
+        return n
+
+    def _list(self, e):
+        lst = self._alloc_list(len(e.items))
+        for k, item in enumerate(e.items): self._emit("mov", Addr(base=lst, disp=8 + 8 * k), self._expr(item))
+        return lst
+
+    def _builtin(self, e):
+        lst = self._reg(self._expr(e.args[0]))
+        n = self._length(lst)
+        if e.name == "len": return n
+        acc, i, head, done = self._vreg(), self._vreg(), self._label(), self._label()
+        self._emit("mov", acc, 0)
+        self._emit("mov", i, 0)
+        self._place(head)
+        self._emit("cmp", i, n)
+        self._emit("jcc", "ge", done)
+        self._emit("add", acc, self._load(lst, i))
+        self._emit("add", i, 1)
+        self._emit("jmp", head)
+        self._place(done)
+        return acc
+
+    def _for_list(self, stmt):
+        # The list is read once, so the body may reassign its variable.
+        lst = self._copy(self._expr(stmt.iterable))
+        n, i, head, done = self._length(lst), self._vreg(), self._label(), self._label()
+        self._emit("mov", i, 0)
+        self._place(head)
+        self._emit("cmp", i, n)
+        self._emit("jcc", "ge", done)
+        self._emit("mov", self.vars[stmt.var], self._load(lst, i))
+        self._block(stmt.body)
+        if not self.terminated:
+            self._emit("add", i, 1)
+            self._emit("jmp", head)
+        self._place(done)
+
+    def _range_len(self, start, end, step):
+        """Element count of range(start, end, step) for a constant step."""
+        stride = abs(step)
+        if isinstance(start, int) and isinstance(end, int):
+            return max(0, -((start - end if step > 0 else end - start) // stride))
+        span = self._copy(end if step > 0 else start)
+        self._emit("sub", span, self._src(start if step > 0 else end))
+        if stride > 1:
+            self._emit("add", span, stride - 1)
+            span = self._div_const(span, stride, "/")
+        zero = self._reg(0)
+        self._emit("cmp", span, 0)
+        self._emit("cmov", "l", span, zero)
+        return span
+
+    def _list_comp(self, e):
+        # One scalar loop that writes through an output pointer. Element-wise
+        # bodies get an AVX2 loop ahead of it, which leaves at least the last
+        # element to the scalar loop so the loop variable ends up the same.
+        x = self.vars[e.var]
+        if is_range(e.source):
+            args = [self._expr(a) for a in e.source.args]
+            if len(args) == 1: args = [0] + args
+            step = args[2] if len(args) == 3 else 1
+            if not isinstance(step, int) or step == 0 or not fits_imm32(LANES * step):
+                raise CompileError("NASM backend: comprehensions over a range with a variable step need -backend llvm")
+            start, n, src = args[0], self._range_len(args[0], args[1], step), None
+        else:
+            lst = self._copy(self._expr(e.source))
+            n, src = self._length(lst), self._vreg()
+            self._emit("lea", src, Addr(base=lst, disp=8))
+        buf = self._alloc_list(n)
+        out, i = self._vreg(), self._vreg()
+        self._emit("lea", out, Addr(base=buf, disp=8))
+        self._emit("mov", i, 0)
+        if src is None: self._emit("mov", x, start)
+        head, skip, done = self._label(), self._label(), self._label()
+        plan = self._vector_plan(e.expr, e.var, src is None) if self.vectorize and e.cond is None else None
+        if plan: self._vector_loop(plan, n, i, src, out, x, step if src is None else None, head)
+        self._place(head)
+        self._emit("cmp", i, self._src(n))
+        self._emit("jcc", "ge", done)
+        if src is not None:
+            self._emit("mov", x, Addr(base=src))
+            self._emit("add", src, 8)
+        if e.cond is not None: self._branch_unless(e.cond, skip)
+        self._emit("mov", Addr(base=out), self._expr(e.expr))
+        self._emit("add", out, 8)
+        self._place(skip)
+        self._emit("add", i, 1)
+        if src is None: self._emit("add", x, step)
+        self._emit("jmp", head)
+        self._place(done)
+        if e.cond is not None:
+            count = self._copy(out)
+            self._emit("sub", count, buf)
+            self._emit("sub", count, 8)
+            self._emit("sar", count, 3)
+            self._emit("mov", Addr(base=buf), count)
+        return buf
+
+    # -------------------------
+    # AVX2 element-wise loops
+    # -------------------------
+    # Four 64-bit lanes per ymm register. AVX2 has 64-bit add and subtract
+    # but no 64-bit multiply (vpmullq is AVX-512), so products are built
+    # from vpmuludq's 32x32->64 partial products: lo*lo + ((hi*lo + lo*hi) << 32).
+    def _vector_plan(self, e, var, from_range):
+        """ymm code for an element-wise body: + - * and negation over var, int
+        variables and constants. Returns (element register, range step
+        register, {leaf: (register, node)}, kernel, result register), or None
+        when the body has anything else or needs more registers than the ABI
+        leaves free."""
+        def fits(n):
+            if isinstance(n, VarNode): return n.type == "int"
+            if isinstance(n, NumberNode): return n.type == "int"
+            if isinstance(n, NegNode): return n.type == "int" and fits(n.expr)
+            return (isinstance(n, BinOpNode) and n.op in ("+", "-", "*") and n.left.type == n.right.type == "int"
+                    and fits(n.left) and fits(n.right))
+        if not fits(e): return None
+        regs = list(self.abi.vector_regs)
+        def take():
+            if not regs: raise NotImplementedError("out of ymm registers")
+            return regs.pop(0)
+        def shift_of(n):   # k for a multiply by a constant 2^k
+            return n.value.bit_length() - 1 if isinstance(n, NumberNode) and n.value > 0 and n.value & (n.value - 1) == 0 else None
+        def shifted(n): return n.left if shift_of(n.left) is not None else n.right if shift_of(n.right) is not None else None
+        def small(n): return isinstance(n, NumberNode) and 0 <= n.value < 2**32
+        def key(n): return ("var", n.name) if isinstance(n, VarNode) else ("const", n.value)
+        try:
+            xr = take()
+            step4 = take() if from_range else None
+            # Invariant operands are broadcast once, before the loop, into registers the kernel never writes.
+            leaves = {}
+            shifts = {id(c) for n in iter_nodes(e) if isinstance(n, BinOpNode) and n.op == "*" for c in [shifted(n)] if c is not None}
+            for n in iter_nodes(e):
+                if isinstance(n, NegNode) and ("const", 0) not in leaves: leaves[("const", 0)] = (take(), _const(0, "int"))
+                if isinstance(n, (VarNode, NumberNode)) and id(n) not in shifts and key(n) not in leaves \
+                        and not (isinstance(n, VarNode) and n.name == var):
+                    leaves[key(n)] = (take(), n)
+            kernel = []
+            def release(*rs):
+                for r, temp in rs:
+                    if temp: regs.insert(0, r)
+            def gen(n):
+                if isinstance(n, VarNode) and n.name == var: return xr, False
+                if isinstance(n, (VarNode, NumberNode)): return leaves[key(n)][0], False
+                if isinstance(n, NegNode):
+                    a = gen(n.expr)
+                    release(a)
+                    d = take()
+                    kernel.append(Ins("vop", "vpsubq", d, leaves[("const", 0)][0], a[0]))
+                    return d, True
+                if n.op == "*":
+                    const = shifted(n)
+                    if const is not None:
+                        a = gen(n.right if const is n.left else n.left)
+                        release(a)
+                        d = take()
+                        kernel.append(Ins("vshift", "vpsllq", d, a[0], shift_of(const)))
+                        return d, True
+                    left, right = (n.right, n.left) if small(n.left) else (n.left, n.right)
+                    return self._vector_mul(gen(left), gen(right), take, release, kernel, small(right))
+                l, r = gen(n.left), gen(n.right)
+                release(l, r)
+                d = take()
+                kernel.append(Ins("vop", "vpaddq" if n.op == "+" else "vpsubq", d, l[0], r[0]))
+                return d, True
+            res = gen(e)[0]
+        except NotImplementedError:
+            return None
+        return xr, step4, leaves, kernel, res
+
+    def _vector_mul(self, l, r, take, release, kernel, small):
+        """Low 64 bits of l * r in every lane; small when r is a constant below
+        2^32, whose high half adds nothing."""
+        a, b = l[0], r[0]
+        t = take()
+        kernel.append(Ins("vshift", "vpsrlq", t, a, 32))
+        kernel.append(Ins("vop", "vpmuludq", t, t, b))
+        if not small:
+            u = take()
+            kernel.append(Ins("vshift", "vpsrlq", u, b, 32))
+            kernel.append(Ins("vop", "vpmuludq", u, u, a))
+            kernel.append(Ins("vop", "vpaddq", t, t, u))
+            release((u, True))
+        kernel.append(Ins("vshift", "vpsllq", t, t, 32))
+        d = take()
+        kernel.append(Ins("vop", "vpmuludq", d, a, b))
+        kernel.append(Ins("vop", "vpaddq", d, d, t))
+        release(l, r, (t, True))
+        return d, True
+
+    def _vector_loop(self, plan, n, i, src, out, x, step, scalar):
+        """The AVX2 loop over elements [i, (n - 1) & -LANES), taken when __plasma_avx2() says so."""
+        xr, step4, leaves, kernel, res = plan
+        self.avx2 = True
+        self.stats["vector_loops"] += 1
+        ok = self._native_call("__plasma_avx2", [])
+        self._emit("test", ok, ok)
+        self._emit("jcc", "e", scalar)
+        if isinstance(n, int): limit = (n - 1) & -LANES
+        else:
+            limit = self._copy(n)
+            self._emit("sub", limit, 1)
+            self._emit("and", limit, -LANES)
+        for reg, leaf in leaves.values():
+            if _literal(leaf) == 0: self._emit("vop", "vpxor", reg, reg, reg)
+            else: self._emit("vbroadcast", reg, self._src(self._expr(leaf)))
+        if step is not None:
+            lanes = f"__lanes{self.ndata}"
+            self._data(f"{lanes} dq {', '.join(str(k * step) for k in range(LANES))}")
+            self._emit("vbroadcast", xr, x)
+            self._emit("vop", "vpaddq", xr, xr, Addr(sym=lanes))
+            self._emit("vbroadcast", step4, LANES * step)
+        head, done = self._label(), self._label()
+        self._place(head)
+        self._emit("cmp", i, self._src(limit))
+        self._emit("jcc", "ge", done)
+        if src is not None: self._emit("vmov", xr, Addr(base=src, index=i, scale=8))
+        self.code.extend(kernel)
+        self._emit("vmov", Addr(base=out, index=i, scale=8), res)
+        if step is not None:
+            self._emit("vop", "vpaddq", xr, xr, step4)
+            self._emit("add", x, LANES * step)
+        self._emit("add", i, LANES)
+        self._emit("jmp", head)
+        self._place(done)
+        self._emit("vzeroupper")   # no AVX-SSE transition penalty in the C code that follows
+        if src is not None: self._emit("lea", src, Addr(base=src, index=i, scale=8))
+        self._emit("lea", out, Addr(base=out, index=i, scale=8))
+
+    def _string(self, text):
+        if text not in self.strings:
+            self.strings[text] = label = f"__str{len(self.strings)}"
+            self._data(f"{label} db {db(text)}")
+        return self.strings[text]
+
+    def _data(self, line):
+        self.out.write("data", [line])
+        self.ndata += 1
+
+    def _print(self, e):
+        self._check_type(e.type)
+        val = self._expr(e)
+        if e.type == "list:int": return self._print_list(self._reg(val))
+        if e.type == "bool":
+            val, other = self._reg(val), self._vreg()
+            text = self._vreg()
+            self._emit("lea", text, Addr(sym=self._string("true")))
+            self._emit("lea", other, Addr(sym=self._string("false")))
+            self._emit("test", val, val)
+            self._emit("cmov", "e", text, other)
+            val = text
+        self._printf("%lld\n" if e.type == "int" else "%s\n", val)
+
+    def _printf(self, text, *args):
+        fmt = self._vreg()
+        self._emit("lea", fmt, Addr(sym=self._string(text)))
         self.externs.add("printf")
-        self.text.append("main:")
-        for node in self.ast:
-            if isinstance(node, PrintNode):
-                self.data.append('msg db "Hello PlasmaScript NASM!", 10, 0')
-                self.text.append("    lea rcx, [rel msg]")
-                self.text.append("    call printf")
-            elif isinstance(node, InlineDgmNode):
-                for c in node.codes:
-                    self.text.append(f"    mov eax, {c}")
-            elif isinstance(node, ExternNode):
-                self.externs.add(node.name)
-        self.text.append("    xor eax, eax")
-        self.text.append("    ret")
-        return self._generate()
+        self._native_call("printf", [fmt, *args], c_call=True)
+
+    def _print_list(self, lst):
+        # [a, b, c] like the VMs' Python lists
+        n, i, head, done = self._length(lst), self._vreg(), self._label(), self._label()
+        self._printf("[")
+        self._emit("mov", i, 0)
+        self._place(head)
+        self._emit("cmp", i, n)
+        self._emit("jcc", "ge", done)
+        fmt, rest = self._vreg(), self._vreg()
+        self._emit("lea", fmt, Addr(sym=self._string("%lld")))
+        self._emit("lea", rest, Addr(sym=self._string(", %lld")))
+        self._emit("test", i, i)
+        self._emit("cmov", "ne", fmt, rest)
+        self.externs.add("printf")
+        self._native_call("printf", [fmt, self._load(lst, i)], c_call=True)
+        self._emit("add", i, 1)
+        self._emit("jmp", head)
+        self._place(done)
+        self._printf("]\n")
 
     def _generate(self):
-        out = ["section .data"]
-        out.extend(self.data)
-        out.append("")
-        for e in self.externs: out.append(f"extern {e}")
-        out.append("")
-        out.append("section .text")
-        out.extend(self.text)
-        return "\n".join(out)
-
-    def compile(self, output="plasmascript_nasm.exe"):
-        asm = self.build()
-        with open("output.asm","w") as f: f.write(asm)
-        subprocess.run(["nasm","-fwin64","output.asm","-o","output.obj"])
-        subprocess.run(["gcc","output.obj","-o",output,"-lopengl32"])
-        print(f"✅ NASM build: {output}")
+        # externs and globals are only known once every function is done;
+        # the head part sits between data and text in the output
+        head = [f"{AVX2_STATE} dq 0"] if self.avx2 else []
+        head.append("")
+        head.extend(f"extern {e}" for e in sorted(self.externs))
+        head.extend(f"global {g}" for g in sorted(self.globals))
+        head += ["", "section .text"]
+        self.out.write("head", head)
+        if self.avx2: self.out.write("text", AVX2_CHECK)
+
+    def compile(self, output="plasmascript_nasm.exe", assembler=DEFAULT_ASSEMBLER):
+        asm = self.emit()
+        fd, obj = tempfile.mkstemp(prefix="plasmascript-", suffix=".o")
+        os.close(fd)
+        try:
+            with phase("assemble"):
+                if assembler == "builtin":
+                    # encoded in-process into an ELF64 object; only the linker runs
+                    if self.abi.format != "elf64": raise Exception(f"the built-in assembler writes ELF64; {self.abi.name} needs --assembler nasm")
+                    self.stats["relocations"] = write_object(asm.chunks(), obj)["relocations"]
+                else:
+                    fd, src = tempfile.mkstemp(prefix="plasmascript-", suffix=".asm")
+                    try:
+                        with os.fdopen(fd, "w") as f: asm.write_to(f)
+                        subprocess.run(["nasm", f"-f{self.abi.format}", src, "-o", obj], check=True)
+                    finally:
+                        os.remove(src)
+            link_objects([obj], output, sorted(self.imports))
+        finally:
+            asm.close()
+            os.remove(obj)
+        print(f"✅ NASM build: {output} (-O{self.opt_level}, {self.stats['instructions']} instructions,"
+              f" {self.stats['memory_accesses']} memory accesses, {self.stats['spill_slots']} spill slots,"
+              f" peephole removed {self.stats['peephole_removed']}, {self.abi.name}, {assembler} assembler)")
 
 # -------------------------
 # CLI Entrypoint
 # -------------------------
-def main():
-    if len(sys.argv) < 4:
-        print("Usage: plasmascriptc file.ps -backend [llvm|nasm] -o output.exe")
-        sys.exit(1)
-    infile = sys.argv[1]
-    backend = sys.argv[3]
-    outfile = sys.argv[5] if len(sys.argv) > 5 else "a.exe"
+parser = Lark(plasma_grammar, start="program", parser="lalr")
 
-    parser = Lark(plasma_grammar, start="program", parser="lalr")
-    with open(infile) as f: code = f.read()
-    tree = parser.parse(code)
-    ast = PlasmaTransformer().transform(tree).children
+def parse_file(path):
+    with open(path) as f: code = f.read()
+    with phase("parse"): tree = parser.parse(code)
+    with phase("transform"): ast = PlasmaTransformer().transform(tree).children
+    if timing_active(): count(source_lines=code.count("\n") + 1, ast_nodes=sum(1 for n in ast for _ in iter_nodes(n)))
+    return ast
 
-    if backend == "llvm":
-        LLVMBackend(ast).compile(outfile)
-    elif backend == "nasm":
-        NASMBackend(ast).compile(outfile)
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="plasmascriptc",
+                                 usage="plasmascriptc (file.ps | --project DIR) -backend [llvm|nasm] -o output.exe [-O0..-O3] [-j N] [--run]"
+                                       " [--pgo-instrument | --pgo-use PROFILE] [--time-report] [--time-report-json FILE]")
+    ap.add_argument("infile", nargs="?")
+    ap.add_argument("-backend", choices=["llvm", "nasm"], default="llvm")
+    ap.add_argument("-o", dest="outfile", default="a.exe")
+    ap.add_argument("-O", dest="opt_level", type=int, choices=range(4), default=2)
+    ap.add_argument("-j", dest="jobs", type=int, default=os.cpu_count(), help="parallel module compiles")
+    ap.add_argument("--project", metavar="DIR", help="build every .ps module under DIR into one executable")
+    ap.add_argument("--run", action="store_true", help="JIT-compile and run main instead of producing an executable")
+    ap.add_argument("--cache-dir", help="object cache for separately compiled modules")
+    ap.add_argument("--assembler", choices=["builtin", "nasm"], default=DEFAULT_ASSEMBLER,
+                    help="-backend nasm: encode in-process to ELF64, or run the nasm executable")
+    ap.add_argument("--abi", choices=sorted(ABIS), default=HOST_ABI.name,
+                    help="-backend nasm: calling convention and object format (default: this host's)")
+    add_timing_arguments(ap)
+    pgo = ap.add_mutually_exclusive_group()
+    pgo.add_argument("--pgo-instrument", action="store_true",
+                     help="count branches; each run writes $LLVM_PROFILE_FILE (default.proftext)")
+    pgo.add_argument("--pgo-use", metavar="PROFILE", help="optimize with a .profdata (llvm-profdata merge) or .proftext profile")
+    args = ap.parse_args(argv)
+    if (args.infile is None) == (args.project is None):
+        ap.error("give either an input file or --project DIR")
+    if args.backend == "nasm" and (args.run or args.project):
+        ap.error("--run and --project build through LLVM; drop -backend nasm")
+    if (args.pgo_instrument or args.pgo_use) and (args.run or args.backend == "nasm"):
+        ap.error("profile-guided builds produce LLVM executables; drop --run / -backend nasm")
+    profile = "instrument" if args.pgo_instrument else load_profile(args.pgo_use) if args.pgo_use else None
+    enable_timing(args, "plasmascriptc")
+
+    try:
+        if args.backend == "llvm":
+            # LLVM builds go through the module cache so Import'ed .ps modules compile separately
+            with phase("startup"): from plasmascriptc_build import CACHE_DIR, build_program, build_project, run_program
+            cache_dir = args.cache_dir or CACHE_DIR
+            if args.project:
+                build_project(args.project, args.outfile, args.opt_level, cache_dir, args.jobs, pgo=profile)
+            elif args.run:
+                sys.exit(run_program(args.infile, args.opt_level, cache_dir, args.jobs))
+            else:
+                build_program(args.infile, args.outfile, args.opt_level, cache_dir, args.jobs, pgo=profile)
+        elif args.backend == "nasm":
+            NASMBackend(parse_file(args.infile), args.opt_level, ABIS[args.abi]).compile(args.outfile, args.assembler)
+    except CompileError as e:
+        ap.exit(1, f"{ap.prog}: error: {e}\n")
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,242 @@
+# plasmascriptc_build.py
+# PlasmaScript separate compilation — per-module object cache, parallel
+# project builds and linking
+# License: MIT
+
+import hashlib, json, os, re, tempfile, time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import llvmlite.binding as llvm
+from plasmascriptc import LLVMBackend, link_objects, parse_file
+from plasma_timing import active as timing_active, count, merge as merge_timing, phase, start_worker, take as take_timing
+
+CACHE_DIR = os.environ.get("PLASMA_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "plasmascript"))
+IMPORT_RE = re.compile(r'^\s*Import\s+"([^"]+)"', re.M)
+ENTRY_RE = re.compile(r'^\s*(Prog|Main)\b', re.M)
+PHASES = ("parse", "typecheck", "codegen", "optimize", "emit")
+
+def _compiler_version():
+    h = hashlib.sha256()
+    for mod in ("plasmascriptc.py", "plasmascriptc_build.py", "plasmascriptc_runtime.py", "plasmascriptc_pgo.py"):
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), mod), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+COMPILER_VERSION = _compiler_version()
+
+# -------------------------
+# Module graph
+# -------------------------
+class Module:
+    def __init__(self, name, path, source):
+        self.name, self.path, self.source = name, path, source
+        self.deps = []          # PlasmaScript modules this one imports, by name
+        self.key = None
+        self.obj = None
+        self.iface = None
+        self.cached = False
+        self.times = {}         # phase -> seconds
+        self.timing = None      # a pool worker's --time-report phases
+
+def scan_imports(source):
+    # Cheap textual scan so cache hits never need a full parse.
+    return IMPORT_RE.findall(source)
+
+def resolve_import(lib, search):
+    for d in search:
+        path = os.path.join(d, lib + ".ps")
+        if os.path.isfile(path): return path
+    return None
+
+def module_graph(roots, search=()):
+    """Modules reachable from roots through Import, dependencies first."""
+    order, state = [], {}
+    def visit(name, path):
+        if state.get(name) == "active": raise Exception(f"Import cycle through {name}")
+        if name in state: return
+        state[name] = "active"
+        with open(path) as f: mod = Module(name, path, f.read())
+        dirs = [os.path.dirname(os.path.abspath(path))] + list(search)
+        for lib in scan_imports(mod.source):
+            dep = resolve_import(lib, dirs)
+            if dep is None: continue          # native library, linked with -l
+            visit(lib, dep)
+            mod.deps.append(lib)
+        state[name] = "done"
+        order.append(mod)
+    for root in ([roots] if isinstance(roots, str) else roots):
+        visit(os.path.splitext(os.path.basename(root))[0], root)
+    return order
+
+def discover(project_dir):
+    paths = {}
+    for d, _, files in os.walk(project_dir):
+        for f in sorted(files):
+            if not f.endswith(".ps"): continue
+            name = f[:-3]
+            if name in paths: raise Exception(f"Duplicate module {name}: {paths[name]} and {os.path.join(d, f)}")
+            paths[name] = os.path.join(d, f)
+    return [paths[n] for n in sorted(paths)]
+
+# -------------------------
+# Object cache
+# -------------------------
+class ModuleCache:
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, mod, flags, dep_ifaces):
+        h = hashlib.sha256()
+        h.update(COMPILER_VERSION.encode())
+        h.update(json.dumps(flags, sort_keys=True).encode())
+        h.update(mod.source.encode())
+        for iface in dep_ifaces:
+            h.update(json.dumps(iface, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def paths(self, key):
+        base = os.path.join(self.root, key[:2], key)
+        return base + ".o", base + ".iface.json"
+
+    def lookup(self, key):
+        obj, iface = self.paths(key)
+        if not (os.path.exists(obj) and os.path.exists(iface)): return None
+        with open(iface) as f: return obj, json.load(f)
+
+    def store(self, key, obj_bytes, iface):
+        obj, iface_path = self.paths(key)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        # write-then-rename so a concurrent build never sees a torn entry
+        for path, data in ((obj, obj_bytes), (iface_path, json.dumps(iface, indent=1).encode())):
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f: f.write(data)
+            os.replace(tmp, path)
+        return obj
+
+def build_flags(opt_level, pgo=None):
+    flags = {"opt": opt_level, "triple": llvm.get_default_triple(),
+             "cpu": llvm.get_host_cpu_name(), "features": llvm.get_host_cpu_features().flatten()}
+    if pgo is not None: flags["pgo"] = pgo if pgo == "instrument" else pgo.digest()
+    return flags
+
+def compile_module(mod, ifaces, opt_level, cache, pgo=None):
+    """Compile one module against its dependencies' interfaces, reusing the cache."""
+    dep_ifaces = [ifaces[d] for d in mod.deps]
+    with phase("cache"):
+        mod.key = cache.key(mod, build_flags(opt_level, pgo), dep_ifaces)
+        hit = cache.lookup(mod.key)
+    count(modules=1, cached=bool(hit))
+    if hit:
+        mod.obj, mod.iface = hit
+        mod.cached = True
+        return mod
+    t0 = time.perf_counter()
+    ast = parse_file(mod.path)
+    mod.times["parse"] = time.perf_counter() - t0
+    backend = LLVMBackend(ast, opt_level, name=mod.name, interfaces={d: ifaces[d] for d in mod.deps}, pgo=pgo)
+    backend.build()
+    mod.times["typecheck"], mod.times["codegen"] = backend.stats["typecheck_s"], backend.stats["codegen_s"]
+    t0 = time.perf_counter()
+    opt = backend.optimize()
+    t1 = time.perf_counter()
+    mod.iface = json.loads(json.dumps(backend.interface()))
+    with phase("emit"): mod.obj = cache.store(mod.key, backend.tm.emit_object(opt), mod.iface)
+    mod.times["optimize"], mod.times["emit"] = t1 - t0, time.perf_counter() - t1
+    return mod
+
+def _compile_job(mod, ifaces, opt_level, cache_dir, pgo, timed):
+    if timed: start_worker()
+    compile_module(mod, ifaces, opt_level, ModuleCache(cache_dir), pgo)
+    if timed: mod.timing = take_timing()
+    return mod
+
+def compile_modules(mods, opt_level, cache_dir, jobs=1, pgo=None):
+    """Compile mods (dependencies first), running independent modules in a process pool."""
+    if jobs <= 1 or len(mods) <= 1:
+        cache, ifaces = ModuleCache(cache_dir), {}
+        for mod in mods:
+            compile_module(mod, ifaces, opt_level, cache, pgo)
+            ifaces[mod.name] = mod.iface
+        return mods
+    done, pending, running = {}, {m.name: m for m in mods}, {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for mod in [m for m in pending.values() if all(d in done for d in m.deps)]:
+                del pending[mod.name]
+                ifaces = {d: done[d].iface for d in mod.deps}
+                running[pool.submit(_compile_job, mod, ifaces, opt_level, cache_dir, pgo, timing_active())] = mod.name
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                del running[fut]
+                mod = fut.result()
+                if mod.timing: merge_timing(mod.timing)
+                done[mod.name] = mod
+    return [done[m.name] for m in mods]
+
+def live_modules(mods, entry):
+    """Modules the entry module transitively calls into; the rest stay out of the link."""
+    by_name, live, work = {m.name: m for m in mods}, set(), [entry]
+    while work:
+        name = work.pop()
+        if name in live: continue
+        live.add(name)
+        work.extend(by_name[name].iface["uses"])
+    return [m for m in mods if m.name in live]
+
+def link_libs(mods):
+    return sorted({lib for m in mods for lib in m.iface["libs"]})
+
+def timing_summary(mods, link_s, wall_s):
+    lines = [f"{'module':<24}{'cache':>6}" + "".join(f"{p:>11}" for p in PHASES) + f"{'total':>11}"]
+    totals = dict.fromkeys(PHASES, 0.0)
+    for m in mods:
+        row = [m.times.get(p, 0.0) for p in PHASES]
+        for p, t in zip(PHASES, row): totals[p] += t
+        lines.append(f"{m.name:<24}{'hit' if m.cached else 'miss':>6}" + "".join(f"{t*1000:>9.1f}ms" for t in row) + f"{sum(row)*1000:>9.1f}ms")
+    lines.append(f"{'all modules':<24}{'':>6}" + "".join(f"{totals[p]*1000:>9.1f}ms" for p in PHASES) + f"{sum(totals.values())*1000:>9.1f}ms")
+    lines.append(f"link {link_s*1000:.1f}ms, wall {wall_s*1000:.1f}ms")
+    return "\n".join(lines)
+
+# -------------------------
+# Drivers
+# -------------------------
+def _build(mods, entry, output, opt_level, cache_dir, jobs, t_start, report, pgo):
+    mods = compile_modules(mods, opt_level, cache_dir, jobs, pgo)
+    linked = live_modules(mods, entry)
+    t0 = time.perf_counter()
+    link_objects([m.obj for m in linked], output, link_libs(linked))
+    link_s = time.perf_counter() - t0
+    rebuilt = [m.name for m in mods if not m.cached]
+    unused = [m.name for m in mods if m not in linked]
+    print(f"✅ LLVM build: {output} ({len(mods)} modules, rebuilt {len(rebuilt)}: {', '.join(rebuilt) or '-'}"
+          + (f"; not linked: {', '.join(unused)})" if unused else ")"))
+    if report: print(timing_summary(mods, link_s, time.perf_counter() - t_start))
+    return mods
+
+def build_program(root, output, opt_level=2, cache_dir=CACHE_DIR, jobs=1, report=False, pgo=None):
+    t_start = time.perf_counter()
+    mods = module_graph(root)
+    return _build(mods, mods[-1].name, output, opt_level, cache_dir, jobs, t_start, report, pgo)
+
+def build_project(project_dir, output, opt_level=2, cache_dir=CACHE_DIR, jobs=None, report=True, pgo=None):
+    """Build every .ps file under project_dir and link them into one executable."""
+    t_start = time.perf_counter()
+    paths = discover(project_dir)
+    entries = []
+    for path in paths:
+        with open(path) as f:
+            if ENTRY_RE.search(f.read()): entries.append(path)
+    if len(entries) != 1:
+        raise Exception(f"A project needs exactly one Prog/Main module, found {len(entries)}: {', '.join(entries)}")
+    mods = module_graph(paths, [os.path.dirname(p) for p in paths])
+    entry = os.path.splitext(os.path.basename(entries[0]))[0]
+    return _build(mods, entry, output, opt_level, cache_dir, jobs or os.cpu_count(), t_start, report, pgo)
+
+def run_program(root, opt_level=2, cache_dir=CACHE_DIR, jobs=1):
+    mods = module_graph(root)
+    deps = compile_modules(mods[:-1], opt_level, cache_dir, jobs)
+    main = mods[-1]
+    backend = LLVMBackend(parse_file(main.path), opt_level, name=main.name,
+                          interfaces={d.name: d.iface for d in deps if d.name in main.deps})
+    backend.imports = set(link_libs(deps))
+    return backend.run_jit([m.obj for m in deps])
@@ -0,0 +1,613 @@
+# plasmascriptc_elf.py
+# PlasmaScript built-in assembler — encodes the NASM subset our backends emit
+# into an ELF64 relocatable object, so no nasm subprocess is needed
+# License: MIT
+
+import re, struct, sys
+
+# Covers what NASMBackend, NASMEmitter and codegen_nasm (runtime included)
+# produce: 8/32/64-bit integer instructions over registers, movd/movq loads
+# into xmm registers, the VEX-encoded AVX2 integer subset of NASMBackend's
+# vector loops, [base + index*scale + disp] and [rel sym] memory, labels
+# with NASM's .local scoping, db/dw/dd/dq data (dd/dq also take float
+# literals) and resb..resq reservations in .text/.data/.bss. Encodings follow NASM's defaults: the shortest
+# immediate form, mov r64, imm as mov r32 when it zero-extends, short jumps
+# wherever they reach. References that stay inside a section are resolved
+# here; the rest become R_X86_64_PC32 (data) or R_X86_64_PLT32 (call/jmp)
+# relocations against the section or the extern symbol.
+
+REG64 = ("rax", "rcx", "rdx", "rbx", "rsp", "rbp", "rsi", "rdi",
+         "r8", "r9", "r10", "r11", "r12", "r13", "r14", "r15")
+REG32 = ("eax", "ecx", "edx", "ebx", "esp", "ebp", "esi", "edi",
+         "r8d", "r9d", "r10d", "r11d", "r12d", "r13d", "r14d", "r15d")
+REG8 = ("al", "cl", "dl", "bl", "spl", "bpl", "sil", "dil",
+        "r8b", "r9b", "r10b", "r11b", "r12b", "r13b", "r14b", "r15b")
+REGS = {**{r: (n, 64) for n, r in enumerate(REG64)}, **{r: (n, 32) for n, r in enumerate(REG32)},
+        **{r: (n, 8) for n, r in enumerate(REG8)},
+        **{f"xmm{n}": (n, 128) for n in range(16)}, **{f"ymm{n}": (n, 256) for n in range(16)}}
+SIZES = {"byte": 8, "word": 16, "dword": 32, "qword": 64}
+CC = {"o": 0, "no": 1, "b": 2, "c": 2, "nae": 2, "ae": 3, "nb": 3, "nc": 3, "e": 4, "z": 4, "ne": 5, "nz": 5,
+      "be": 6, "na": 6, "a": 7, "nbe": 7, "s": 8, "ns": 9, "p": 10, "pe": 10, "np": 11, "po": 11,
+      "l": 12, "nge": 12, "ge": 13, "nl": 13, "le": 14, "ng": 14, "g": 15, "nle": 15}
+ALU = {"add": 0, "or": 1, "adc": 2, "sbb": 3, "and": 4, "sub": 5, "xor": 6, "cmp": 7}
+GROUP3 = {"not": 2, "neg": 3, "mul": 4, "div": 6, "idiv": 7}   # and one-operand imul, /5
+SHIFTS = {"rol": 0, "ror": 1, "shl": 4, "sal": 4, "shr": 5, "sar": 7}
+FIXED = {"cqo": b"\x48\x99", "cdq": b"\x99", "leave": b"\xc9", "ret": b"\xc3", "syscall": b"\x0f\x05",
+         "nop": b"\x90", "rep movsb": b"\xf3\xa4", "rep stosb": b"\xf3\xaa",
+         "cpuid": b"\x0f\xa2", "xgetbv": b"\x0f\x01\xd0", "vzeroupper": b"\xc5\xf8\x77"}
+# AVX/AVX2 integer subset: name -> (opcode, map (1 = 0F, 2 = 0F38), pp (1 = 66, 2 = F3), VEX.W)
+VEX = {"vpaddq": (0xd4, 1, 1, 0), "vpsubq": (0xfb, 1, 1, 0), "vpmuludq": (0xf4, 1, 1, 0), "vpxor": (0xef, 1, 1, 0),
+       "vpaddd": (0xfe, 1, 1, 0), "vpsubd": (0xfa, 1, 1, 0), "vpmulld": (0x40, 2, 1, 0),
+       "vpbroadcastq": (0x59, 2, 1, 0), "vmovq": (0x6e, 1, 1, 1)}
+VEX_SHIFTS = {"vpsrlq": 2, "vpsllq": 6}   # 66 0F 73 /n ib
+DATA = {"db": 1, "dw": 2, "dd": 4, "dq": 8}
+RES = {"resb": 1, "resw": 2, "resd": 4, "resq": 8}
+
+R_X86_64_PC32, R_X86_64_PLT32 = 2, 4
+DEFAULT_ASSEMBLER = "nasm" if sys.platform == "win32" else "builtin"   # the writer only produces ELF
+
+class AsmError(Exception):
+    pass
+
+# -------------------------
+# Operands
+# -------------------------
+class Reg:
+    def __init__(self, name):
+        self.name = name
+        self.n, self.size = REGS[name]
+
+class Mem:
+    def __init__(self, size, base=None, index=None, scale=1, disp=0, sym=None):
+        self.size, self.base, self.index, self.scale, self.disp, self.sym = size, base, index, scale, disp, sym
+
+class Imm:
+    def __init__(self, value): self.value = value
+
+class Sym:
+    def __init__(self, name): self.name = name
+
+def _strip_comment(line):
+    quote = None
+    for i, ch in enumerate(line):
+        if quote:
+            if ch == quote: quote = None
+        elif ch in "'\"`": quote = ch
+        elif ch == ";": return line[:i]
+    return line
+
+def _split(text):
+    """Comma-separated operands, commas inside brackets or quotes kept."""
+    parts, depth, quote, cur = [], 0, None, ""
+    for ch in text:
+        if quote:
+            if ch == quote: quote = None
+        elif ch in "'\"`": quote = ch
+        elif ch == "[": depth += 1
+        elif ch == "]": depth -= 1
+        elif ch == "," and depth == 0:
+            parts.append(cur.strip()); cur = ""; continue
+        cur += ch
+    if cur.strip(): parts.append(cur.strip())
+    return parts
+
+def number(text):
+    text = text.strip()
+    if len(text) >= 3 and text[0] == text[-1] and text[0] in "'\"`":
+        return int.from_bytes(text[1:-1].encode("utf8"), "little")
+    neg = text.startswith("-")
+    t = text.lstrip("+-").lower().replace("_", "")
+    if t.startswith("0x"): v = int(t[2:], 16)
+    elif t.endswith("h") and re.fullmatch(r"[0-9][0-9a-f]*h", t): v = int(t[:-1], 16)
+    else: v = int(t, 10)
+    return -v if neg else v
+
+class Assembler:
+    def __init__(self):
+        self.sections = {}     # name -> Section
+        self.section = None
+        self.globals, self.externs = set(), set()
+        self.scope = ""        # last non-local label, for NASM's .local names
+        self.stats = {"instructions": 0, "relocations": 0}
+        self.encoded = {}      # instruction text -> Code/Branch; generated code repeats lines a lot
+
+    # -------------------------
+    # Parsing
+    # -------------------------
+    def _name(self, name):
+        return self.scope + name if name.startswith(".") and not name.startswith("..") else name
+
+    def _operand(self, text):
+        m = re.fullmatch(r"(?:(byte|word|dword|qword)\s+)?\[(.*)\]", text, re.I)
+        if m:
+            size = SIZES[m.group(1).lower()] if m.group(1) else None
+            return self._mem(size, m.group(2))
+        if text.lower() in REGS: return Reg(text.lower())
+        try:
+            return Imm(number(text))
+        except ValueError:
+            pass
+        if re.fullmatch(r"[A-Za-z_.$?@][\w.$?@#~]*", text): return Sym(self._name(text.lstrip("$")))
+        raise AsmError(f"unsupported operand {text}")
+
+    def _mem(self, size, text):
+        text = text.strip()
+        rel = text.lower().startswith("rel ")
+        if rel: text = text[4:]
+        mem = Mem(size)
+        for sign, term in re.findall(r"([+-]?)\s*([^+-]+)", text.replace(" ", "")):
+            term = term.lower() if term.lower() in REGS or "*" in term else term
+            if "*" in term:
+                reg, scale = term.split("*")
+                if reg in ("1", "2", "4", "8"): reg, scale = scale, reg
+                mem.index, mem.scale = Reg(reg), int(scale)
+            elif term in REGS:
+                if mem.base is None: mem.base = Reg(term)
+                else: mem.index = Reg(term)
+            else:
+                try:
+                    mem.disp += -number(term) if sign == "-" else number(term)
+                except ValueError:
+                    if mem.sym or sign == "-": raise AsmError(f"unsupported address [{text}]")
+                    mem.sym = self._name(term)
+        if mem.sym and (mem.base or mem.index):
+            raise AsmError(f"symbol with registers in [{text}] needs an absolute address")
+        return mem
+
+    def feed(self, text):
+        for raw in text.splitlines():
+            line = (_strip_comment(raw) if ";" in raw else raw).strip()
+            if not line: continue
+            item = self.encoded.get((self.scope, line) if "." in line else line)
+            if item is not None:
+                self._sec().items.append(item)
+                self.stats["instructions"] += 1
+                continue
+            try:
+                self._line(line)
+            except AsmError as e:
+                raise AsmError(f"{e} in: {raw.strip()}") from None
+
+    def _line(self, line):
+        word, _, rest = line.partition(" ")
+        low = word.lower()
+        if low in ("section", "segment"):
+            name = rest.split()[0]
+            self.section = self.sections.setdefault(name, Section(name))
+            return
+        if low in ("global", "extern"):
+            names = {n.split(":")[0].strip() for n in rest.split(",")}
+            (self.globals if low == "global" else self.externs).update(names)
+            return
+        if low in ("default", "bits", "align"): return
+        # label: [rest] / label db ... / instruction
+        m = re.match(r"([A-Za-z_.$?@][\w.$?@#~]*)\s*:\s*(.*)", line)
+        if m and m.group(1).lower() not in REGS:
+            self._label(m.group(1))
+            if m.group(2): self._line(m.group(2))
+            return
+        second = rest.split(None, 1)[0].lower() if rest.strip() else ""
+        if second in DATA or second in RES:
+            self._label(word)
+            self._line(rest)
+            return
+        if low in DATA:
+            size = DATA[low]
+            out = bytearray()
+            for item in _split(rest):
+                if item[0] in "'\"" and (size == 1 or len(item) > 3):
+                    out += item[1:-1].encode("utf8")
+                elif size in (4, 8) and re.fullmatch(r"[+-]?\d+\.\d*(?:e[+-]?\d+)?", item, re.I):
+                    out += struct.pack("<f" if size == 4 else "<d", float(item))
+                else:
+                    out += (number(item) & ((1 << 8 * size) - 1)).to_bytes(size, "little")
+            self._sec().data(bytes(out))
+            return
+        if low in RES:
+            self._sec().reserve(RES[low] * number(rest))
+            return
+        item = self.encoded[(self.scope, line) if "." in line else line] = self._instruction(line)   # .local names depend on the scope
+        self._sec().items.append(item)
+        self.stats["instructions"] += 1
+
+    def _sec(self):
+        if self.section is None: self.section = self.sections.setdefault(".text", Section(".text"))
+        return self.section
+
+    def _label(self, name):
+        if not name.startswith("."): self.scope = name
+        self._sec().label(self._name(name))
+
+    # -------------------------
+    # Encoding
+    # -------------------------
+    def _instruction(self, line):
+        op, _, rest = line.partition(" ")
+        op = op.lower()
+        if op == "rep": op, rest = f"rep {rest.strip().lower()}", ""
+        rest = re.sub(r"\s+wrt\s+\.\.plt$", "", rest)   # calls and jumps are PLT32 relocations anyway
+        args = [self._operand(a) for a in _split(rest)]
+        if op in FIXED and not args: return Code(FIXED[op])
+        if op in ("jmp", "call") or (op[:1] == "j" and op[1:] in CC):
+            if len(args) != 1 or not isinstance(args[0], Sym): raise AsmError(f"{op} needs a label")
+            return Branch(op, args[0].name)
+        enc = Encoding()
+        if op in ALU: self._alu(enc, ALU[op], *args)
+        elif op == "mov": self._mov(enc, *args)
+        elif op == "test": self._test(enc, *args)
+        elif op == "lea": enc.modrm(b"\x8d", args[0].n, args[1], 64)
+        elif op == "imul": self._imul(enc, args)
+        elif op in GROUP3: self._group3(enc, GROUP3[op], *args)
+        elif op in ("inc", "dec"):
+            size = self._size(args[0])
+            enc.modrm(b"\xfe" if size == 8 else b"\xff", int(op == "dec"), args[0], size)
+        elif op in SHIFTS: self._shift(enc, SHIFTS[op], *args)
+        elif op.startswith("set") and op[3:] in CC:
+            enc.modrm(bytes([0x0f, 0x90 + CC[op[3:]]]), 0, args[0], 8)
+        elif op.startswith("cmov") and op[4:] in CC:
+            enc.modrm(bytes([0x0f, 0x40 + CC[op[4:]]]), args[0].n, args[1], args[0].size)
+        elif op in ("movd", "movq") and isinstance(args[0], Reg) and args[0].size == 128 and isinstance(args[1], Mem):
+            # loads only: 66 0F 6E /r and F3 0F 7E /r, as NASM picks them
+            if op == "movd": enc.modrm(b"\x0f\x6e", args[0].n, args[1], 32, prefix=b"\x66")
+            else: enc.modrm(b"\x0f\x7e", args[0].n, args[1], 32, prefix=b"\xf3")
+        elif op in ("movzx", "movsx"):
+            src = self._size(args[1])
+            if src not in (8, 16): raise AsmError(f"{op} takes a byte or word source")
+            code = (0xb6 if op == "movzx" else 0xbe) + (src == 16)
+            enc.modrm(bytes([0x0f, code]), args[0].n, args[1], args[0].size, byte_rm=src == 8)
+        elif op == "vmovdqu":
+            # F3 0F 6F loads (and register moves), 7F stores
+            if isinstance(args[0], Mem): enc.vex(0x7f, 1, 2, 0, args[1].n, 0, args[0], args[1].size == 256)
+            else: enc.vex(0x6f, 1, 2, 0, args[0].n, 0, args[1], args[0].size == 256)
+        elif op in VEX:
+            code, map_, pp, w = VEX[op]
+            d, rest = args[0], args[1:]
+            if len(rest) == 1: enc.vex(code, map_, pp, w, d.n, 0, rest[0], d.size == 256)
+            else: enc.vex(code, map_, pp, w, d.n, rest[0].n, rest[1], d.size == 256)
+        elif op in VEX_SHIFTS:
+            d, src, count = args
+            enc.vex(0x73, 1, 1, 0, VEX_SHIFTS[op], d.n, src, d.size == 256, imm=(count.value, 1))
+        elif op in ("push", "pop") and isinstance(args[0], Reg) and args[0].size == 64:
+            n = args[0].n
+            enc.raw((b"\x41" if n >= 8 else b"") + bytes([(0x50 if op == "push" else 0x58) + (n & 7)]))
+        else:
+            raise AsmError(f"unsupported instruction {op}")
+        return enc.done()
+
+    def _size(self, *ops):
+        for o in ops:
+            if isinstance(o, Reg): return o.size
+        for o in ops:
+            if isinstance(o, Mem) and o.size: return o.size
+        raise AsmError("operation size not specified")
+
+    def _alu(self, enc, n, d, s):
+        size = self._size(d, s)
+        if isinstance(s, Imm):
+            v = s.value
+            if size == 8 and isinstance(d, Reg) and d.n == 0: enc.plain(bytes([n * 8 + 4]), 8, imm=(v, 1))
+            elif size == 8: enc.modrm(b"\x80", n, d, 8, imm=(v, 1))
+            elif -128 <= v < 128: enc.modrm(b"\x83", n, d, size, imm=(v, 1))
+            elif isinstance(d, Reg) and d.n == 0: enc.plain(bytes([n * 8 + 5]), size, imm=(v, 4))
+            else: enc.modrm(b"\x81", n, d, size, imm=(v, 4))
+        elif isinstance(s, Reg):
+            enc.modrm(bytes([n * 8 + (0 if size == 8 else 1)]), s.n, d, size)
+        else:
+            enc.modrm(bytes([n * 8 + (2 if size == 8 else 3)]), d.n, s, size)
+
+    def _mov(self, enc, d, s):
+        size = self._size(d, s)
+        if isinstance(s, Imm):
+            v = s.value
+            if isinstance(d, Reg):
+                if size == 64 and not 0 <= v < 2**32:
+                    if -2**31 <= v < 0: enc.modrm(b"\xc7", 0, d, 64, imm=(v, 4))
+                    else: enc.plain(bytes([0xb8 + (d.n & 7)]), 64, b=d.n >> 3, imm=(v, 8))
+                elif size == 8: enc.plain(bytes([0xb0 + (d.n & 7)]), 8, b=d.n >> 3, imm=(v, 1), byte_reg=d)
+                else: enc.plain(bytes([0xb8 + (d.n & 7)]), 32, b=d.n >> 3, imm=(v, 4))
+            elif size == 8: enc.modrm(b"\xc6", 0, d, 8, imm=(v, 1))
+            else: enc.modrm(b"\xc7", 0, d, size, imm=(v, 4))
+        elif isinstance(s, Reg):
+            enc.modrm(b"\x88" if size == 8 else b"\x89", s.n, d, size, byte_reg=s)
+        else:
+            enc.modrm(b"\x8a" if size == 8 else b"\x8b", d.n, s, size, byte_reg=d)
+
+    def _test(self, enc, d, s):
+        size = self._size(d, s)
+        if isinstance(s, Mem): d, s = s, d   # commutative; only test r/m, r exists
+        if isinstance(s, Imm):
+            if isinstance(d, Reg) and d.n == 0:
+                enc.plain(b"\xa8" if size == 8 else b"\xa9", size, imm=(s.value, 1 if size == 8 else 4))
+            else: enc.modrm(b"\xf6" if size == 8 else b"\xf7", 0, d, size, imm=(s.value, 1 if size == 8 else 4))
+        else:
+            enc.modrm(b"\x84" if size == 8 else b"\x85", s.n, d, size, byte_reg=s)
+
+    def _imul(self, enc, args):
+        if len(args) == 1: return self._group3(enc, 5, args[0])
+        d, s, imm = (args + [None])[:3]
+        if isinstance(s, Imm): s, imm = d, s
+        if imm is None: return enc.modrm(b"\x0f\xaf", d.n, s, d.size)
+        if -128 <= imm.value < 128: enc.modrm(b"\x6b", d.n, s, d.size, imm=(imm.value, 1))
+        else: enc.modrm(b"\x69", d.n, s, d.size, imm=(imm.value, 4))
+
+    def _group3(self, enc, n, d):
+        size = self._size(d)
+        enc.modrm(b"\xf6" if size == 8 else b"\xf7", n, d, size)
+
+    def _shift(self, enc, n, d, count):
+        size = self._size(d)
+        if isinstance(count, Reg) and count.name == "cl": enc.modrm(b"\xd2" if size == 8 else b"\xd3", n, d, size)
+        elif count.value == 1: enc.modrm(b"\xd0" if size == 8 else b"\xd1", n, d, size)
+        else: enc.modrm(b"\xc0" if size == 8 else b"\xc1", n, d, size, imm=(count.value, 1))
+
+    # -------------------------
+    # Layout and output
+    # -------------------------
+    def assemble(self):
+        """ELF64 relocatable object bytes."""
+        for sec in self.sections.values(): sec.layout()
+        defined = {}
+        for sec in self.sections.values():
+            for name, off in sec.labels.items():
+                if name in defined: raise AsmError(f"symbol {name} redefined")
+                defined[name] = (sec, off)
+        relocs = {}
+        for sec in self.sections.values():
+            for off, sym, addend, kind in sec.fixups:
+                if sym in defined and defined[sym][0] is sec:
+                    value = defined[sym][1] + addend - off
+                    sec.bytes[off:off + 4] = struct.pack("<i", value)
+                    continue
+                if sym not in defined and sym not in self.externs:
+                    raise AsmError(f"symbol {sym} not defined")
+                relocs.setdefault(sec.name, []).append((off, sym, addend, kind))
+        self.stats["relocations"] = sum(len(r) for r in relocs.values())
+        return write_elf(list(self.sections.values()), defined, self.globals, self.externs, relocs)
+
+class Encoding:
+    """One instruction: legacy prefix, REX, opcode, ModRM/SIB/displacement, immediate."""
+    def __init__(self):
+        self.bytes = b""
+        self.fixup = None   # (offset of disp32, symbol, extra addend)
+
+    def raw(self, b): self.bytes = b
+
+    def _rex(self, w, r, x, b, force):
+        v = 0x40 | (w << 3) | (r << 2) | (x << 1) | b
+        return bytes([v]) if v != 0x40 or force else b""
+
+    def plain(self, opcode, size, b=0, imm=None, byte_reg=None):
+        force = byte_reg is not None and byte_reg.size == 8 and 4 <= byte_reg.n < 8
+        self.bytes = self._rex(size == 64, 0, 0, b, force) + opcode + _imm(imm)
+
+    def modrm(self, opcode, reg, rm, size, imm=None, byte_reg=None, byte_rm=None, prefix=b""):
+        if size == 16: raise AsmError("16-bit operands are not supported")
+        # spl/bpl/sil/dil exist only with a REX prefix
+        force = any(isinstance(o, Reg) and o.size == 8 and 4 <= o.n < 8 for o in (byte_reg, rm))
+        if isinstance(rm, Reg):
+            body, x, b = bytes([0xc0 | (reg & 7) << 3 | (rm.n & 7)]), 0, rm.n >> 3
+            disp_at = None
+        else:
+            body, x, b, disp_at = _address(reg, rm)
+        if size == 64 and imm and imm[1] == 4 and not -2**31 <= imm[0] < 2**31:
+            raise AsmError(f"immediate {imm[0]} does not fit a sign-extended 32 bits")
+        self._finish(prefix + self._rex(size == 64, reg >> 3, x, b, force) + opcode, body, imm, disp_at, rm)
+
+    def vex(self, opcode, map_, pp, w, reg, vvvv, rm, l, imm=None):
+        """VEX-encoded: reg in ModRM.reg, vvvv the extra source, l for 256-bit."""
+        if isinstance(rm, Reg):
+            body, x, b, disp_at = bytes([0xc0 | (reg & 7) << 3 | (rm.n & 7)]), 0, rm.n >> 3, None
+        else:
+            body, x, b, disp_at = _address(reg, rm)
+        tail = (~vvvv & 15) << 3 | int(l) << 2 | pp
+        if map_ == 1 and not (w or x or b):   # the two-byte form, as NASM picks it
+            head = bytes([0xc5, (~reg >> 3 & 1) << 7 | tail])
+        else:
+            head = bytes([0xc4, (~reg >> 3 & 1) << 7 | (~x & 1) << 6 | (~b & 1) << 5 | map_, w << 7 | tail])
+        self._finish(head + bytes([opcode]), body, imm, disp_at, rm)
+
+    def _finish(self, head, body, imm, disp_at, rm):
+        self.bytes = head + body + _imm(imm)
+        if disp_at is not None:
+            off = len(head) + disp_at
+            # PC-relative from the end of the instruction, past any immediate
+            self.fixup = (off, rm.sym, rm.disp - (len(self.bytes) - off))
+
+    def done(self):
+        return Code(self.bytes, self.fixup)
+
+def _imm(imm):
+    if imm is None: return b""
+    v, n = imm
+    if not -(1 << (8 * n - 1)) <= v < (1 << (8 * n)): raise AsmError(f"immediate {v} does not fit {8 * n} bits")
+    return (v & ((1 << 8 * n) - 1)).to_bytes(n, "little")
+
+def _address(reg, m):
+    """ModRM (+SIB, displacement) for a memory operand: (bytes, rex.x, rex.b, offset of a symbol's disp32)."""
+    if m.sym is not None or (m.base is None and m.index is None):
+        if m.sym is None: raise AsmError("absolute addresses are not supported")
+        return bytes([(reg & 7) << 3 | 5]) + b"\0\0\0\0", 0, 0, 1   # [rip + disp32]
+    base, index = m.base, m.index
+    if base is None: raise AsmError("index without a base register is not supported")
+    if index is not None and index.n == 4: raise AsmError("rsp cannot be an index")
+    if m.disp == 0 and base.n & 7 != 5: mod, disp = 0, b""
+    elif -128 <= m.disp < 128: mod, disp = 1, struct.pack("<b", m.disp)
+    else: mod, disp = 2, struct.pack("<i", m.disp)
+    if index is None and base.n & 7 != 4:
+        return bytes([mod << 6 | (reg & 7) << 3 | base.n & 7]) + disp, 0, base.n >> 3, None
+    scale = {1: 0, 2: 1, 4: 2, 8: 3}[m.scale]
+    sib = scale << 6 | ((index.n & 7) if index else 4) << 3 | base.n & 7
+    return bytes([mod << 6 | (reg & 7) << 3 | 4, sib]) + disp, (index.n >> 3) if index else 0, base.n >> 3, None
+
+class Code:
+    def __init__(self, b, fixup=None): self.b, self.fixup = b, fixup
+
+class Branch:
+    def __init__(self, op, target): self.op, self.target = op, target
+
+class Section:
+    def __init__(self, name):
+        self.name = name
+        self.items = []        # Code, Branch, ("label", name), bytes, or an int reservation
+        self.labels = {}
+        self.bytes = bytearray()
+        self.fixups = []       # (offset, symbol, addend, relocation type)
+        self.nobits = name == ".bss"
+
+    def label(self, name): self.items.append(("label", name))
+    def data(self, b): self.items.append(b)
+    def reserve(self, n): self.items.append(n)
+
+    def _size(self, it, i, long):
+        if isinstance(it, Code): return len(it.b)
+        if isinstance(it, Branch): return 5 if it.op == "call" else (5 if it.op == "jmp" else 6) if i in long else 2
+        if isinstance(it, int): return it
+        return 0 if isinstance(it, tuple) else len(it)
+
+    def _labels(self, long):
+        """Label offsets, with the jumps in long taking their rel32 form."""
+        labels, off = {}, 0
+        for i, it in enumerate(self.items):
+            if isinstance(it, tuple): labels[it[1]] = off
+            off += self._size(it, i, long)
+        return labels
+
+    def layout(self):
+        # Branch relaxation: start every jump short and lengthen those that
+        # don't reach until nothing changes (lengths only ever grow).
+        local = {it[1] for it in self.items if isinstance(it, tuple)}
+        long = {i for i, it in enumerate(self.items) if isinstance(it, Branch) and it.op != "call" and it.target not in local}
+        while True:
+            labels = self._labels(long)
+            grew, off = False, 0
+            for i, it in enumerate(self.items):
+                if isinstance(it, Branch) and it.op != "call" and i not in long:
+                    if not -128 <= labels[it.target] - (off + 2) < 128:
+                        long.add(i); grew = True
+                off += self._size(it, i, long)
+            if not grew: break
+        self.labels = labels
+        for i, it in enumerate(self.items):
+            off = len(self.bytes)
+            if isinstance(it, Code):
+                if self.nobits: raise AsmError(f"code in {self.name}")
+                self.bytes += it.b
+                if it.fixup:
+                    at, sym, addend = it.fixup
+                    self.fixups.append((off + at, sym, addend, R_X86_64_PC32))
+            elif isinstance(it, Branch):
+                cc = CC.get(it.op[1:]) if it.op not in ("jmp", "call") else None
+                if it.op != "call" and i not in long:
+                    self.bytes += bytes([0xeb if cc is None else 0x70 + cc]) + struct.pack("<b", labels[it.target] - (off + 2))
+                    continue
+                head = b"\xe8" if it.op == "call" else b"\xe9" if cc is None else bytes([0x0f, 0x80 + cc])
+                self.bytes += head + b"\0\0\0\0"
+                self.fixups.append((off + len(head), it.target, -4, R_X86_64_PLT32))
+            elif isinstance(it, int):
+                self.bytes += bytes(it)
+            elif not isinstance(it, tuple):
+                self.bytes += it
+
+# -------------------------
+# ELF64 writer
+# -------------------------
+SHT_PROGBITS, SHT_SYMTAB, SHT_STRTAB, SHT_RELA, SHT_NOBITS = 1, 2, 3, 4, 8
+SHF_WRITE, SHF_ALLOC, SHF_EXECINSTR, SHF_INFO_LINK = 1, 2, 4, 0x40
+STB_LOCAL, STB_GLOBAL = 0, 1
+STT_NOTYPE, STT_FUNC, STT_SECTION = 0, 2, 3
+
+class StrTab:
+    def __init__(self):
+        self.data, self.index = bytearray(b"\0"), {"": 0}
+    def add(self, s):
+        if s not in self.index:
+            self.index[s] = len(self.data)
+            self.data += s.encode() + b"\0"
+        return self.index[s]
+
+def write_elf(sections, defined, globals_, externs, relocs):
+    shstr, strtab = StrTab(), StrTab()
+    headers = [None]                   # section index -> header fields
+    index = {}
+    blobs = []                         # (section index, bytes) laid out after the ELF header
+    for sec in sections:
+        exec_ = sec.name == ".text" or sec.name.startswith(".text.")
+        flags = SHF_ALLOC | (SHF_EXECINSTR if exec_ else 0 if sec.name.startswith(".rodata") else SHF_WRITE)
+        index[sec.name] = len(headers)
+        headers.append([shstr.add(sec.name), SHT_NOBITS if sec.nobits else SHT_PROGBITS, flags, len(sec.bytes), 0, 0, 16 if exec_ else 8, 0])
+        if not sec.nobits: blobs.append((index[sec.name], bytes(sec.bytes)))
+    # Symbols: null, one per section (relocation targets for local labels),
+    # named local labels, then globals and externs.
+    syms = [(0, 0, 0, 0, 0)]
+    sec_sym = {}
+    for sec in sections:
+        sec_sym[sec.name] = len(syms)
+        syms.append((0, STB_LOCAL << 4 | STT_SECTION, index[sec.name], 0, 0))
+    sym_index = {}
+    for name, (sec, off) in defined.items():
+        if name in globals_ or "." in name[1:] or name.startswith("."): continue
+        sym_index[name] = len(syms)
+        syms.append((strtab.add(name), STB_LOCAL << 4 | STT_NOTYPE, index[sec.name], off, 0))
+    first_global = len(syms)
+    for name in sorted(globals_ | externs):
+        if name in defined:
+            sec, off = defined[name]
+            kind = STT_FUNC if sec.name == ".text" else STT_NOTYPE
+            syms.append((strtab.add(name), STB_GLOBAL << 4 | kind, index[sec.name], off, 0))
+        elif name in externs:
+            syms.append((strtab.add(name), STB_GLOBAL << 4 | STT_NOTYPE, 0, 0, 0))
+        else:
+            raise AsmError(f"global {name} is not defined")
+        sym_index[name] = len(syms) - 1
+    symtab_idx = len(headers) + len(relocs)
+    for sec_name, rs in relocs.items():
+        data = bytearray()
+        for off, sym, addend, kind in rs:
+            if sym in sym_index and (sym in globals_ or sym not in defined):
+                s, a = sym_index[sym], addend
+            else:
+                sec, target = defined[sym]
+                s, a = sec_sym[sec.name], target + addend
+            data += struct.pack("<QQq", off, s << 32 | kind, a)
+        idx = len(headers)
+        headers.append([shstr.add(".rela" + sec_name), SHT_RELA, SHF_INFO_LINK, len(data), symtab_idx, index[sec_name], 8, 24])
+        blobs.append((idx, bytes(data)))
+    symdata = b"".join(struct.pack("<IBBHQQ", n, info, 0, shndx, value, size) for n, info, shndx, value, size in syms)
+    headers.append([shstr.add(".symtab"), SHT_SYMTAB, 0, len(symdata), symtab_idx + 1, first_global, 8, 24])
+    blobs.append((symtab_idx, symdata))
+    headers.append([shstr.add(".strtab"), SHT_STRTAB, 0, len(strtab.data), 0, 0, 1, 0])
+    blobs.append((symtab_idx + 1, bytes(strtab.data)))
+    headers.append([shstr.add(".note.GNU-stack"), SHT_PROGBITS, 0, 0, 0, 0, 1, 0])   # no executable stack
+    shstrndx = len(headers)
+    headers.append([shstr.add(".shstrtab"), SHT_STRTAB, 0, 0, 0, 0, 1, 0])
+    headers[-1][3] = len(shstr.data)
+    blobs.append((shstrndx, bytes(shstr.data)))
+
+    out = bytearray(64)
+    offsets = {}
+    for idx, blob in blobs:
+        align = headers[idx][6]
+        out += bytes(-len(out) % align)
+        offsets[idx] = len(out)
+        out += blob
+    out += bytes(-len(out) % 8)
+    shoff = len(out)
+    out += bytes(64)   # null section header
+    for idx, h in enumerate(headers[1:], 1):
+        name, type_, flags, size, link, info, align, entsize = h
+        out += struct.pack("<IIQQQQIIQQ", name, type_, flags, 0, offsets.get(idx, 0), size, link, info, align, entsize)
+    ident = b"\x7fELF" + bytes([2, 1, 1, 0]) + bytes(8)
+    out[:64] = struct.pack("<16sHHIQQQIHHHHHH", ident, 1, 62, 1, 0, 0, shoff, 0, 64, 0, 0, 64, len(headers), shstrndx)
+    return bytes(out)
+
+def assemble(text):
+    """Assemble NASM text to an ELF64 relocatable object; returns (bytes, stats).
+    text may also be an iterable of chunks ending at line breaks (AsmStream.chunks())."""
+    asm = Assembler()
+    for chunk in ([text] if isinstance(text, str) else text): asm.feed(chunk)
+    return asm.assemble(), asm.stats
+
+def write_object(text, path):
+    obj, stats = assemble(text)
+    with open(path, "wb") as f: f.write(obj)
+    return stats
@@ -3,160 +3,547 @@
 # Author: Violet + ChatGPT
 # License: MIT
 
-import os, subprocess
+import os, subprocess, tempfile
+from plasmascriptc import link_objects
+from plasmascriptc_elf import DEFAULT_ASSEMBLER, write_object
+from plasmascriptc_peephole import peephole
+from plasmascriptc_x86 import BYTE_REGS, CC, HOST_ABI, SYSV, WIN64, AsmStream, fits_imm32
+
+OUT_BUF_SIZE = 1 << 16   # same buffer size as the LLVM backend's runtime
 
 class NASMEmitter:
-    def __init__(self):
-        self.asm = []
-        self.data = []
+    def __init__(self, abi=HOST_ABI):
+        self.abi = abi
+        self.out = AsmStream()
+        self.out.write("data", ["section .data"])
+        self.asm = []   # text since the last flush()
         self.externs = set()
         self.globals = set()
+        self.stats = {}
 
     def emit(self, line): self.asm.append(line)
-    def emit_data(self, line): self.data.append(line)
+    def emit_data(self, line): self.out.write("data", [line])
+
+    def flush(self):
+        """Write out the function just emitted."""
+        self.out.write("text", peephole(self.asm, self.stats))
+        self.asm = []
 
     def compile_prog(self, prog_name="main", body=None):
+        arg, plt = self.abi.args[0], self.abi.plt
         self.emit("global main")
         self.externs.add("printf")
         self.emit("section .text")
         self.emit("main:")
+        self.emit("    sub rsp, 40")   # Win64 shadow space; keeps rsp 16-byte aligned at the calls
 
         # Example: print string
         msg = "Hello from PlasmaScript NASM!"
         label = "msg"
         self.emit_data(f'{label} db "{msg}", 10, 0')
-        self.emit(f"    lea rcx, [rel {label}]")
-        self.emit(f"    call printf")
+        self.emit(f"    lea {arg}, [rel {label}]")
+        if self.abi.varargs_al: self.emit("    xor eax, eax")
+        self.emit(f"    call printf{plt}")
 
         # OpenGL sample calls
         self.externs.update(["glClear", "glClearColor"])
 
-        # glClearColor(0.2,0.3,0.3,1.0)
-        self.emit("    movq xmm0, __float64__(0.2)")
-        self.emit("    movq xmm1, __float64__(0.3)")
-        self.emit("    movq xmm2, __float64__(0.3)")
-        self.emit("    movq xmm3, __float64__(1.0)")
-        self.emit("    call glClearColor")
+        # glClearColor(0.2,0.3,0.3,1.0): GLfloat arguments in xmm0-3
+        self.emit_data("clear_color dd 0.2, 0.3, 0.3, 1.0")
+        for i in range(4):
+            self.emit(f"    movd xmm{i}, [rel clear_color+{4 * i}]")
+        self.emit(f"    call glClearColor{plt}")
 
         # glClear(0x4000)
-        self.emit("    mov ecx, 0x4000")
-        self.emit("    call glClear")
+        self.emit(f"    mov {arg}, 0x4000")
+        self.emit(f"    call glClear{plt}")
 
+        self.emit("    add rsp, 40")
         self.emit("    xor eax, eax")
         self.emit("    ret")
+        self.flush()
+
+    def finish(self):
+        """The finished AsmStream: data, then the extern list, then text."""
+        self.flush()
+        head = [""]
+        for ext in sorted(self.externs):
+            head.append(f"extern {ext}")
+        head.append("")
+        self.out.write("head", head)
+        return self.out
 
     def generate(self):
-        out = []
-        out.append("section .data")
-        out.extend(self.data)
-        out.append("")
-        for ext in self.externs:
-            out.append(f"extern {ext}")
-        out.append("")
-        out.extend(self.asm)
-        return "\n".join(out)
-
-def compile_to_exe(output="plasmascript_nasm.exe"):
-    emitter = NASMEmitter()
-    emitter.compile_prog()
-    asm_code = emitter.generate()
+        return self.finish().getvalue()
 
-    with open("output.asm", "w") as f:
-        f.write(asm_code)
-
-    # Assemble and link (Windows)
-    subprocess.run(["nasm", "-fwin64", "output.asm", "-o", "output.obj"])
-    subprocess.run(["gcc", "output.obj", "-o", output, "-lopengl32"])
-
-    print(f"✅ NASM build complete: {output}")
+def compile_to_exe(output="plasmascript_nasm.exe", assembler=DEFAULT_ASSEMBLER, abi=HOST_ABI):
+    emitter = NASMEmitter(abi)
+    emitter.compile_prog()
+    asm_code = emitter.finish()
+
+    fd, obj = tempfile.mkstemp(prefix="plasmascript-", suffix=".o")
+    os.close(fd)
+    try:
+        if assembler == "builtin":
+            # in-process ELF64 object, linked by the system linker
+            if abi.format != "elf64": raise Exception(f"the built-in assembler writes ELF64; {abi.name} needs nasm")
+            write_object(asm_code.chunks(), obj)
+        else:
+            fd, src = tempfile.mkstemp(prefix="plasmascript-", suffix=".asm")
+            try:
+                with os.fdopen(fd, "w") as f: asm_code.write_to(f)
+                subprocess.run(["nasm", f"-f{abi.format}", src, "-o", obj], check=True)
+            finally:
+                os.remove(src)
+        link_objects([obj], output, ["opengl32" if abi is WIN64 else "GL"])
+    finally:
+        asm_code.close()
+        os.remove(obj)
+
+    print(f"✅ NASM build complete: {output} (peephole removed {emitter.stats['peephole_removed']})")
 
 if __name__ == "__main__":
     compile_to_exe()
 
-def codegen_nasm(ast):
-    asm = []
-    data = []
-    bss = []
-
-    # counters
-    labelc = {"if":0,"else":0,"endif":0,"for":0,"func":0}
-    varmap_stack = [{}]
-    varoff = [0]   # stack frame offsets
+PRINT_RUNTIME = [
+    "print_int:",                 # rdi = value; clobbers rax, rcx, rdx, rsi, rdi, r8, r11
+    "  mov rax,rdi",
+    "  mov r8,rdi",
+    "  lea rsi,[rel numbuf+24]",
+    "  dec rsi",
+    "  mov byte [rsi],10",
+    "  test rax,rax",
+    "  jns .digit",
+    "  neg rax",                  # INT64_MIN stays 2^63, which div reads as unsigned
+    ".digit:",
+    "  xor edx,edx",
+    "  mov ecx,10",
+    "  div rcx",
+    "  add dl,'0'",
+    "  dec rsi",
+    "  mov [rsi],dl",
+    "  test rax,rax",
+    "  jnz .digit",
+    "  test r8,r8",
+    "  jns .copy",
+    "  dec rsi",
+    "  mov byte [rsi],'-'",
+    ".copy:",
+    "  lea rdx,[rel numbuf+24]",
+    "  sub rdx,rsi",              # length including the newline
+    "  mov rax,[rel outlen]",
+    "  add rax,rdx",
+    f"  cmp rax,{OUT_BUF_SIZE}",
+    "  jbe .append",
+    "  push rsi",
+    "  push rdx",
+    "  call print_flush",
+    "  pop rdx",
+    "  pop rsi",
+    ".append:",
+    "  lea rdi,[rel outbuf]",
+    "  add rdi,[rel outlen]",
+    "  add [rel outlen],rdx",
+    "  mov rcx,rdx",
+    "  rep movsb",
+    "  ret",
+    "print_flush:",               # write(1, outbuf, outlen) until drained
+    "  lea rsi,[rel outbuf]",
+    "  mov rdx,[rel outlen]",
+    ".loop:",
+    "  test rdx,rdx",
+    "  jz .done",
+    "  mov eax,1",
+    "  mov edi,1",
+    "  syscall",
+    "  test rax,rax",
+    "  jle .done",
+    "  add rsi,rax",
+    "  sub rdx,rax",
+    "  jmp .loop",
+    ".done:",
+    "  mov qword [rel outlen],0",
+    "  ret",
+]
+
+# -------------------------
+# Expression lowering (Sethi-Ullman)
+# -------------------------
+# An RPN expression becomes a tree whose nodes are labelled with the number
+# of registers they need (Sethi & Ullman): a leaf that can sit directly in
+# an instruction as the right operand needs none. The subtree that needs
+# more is evaluated first, so the other one fits in what is left. Only when
+# both sides need the whole pool does the right result wait on the stack.
+# rax and rdx stay out of the pool because idiv takes them; the result ends
+# up in rax.
+EXPR_REGS = ("rcx", "rsi", "rdi", "r8", "r9", "r10", "r11")
+ARITH = {"+": "add", "-": "sub", "*": "imul"}
+
+class ExprNode:
+    def __init__(self, op, kids=(), operand=None):
+        self.op, self.kids, self.operand = op, list(kids), operand
+        self.need = 0
+
+def rpn_tree(expr, lookup):
+    stack = []
+    for t in expr:
+        if t["type"] == "Number": stack.append(ExprNode("imm", operand=int(t["value"])))
+        elif t["type"] == "Var":
+            slot = lookup(t["value"])
+            stack.append(ExprNode("mem" if slot.startswith("[") else "reg", operand=slot))
+        elif t["type"] == "Op" and t["value"] == "neg": stack.append(ExprNode("neg", [stack.pop()]))
+        elif t["type"] == "Op":
+            b, a = stack.pop(), stack.pop()
+            stack.append(ExprNode(t["value"], [a, b]))
+        else: raise Exception(f"Unknown RPN token {t['type']}")
+    if len(stack) != 1: raise Exception("Malformed RPN expression")
+    return stack[0]
+
+def _direct(node, op):
+    # usable as the right operand of op without a register
+    if node.op in ("mem", "reg"): return True
+    return node.op == "imm" and fits_imm32(node.operand) and op not in ("/", "%")
+
+def su_label(node, right_of=None):
+    if not node.kids:
+        node.need = 0 if right_of and _direct(node, right_of) else 1
+    elif node.op == "neg":
+        node.need = su_label(node.kids[0])
+    else:
+        l, r = su_label(node.kids[0]), su_label(node.kids[1], node.op)
+        node.need = max(l, r) if l != r else l + 1
+    return node.need
+
+def _operand(node):
+    return f"qword {node.operand}" if node.op == "mem" else str(node.operand)
+
+def _apply(code, op, r, s):
+    if op in ARITH: code.append(f"  {ARITH[op]} {r},{s}")
+    elif op in ("/", "%"):
+        code += [f"  mov rax,{r}", "  cqo", f"  idiv {s}", f"  mov {r},{'rax' if op == '/' else 'rdx'}"]
+    elif op in CC:
+        code += [f"  cmp {r},{s}", f"  set{CC[op]} {BYTE_REGS[r]}", f"  movzx {r},{BYTE_REGS[r]}"]
+    else: raise Exception(f"Unknown operator {op}")
+
+def _gen(node, regs, code):
+    """Evaluate node into regs[0] (or another of regs); returns the register."""
+    if not node.kids:
+        code.append(f"  mov {regs[0]},{node.operand}")
+        return regs[0]
+    if node.op == "neg":
+        r = _gen(node.kids[0], regs, code)
+        code.append(f"  neg {r}")
+        return r
+    left, right = node.kids
+    if right.need == 0:
+        r = _gen(left, regs, code)
+        _apply(code, node.op, r, _operand(right))
+        return r
+    if left.need >= right.need and right.need < len(regs):
+        r = _gen(left, regs, code)
+        s = _gen(right, [x for x in regs if x != r], code)
+    elif left.need < right.need and left.need < len(regs):
+        s = _gen(right, regs, code)
+        r = _gen(left, [x for x in regs if x != s], code)
+    else:
+        s = _gen(right, regs, code)
+        code.append(f"  push {s}")
+        r = _gen(left, regs, code)
+        s = next(x for x in regs if x != r)
+        code.append(f"  pop {s}")
+    _apply(code, node.op, r, s)
+    return r
+
+def lower_tree(tree, regs=EXPR_REGS):
+    su_label(tree)
+    code = []
+    r = _gen(tree, list(regs), code)
+    if r != "rax": code.append(f"  mov rax,{r}")
+    return code
+
+# -------------------------
+# Counted loops
+# -------------------------
+# A ForLoop runs var from start to end inclusive. Its induction variable
+# lives in a callee-saved register; the enclosing function saves the ones it
+# uses, and when they run out the outermost loops count in memory.
+#
+# The loop is rotated: one guard in front, the compare and branch at the
+# bottom. Bodies of plain statements are unrolled `unroll` times, with
+# a remainder loop for the last trip % unroll iterations. Before lowering,
+# hoist_invariants() moves loop-invariant subexpressions into temporaries
+# assigned just ahead of the loop.
+LOOP_REGS = ("rbx", "r12", "r13", "r14", "r15")   # untouched by expressions and the print runtime
+UNROLL = 4
+PLAIN = ("AssignExpr", "Print", "FunctionCall")   # statements an unrolled body may hold
+
+def block_end(nodes, i):
+    """Index of the BlockEnd closing the IfStart/ForLoop at i, and of its Else (or None)."""
+    depth, els = 0, None
+    for j in range(i, len(nodes)):
+        t = nodes[j]["type"]
+        if t in ("IfStart", "ForLoop"): depth += 1
+        elif t == "Else" and depth == 1: els = j
+        elif t == "BlockEnd":
+            depth -= 1
+            if depth == 0: return j, els
+    raise Exception(f"{nodes[i]['type']} without BlockEnd")
+
+def _expr_tree(expr):
+    stack = []
+    for t in expr:
+        n = (1 if t["value"] == "neg" else 2) if t["type"] == "Op" else 0
+        kids = stack[len(stack) - n:]
+        del stack[len(stack) - n:]
+        stack.append((t, kids))
+    if len(stack) != 1: raise Exception("Malformed RPN expression")
+    return stack[0]
+
+def _expr_rpn(tree):
+    t, kids = tree
+    return [tok for k in kids for tok in _expr_rpn(k)] + [t]
+
+def loop_depth(nodes):
+    """How deeply ForLoops nest inside nodes."""
+    open_blocks, deepest = [], 0
+    for n in nodes:
+        if n["type"] in ("IfStart", "ForLoop"): open_blocks.append(n["type"])
+        elif n["type"] == "BlockEnd": open_blocks.pop()
+        deepest = max(deepest, open_blocks.count("ForLoop"))
+    return deepest
+
+def _invariant(tree, defined):
+    t, kids = tree
+    if t["type"] == "Var": return t["value"] not in defined
+    if t["type"] == "Op" and t["value"] in ("/", "%"):
+        # hoisted code runs even when the loop body doesn't: never move a trap
+        d = kids[1][0]
+        if d["type"] != "Number" or int(d["value"]) in (0, -1): return False
+    return all(_invariant(k, defined) for k in kids)
+
+EXPR_FIELDS = {"AssignExpr": "expr", "ReturnExpr": "expr", "IfStart": "cond"}
+
+def hoist_invariants(nodes, stats=None, temps=None):
+    """Replace loop-invariant subexpressions inside ForLoop bodies with
+    temporaries assigned before the loop, innermost loops first."""
+    temps = [0] if temps is None else temps
+    out, i = [], 0
+    while i < len(nodes):
+        node = nodes[i]
+        if node["type"] != "ForLoop":
+            out.append(node)
+            i += 1
+            continue
+        end, _ = block_end(nodes, i)
+        body = hoist_invariants(nodes[i + 1:end], stats, temps)
+        defined = ({node["var"]} | {n["name"] for n in body if n["type"] == "AssignExpr"}
+                   | {n["var"] for n in body if n["type"] == "ForLoop"})
+        hoisted = {}   # RPN text -> (temporary, RPN)
+
+        def lift(tree):
+            t, kids = tree
+            if kids and _invariant(tree, defined):
+                rpn = _expr_rpn(tree)
+                key = " ".join(str(x["value"]) for x in rpn)
+                if key not in hoisted:
+                    temps[0] += 1
+                    hoisted[key] = (f"__inv{temps[0]}", rpn)
+                return {"type": "Var", "value": hoisted[key][0]}, []
+            return t, [lift(k) for k in kids]
+
+        for k, n in enumerate(body):
+            field = EXPR_FIELDS.get(n["type"])
+            if field: body[k] = dict(n, **{field: _expr_rpn(lift(_expr_tree(n[field])))})
+        pre = [{"type": "AssignExpr", "name": name, "expr": rpn} for name, rpn in hoisted.values()]
+        if stats is not None: stats["hoisted"] = stats.get("hoisted", 0) + len(pre)
+        out += pre + [node] + body + [nodes[end]]
+        i = end + 1
+    return out
+
+def _const(v):
+    if isinstance(v, int): return v
+    if isinstance(v, str) and v.lstrip("-").isdigit(): return int(v)
+    return None
+
+def codegen_nasm(ast, stats=None, unroll=UNROLL, hoist=True, out=None):
+    """Lower the RPN statement list to NASM for Linux (SysV arguments, syscall
+    output, its own _start: link with ld, no libc); stats, if given, receives
+    the peephole, hoisting and unrolling counts. Each function is written out
+    once it is finished: into the "text" part of out (an AsmStream, which is
+    returned) if given, otherwise the program comes back as a string."""
+    if stats is None: stats = {}
+    if hoist: ast = hoist_invariants(ast, stats)
+    stream = AsmStream(("text",)) if out is None else out
+    asm = []   # lines (and placeholders) of the function being generated
+
+    labelc = {}
+    scopes = [{}]   # the function's variables, then one scope per loop keeping its counter in a register
+    varoff = [0]    # stack frame offsets
+    func = None     # placeholders of the function being generated
+    loop_regs = []  # induction registers of the enclosing loops
 
     def fresh_label(prefix):
-        labelc[prefix]+=1
+        labelc[prefix] = labelc.get(prefix, 0) + 1
         return f"{prefix}{labelc[prefix]}"
 
     # allocate variable
     def alloc_var(name):
         varoff[-1]+=8
         slot=f"[rbp-{varoff[-1]}]"
-        varmap_stack[-1][name]=slot
+        scopes[0][name]=slot
         return slot
 
     # lookup variable
     def lookup(name):
-        for scope in reversed(varmap_stack):
+        for scope in reversed(scopes):
             if name in scope: return scope[name]
         raise Exception(f"Undefined variable {name}")
 
-    # lower RPN expr into NASM
-    def lower_expr(expr):
-        code=[]
-        stack=[]
-        for t in expr:
-            if t["type"]=="Number":
-                code.append(f"  mov rax,{t['value']}")
-                stack.append("rax")
-            elif t["type"]=="Var":
-                slot=lookup(t["value"])
-                code.append(f"  mov rax,{slot}")
-                stack.append("rax")
-            elif t["type"]=="Op":
-                b=stack.pop(); a=stack.pop()
-                if t["value"]=="+":
-                    code.append(f"  add {a},{b}")
-                    stack.append(a)
-                elif t["value"]=="-":
-                    code.append(f"  sub {a},{b}")
-                    stack.append(a)
-                elif t["value"]=="*":
-                    code.append(f"  imul {a},{b}")
-                    stack.append(a)
-                elif t["value"]=="/":
-                    code.append(f"  mov rdx,0")
-                    code.append(f"  idiv {b}")
-                    stack.append("rax")
-        return code
-
-    # header
-    asm.append("section .data")
-    asm.append("fmt: db \"%d\",10,0")
-    asm.append("section .text")
-    asm.append("global _start")
+    def assign_slot(name):
+        return next((scope[name] for scope in reversed(scopes) if name in scope), None) or alloc_var(name)
 
-    asm.append("_start:")
-    asm.append("  call main")
-    asm.append("  mov rax,60")
-    asm.append("  xor rdi,rdi")
-    asm.append("  syscall")
+    def lower_expr(expr):
+        return lower_tree(rpn_tree(expr, lookup))
+
+    def placeholder():
+        asm.append([])
+        return asm[-1]
+
+    def finish_function():
+        # callee-saved loop registers go in slots after the locals; the frame
+        # stays a multiple of 16 so calls are aligned
+        if func is None: return
+        for r in sorted(func["regs"], key=LOOP_REGS.index):
+            slot = alloc_var(f"__saved_{r}")
+            func["save"].append(f"  mov {slot},{r}")
+            for restore in func["restores"]: restore.append(f"  mov {r},{slot}")
+        size = (varoff[-1] + 15) // 16 * 16
+        if size: func["frame"].append(f"  sub rsp,{size}")
+        flush()
+
+    def flush():
+        stream.write("text", peephole([line for x in asm for line in (x if isinstance(x, list) else [x])], stats))
+        asm.clear()
+
+    def mem(op):
+        return f"qword {op}" if op.startswith("[") else op
+
+    def compare(iv, bound):
+        if iv.startswith("qword") and bound.startswith("qword"):
+            asm.extend([f"  mov rax,{iv}", f"  cmp rax,{bound}"])
+        else:
+            asm.append(f"  cmp {iv},{bound}")
+
+    def bound_operand(v):
+        """A loop bound as a cmp operand: imm32, register, or a slot (computed once if it's an expression)."""
+        c = _const(v)
+        if c is not None and fits_imm32(c): return str(c)
+        if isinstance(v, str) and c is None: return mem(lookup(v))
+        asm.extend(lower_expr(v) if c is None else [f"  mov rax,{c}"])
+        slot = alloc_var(fresh_label("__bound"))
+        asm.append(f"  mov {slot},rax")
+        return mem(slot)
+
+    def set_iv(iv, v):
+        c = _const(v)
+        if c is None and not isinstance(v, str):
+            asm.extend(lower_expr(v))
+            src = "rax"
+        else:
+            src = str(c) if c is not None else lookup(v)
+        if iv.startswith("qword") and (src.startswith("[") or (c is not None and not fits_imm32(c))):
+            asm.append(f"  mov rax,{src}")
+            src = "rax"
+        asm.append(f"  mov {iv},{src}")
+
+    def counted(iv, bound, body, copies):
+        # rotated: guard, body copies with an increment after each, compare at the bottom
+        top, done = fresh_label("for"), fresh_label("endfor")
+        compare(iv, bound)
+        asm.append(f"  jg {done}")
+        asm.append(f"{top}:")
+        for _ in range(copies):
+            block(body)
+            asm.append(f"  inc {iv}")
+        compare(iv, bound)
+        asm.append(f"  jle {top}")
+        asm.append(f"{done}:")
+
+    def for_loop(node, body):
+        var = node["var"]
+        slot = assign_slot(var)
+        # inner loops run more often: leave them enough registers first
+        free = [r for r in LOOP_REGS if r not in loop_regs]
+        if len(free) <= loop_depth(body): free = []
+        iv = free[0] if free else mem(slot)
+        set_iv(iv, node["start"])
+        bound = bound_operand(node["end"])
+        if free:
+            func["regs"].add(iv)
+            loop_regs.append(iv)
+            scopes.append({var: iv})
+        written = {n["name"] for n in body if n["type"] == "AssignExpr"}
+        first, last = _const(node["start"]), _const(node["end"])
+        short = first is not None and last is not None and last - first + 1 < unroll
+        if (unroll > 1 and free and not short and all(n["type"] in PLAIN for n in body)
+                and var not in written and not (isinstance(node["end"], str) and node["end"] in written)):
+            # the unrolled loop runs while iv + unroll - 1 <= end, the remainder loop finishes
+            if last is not None and fits_imm32(last - unroll + 1):
+                limit = str(last - unroll + 1)
+            else:
+                limit = mem(alloc_var(fresh_label("__limit")))
+                asm.extend([f"  mov rax,{bound}", f"  sub rax,{unroll - 1}", f"  mov {limit},rax"])
+            counted(iv, limit, body, unroll)
+            stats["unrolled"] = stats.get("unrolled", 0) + 1
+        counted(iv, bound, body, 1)
+        if free:
+            scopes.pop()
+            loop_regs.pop()
+            asm.append(f"  mov {slot},{iv}")   # the variable keeps its final value after the loop
+
+    def if_block(node, then, other):
+        lbl_else = fresh_label("else")
+        lbl_end = fresh_label("endif") if other is not None else lbl_else
+        asm.extend(lower_expr(node["cond"]))
+        asm.append("  test rax,rax")
+        asm.append(f"  jz {lbl_else}")
+        block(then)
+        if other is not None:
+            asm.append(f"  jmp {lbl_end}")
+            asm.append(f"{lbl_else}:")
+            block(other)
+        asm.append(f"{lbl_end}:")
+
+    def block(nodes):
+        k = 0
+        while k < len(nodes):
+            node = nodes[k]
+            if node["type"] in ("IfStart", "ForLoop"):
+                end, els = block_end(nodes, k)
+                if node["type"] == "ForLoop": for_loop(node, nodes[k + 1:end])
+                else: if_block(node, nodes[k + 1:els if els is not None else end], None if els is None else nodes[els + 1:end])
+                k = end + 1
+            else:
+                statement(node)
+                k += 1
 
-    # generate
-    i=0
-    while i<len(ast):
-        node=ast[i]
+    def statement(node):
+        nonlocal func
 
         # function declarations
         if node["type"]=="FunctionDecl":
+            finish_function()
             fname=node["name"]
             asm.append(f"{fname}:")
             asm.append("  push rbp")
             asm.append("  mov rbp,rsp")
-            varmap_stack.append({})
+            del scopes[1:]
+            scopes[0] = {}
             varoff.append(0)
+            func = {"frame": placeholder(), "save": placeholder(), "restores": [], "regs": set()}
 
             # map args into [rbp-]
-            regs=["rdi","rsi","rdx","rcx","r8","r9"]
+            regs=SYSV.args
             for ai,a in enumerate(node["args"]):
                 slot=alloc_var(a)
                 asm.append(f"  mov {slot},{regs[ai]}")
@@ -164,14 +551,15 @@ def codegen_nasm(ast):
         elif node["type"]=="ReturnExpr":
             code=lower_expr(node["expr"])
             asm.extend(code)
+            func["restores"].append(placeholder())
             asm.append("  mov rsp,rbp")
             asm.append("  pop rbp")
             asm.append("  ret")
 
         elif node["type"]=="AssignExpr":
-            slot=alloc_var(node["name"])
             code=lower_expr(node["expr"])
             asm.extend(code)
+            slot=assign_slot(node["name"])
             asm.append(f"  mov {slot},rax")
 
         elif node["type"]=="Print":
@@ -185,7 +573,7 @@ def codegen_nasm(ast):
 
         elif node["type"]=="FunctionCall":
             args=node["args"]
-            regs=["rdi","rsi","rdx","rcx","r8","r9"]
+            regs=SYSV.args
             for ai,a in enumerate(args):
                 if a.isdigit():
                     asm.append(f"  mov {regs[ai]},{a}")
@@ -194,51 +582,33 @@ def codegen_nasm(ast):
                     asm.append(f"  mov {regs[ai]},{slot}")
             asm.append(f"  call {node['name']}")
 
-        elif node["type"]=="IfStart":
-            lbl_else=fresh_label("else")
-            lbl_end=fresh_label("endif")
-            code=lower_expr(node["cond"])
-            asm.extend(code)
-            asm.append("  cmp rax,0")
-            asm.append(f"  je {lbl_else}")
-            node["else_label"]=lbl_else
-            node["end_label"]=lbl_end
+        elif node["type"] in ("Else", "BlockEnd"):
+            raise Exception(f"{node['type']} without IfStart/ForLoop")
 
-        elif node["type"]=="Else":
-            lbl_end=fresh_label("endif")
-            asm.append(f"  jmp {lbl_end}")
-            asm.append(f"{node['else_label']}:")
-            node["end_label"]=lbl_end
-
-        elif node["type"]=="BlockEnd":
-            if "end_label" in node:
-                asm.append(f"{node['end_label']}:")
-
-        elif node["type"]=="ForLoop":
-            var=node["var"]
-            start=node["start"]; end=node["end"]
-            slot=alloc_var(var)
-            lbl_loop=fresh_label("for")
-            lbl_end=fresh_label("endfor")
-            asm.append(f"  mov rax,{start}")
-            asm.append(f"  mov {slot},rax")
-            asm.append(f"{lbl_loop}:")
-            asm.append(f"  mov rax,{slot}")
-            asm.append(f"  cmp rax,{end}")
-            asm.append(f"  jg {lbl_end}")
-
-        i+=1
-
-    # builtin print_int
-    asm.append("print_int:")
-    asm.append("  push rbp")
-    asm.append("  mov rbp,rsp")
-    asm.append("  mov rsi,rdi")
-    asm.append("  mov rdi,fmt")
-    asm.append("  xor rax,rax")
-    asm.append("  call printf wrt ..plt")
-    asm.append("  mov rsp,rbp")
-    asm.append("  pop rbp")
-    asm.append("  ret")
-
-    return "\n".join(asm)
+    # header
+    asm.append("section .bss")
+    asm.append(f"outbuf: resb {OUT_BUF_SIZE}")
+    asm.append("outlen: resq 1")
+    asm.append("numbuf: resb 24")
+    asm.append("section .text")
+    asm.append("global _start")
+
+    asm.append("_start:")
+    asm.append("  call main")
+    asm.append("  call print_flush")
+    asm.append("  mov rax,60")
+    asm.append("  xor rdi,rdi")
+    asm.append("  syscall")
+
+    # generate
+    block(ast)
+    finish_function()
+    flush()   # the header, when there is no function
+
+    # builtin print_int: itoa into numbuf, append to outbuf, write(2) only when full
+    stream.write("text", PRINT_RUNTIME)
+
+    if out is not None: return out
+    text = stream.getvalue()
+    stream.close()
+    return text
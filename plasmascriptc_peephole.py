@@ -0,0 +1,184 @@
+# plasmascriptc_peephole.py
+# PlasmaScript peephole optimizer — a pattern table over windows of emitted
+# NASM lines, shared by NASMBackend, NASMEmitter and codegen_nasm
+# License: MIT
+
+import re
+from plasmascriptc_x86 import NEGATE
+
+# Works on the printed assembly, after register allocation, so it sees the
+# moves and jumps allocation and block layout leave behind. Instruction
+# lines are indented; "name:" lines are labels; anything else (directives,
+# data) is a barrier no pattern looks across. Each pattern gets the line list
+# and a position and returns (lines consumed, replacement) or None; after a
+# rewrite the scan backs up by the widest window so new matches are found.
+WIDTH = {}   # register name -> (64-bit family, bits)
+for _names, _bits in ((("rax", "rcx", "rdx", "rbx", "rsp", "rbp", "rsi", "rdi"), 64),
+                      (("eax", "ecx", "edx", "ebx", "esp", "ebp", "esi", "edi"), 32),
+                      (("ax", "cx", "dx", "bx", "sp", "bp", "si", "di"), 16),
+                      (("al", "cl", "dl", "bl", "spl", "bpl", "sil", "dil"), 8)):
+    for _i, _r in enumerate(_names):
+        WIDTH[_r] = ("rax", "rcx", "rdx", "rbx", "rsp", "rbp", "rsi", "rdi")[_i], _bits
+for _n in range(8, 16):
+    for _suffix, _bits in (("", 64), ("d", 32), ("w", 16), ("b", 8)):
+        WIDTH[f"r{_n}{_suffix}"] = f"r{_n}", _bits
+
+FLAG_WRITERS = ("cmp", "test", "add", "sub", "and", "or", "xor", "neg", "imul", "idiv", "div")
+FLAG_NEUTRAL = ("mov", "lea", "movzx", "movsx", "push", "pop", "cqo", "cdq", "leave", "nop")
+
+def parse(line):
+    """("ins", op, [operands]) | ("label", name, None) | ("other", line, None)"""
+    text = line.split(";", 1)[0].strip()
+    if line[:1] in (" ", "\t") and text:
+        op, _, rest = text.partition(" ")
+        args = [a.strip() for a in re.split(r",(?![^\[]*\])", rest)] if rest.strip() else []
+        return "ins", op, args
+    if text.endswith(":") and " " not in text: return "label", text[:-1], None
+    return "other", line, None
+
+def family(x):
+    return WIDTH[x][0] if x in WIDTH else None
+
+def is_reg64(x):
+    return x in WIDTH and WIDTH[x][1] == 64
+
+def mentions(operand, reg):
+    """Whether operand reads any part of reg's 64-bit family."""
+    return any(family(tok) == family(reg) for tok in re.findall(r"\w+", operand))
+
+def _ins(lines, i):
+    kind, op, args = parse(lines[i]) if i < len(lines) else ("other", None, None)
+    return (op, args) if kind == "ins" else (None, None)
+
+def _fmt(like, op, *args):
+    indent = like[:len(like) - len(like.lstrip())]
+    sep = ", " if ", " in like else ","
+    return f"{indent}{op} {sep.join(args)}" if args else f"{indent}{op}"
+
+def flags_dead(lines, j):
+    """Whether nothing from lines[j] on reads the flags before redefining them."""
+    for line in lines[j:]:
+        kind, op, args = parse(line)
+        if kind != "ins": return False   # a label may be jumped to with the flags live
+        if op in ("ret", "call") or op in FLAG_WRITERS: return True
+        if op in FLAG_NEUTRAL: continue
+        return False   # jcc, setcc, cmovcc, adc, jmp and anything unknown
+    return False
+
+# -------------------------
+# Patterns
+# -------------------------
+def push_pop(lines, i):
+    # push X / pop Y -> mov Y, X (nothing when they are the same register)
+    (op1, a1), (op2, a2) = _ins(lines, i), _ins(lines, i + 1)
+    if op1 != "push" or op2 != "pop" or not (is_reg64(a1[0]) and is_reg64(a2[0])): return None
+    return 2, [] if a1[0] == a2[0] else [_fmt(lines[i], "mov", a2[0], a1[0])]
+
+def self_move(lines, i):
+    op, a = _ins(lines, i)
+    if op == "mov" and len(a) == 2 and a[0] == a[1] and a[0] in WIDTH and WIDTH[a[0]][1] == 64: return 1, []
+    return None
+
+def move_back(lines, i):
+    # mov A, B / mov B, A -> mov A, B
+    (op1, a1), (op2, a2) = _ins(lines, i), _ins(lines, i + 1)
+    if op1 == op2 == "mov" and a1 == a2[::-1] and (is_reg64(a1[0]) or is_reg64(a1[1])) and a1[0] != a1[1]:
+        return 2, [lines[i]]
+    return None
+
+def store_load(lines, i):
+    # mov [m], R / mov R2, [m] -> mov [m], R / mov R2, R
+    (op1, a1), (op2, a2) = _ins(lines, i), _ins(lines, i + 1)
+    if op1 != "mov" or op2 != "mov" or "[" not in a1[0] or not is_reg64(a1[1]) or not is_reg64(a2[0]): return None
+    if a2[1].replace("qword ", "") != a1[0].replace("qword ", ""): return None
+    return 2, [lines[i]] if a2[0] == a1[1] else [lines[i], _fmt(lines[i + 1], "mov", a2[0], a1[1])]
+
+def dead_write(lines, i):
+    # mov R, X / mov R, Y -> mov R, Y when Y doesn't read R (likewise lea and a zeroing xor)
+    (op1, a1), (op2, a2) = _ins(lines, i), _ins(lines, i + 1)
+    if op1 not in ("mov", "lea") or not a1 or a1[0] not in WIDTH: return None
+    # 32-bit writes clear the upper half too, narrower ones merge
+    if op2 not in ("mov", "lea", "xor") or not a2 or family(a2[0]) != family(a1[0]) or WIDTH[a2[0]][1] < 32: return None
+    if op2 == "xor" and a2[1] != a2[0]: return None
+    if op2 != "xor" and mentions(a2[1], a2[0]): return None
+    return 2, [lines[i + 1]]
+
+def redundant_zero(lines, i):
+    # a register zeroed twice in a row
+    (op1, a1), (op2, a2) = _ins(lines, i), _ins(lines, i + 1)
+    zero = lambda op, a: (op == "xor" and len(a) == 2 and a[0] == a[1]) or (op == "mov" and len(a) == 2 and a[1] == "0")
+    if zero(op1, a1) and zero(op2, a2) and a1[0] in WIDTH and family(a1[0]) == family(a2[0]) and WIDTH[a1[0]][1] >= 32:
+        return 2, [lines[i]]
+    return None
+
+def mov_zero(lines, i):
+    # mov r64, 0 -> xor r32, r32: shorter and dependency-breaking, but it writes the flags
+    op, a = _ins(lines, i)
+    if op != "mov" or len(a) != 2 or a[1] != "0" or not is_reg64(a[0]) or not flags_dead(lines, i + 1): return None
+    r32 = next(r for r, (f, bits) in WIDTH.items() if f == a[0] and bits == 32)
+    return 1, [_fmt(lines[i], "xor", r32, r32)]
+
+def jump_to_next(lines, i):
+    # jmp L / jcc L straight into L (possibly past other labels)
+    op, a = _ins(lines, i)
+    if op is None or not op.startswith("j") or len(a) != 1: return None
+    j = i + 1
+    while j < len(lines) and parse(lines[j])[0] == "label":
+        if parse(lines[j])[1] == a[0]: return 1, []
+        j += 1
+    return None
+
+def jump_over_jump(lines, i):
+    # jcc L1 / jmp L2 / L1: -> jncc L2 / L1:
+    (op1, a1), (op2, a2) = _ins(lines, i), _ins(lines, i + 1)
+    if op1 is None or op1[1:] not in NEGATE or op2 != "jmp": return None
+    if i + 2 >= len(lines) or parse(lines[i + 2])[:2] != ("label", a1[0]): return None
+    return 2, [_fmt(lines[i], "j" + NEGATE[op1[1:]], a2[0])]
+
+def unreachable(lines, i):
+    # instructions after jmp/ret up to the next label
+    op, _ = _ins(lines, i)
+    if op not in ("jmp", "ret"): return None
+    j = i + 1
+    while j < len(lines) and parse(lines[j])[0] == "ins": j += 1
+    return (j - i, [lines[i]]) if j > i + 1 else None
+
+# name -> (window, rewrite); the window is how many lines a pattern inspects
+PATTERNS = {
+    "push_pop": (2, push_pop),
+    "self_move": (1, self_move),
+    "move_back": (2, move_back),
+    "store_load": (2, store_load),
+    "dead_write": (2, dead_write),
+    "redundant_zero": (2, redundant_zero),
+    "mov_zero": (1, mov_zero),
+    "jump_to_next": (1, jump_to_next),
+    "jump_over_jump": (3, jump_over_jump),
+    "unreachable": (1, unreachable),
+}
+BACKUP = max(w for w, _ in PATTERNS.values())
+
+def count_ins(lines):
+    return sum(parse(l)[0] == "ins" for l in lines)
+
+def peephole(lines, stats=None, patterns=PATTERNS):
+    """Rewrite lines until no pattern matches. Adds the number of instructions
+    removed, and how often each pattern fired, to stats."""
+    out, i = list(lines), 0
+    hits = {}
+    while i < len(out):
+        for name, (_, rewrite) in patterns.items():
+            m = rewrite(out, i)
+            if m is None: continue
+            n, new = m
+            out[i:i + n] = new
+            hits[name] = hits.get(name, 0) + 1
+            i = max(i - BACKUP, 0)
+            break
+        else:
+            i += 1
+    if stats is not None:
+        stats["peephole_removed"] = stats.get("peephole_removed", 0) + count_ins(lines) - count_ins(out)
+        fired = stats.setdefault("peephole", {})
+        for name, n in hits.items(): fired[name] = fired.get(name, 0) + n
+    return out
@@ -0,0 +1,163 @@
+# plasmascriptc_pgo.py
+# PlasmaScript profile-guided optimization — edge-counter instrumentation,
+# profile loading through llvm-profdata, and profile annotation of LLVM IR
+# License: MIT
+
+import hashlib, os, subprocess, zlib
+import llvmlite.ir as ir
+from plasmascriptc_runtime import RUNTIME_SIGS
+
+# Instrumented binaries write LLVM's text instrprof format (front-end
+# flavour) to $LLVM_PROFILE_FILE, default.proftext if unset, so runs are
+# merged into an indexed profile with
+#     llvm-profdata merge -o app.profdata *.proftext
+# Each function has an entry counter followed by a taken/not-taken pair per
+# conditional branch, in block order. The hash covers the shape of the
+# control flow, so a stale profile is dropped for functions that changed.
+PROFDATA = os.environ.get("PLASMA_PROFDATA", "llvm-profdata")
+INDEXED_MAGIC = b"\xfflprofi\x81"
+# Per-million coverage cutoffs of the detailed summary, ProfileSummaryBuilder's defaults
+CUTOFFS = (10000, 100000, 200000, 300000, 400000, 500000, 600000, 700000,
+           800000, 900000, 950000, 990000, 999000, 999900, 999990, 999999)
+MAX_WEIGHT = 0xFFFFFFFF   # branch weights are i32
+
+I8P, I32, I64, VOID = ir.IntType(8).as_pointer(), ir.IntType(32), ir.IntType(64), ir.VoidType()
+
+# -------------------------
+# Profiles
+# -------------------------
+class Profile:
+    def __init__(self, records): self.records = records   # pgo name -> (hash, [counts])
+
+    def digest(self):
+        return hashlib.sha256(repr(sorted(self.records.items())).encode()).hexdigest()[:16]
+
+    def summary(self):
+        """(total, max count, max internal count, max function count, number of counts,
+        detailed [(cutoff, min count, num counts)])"""
+        counts = sorted((c for _, cs in self.records.values() for c in cs), reverse=True)
+        total = sum(counts)
+        detailed, acc, i = [], 0, 0
+        for cutoff in CUTOFFS:
+            while i < len(counts) and acc * 1000000 < total * cutoff:
+                acc += counts[i]; i += 1
+            detailed.append((cutoff, counts[i - 1] if i else 0, i))
+        max_fn = max((cs[0] for _, cs in self.records.values() if cs), default=0)
+        max_internal = max((c for _, cs in self.records.values() for c in cs[1:]), default=0)
+        return total, counts[0] if counts else 0, max_internal, max_fn, len(counts), detailed
+
+def parse_proftext(text):
+    records, lines = {}, [l.strip() for l in text.splitlines()]
+    lines = [l for l in lines if l and not l.startswith(("#", ":"))]
+    i = 0
+    while i < len(lines):
+        name, h, n = lines[i], int(lines[i + 1]), int(lines[i + 2])
+        records[name] = (h, [int(c) for c in lines[i + 3:i + 3 + n]])
+        i += 3 + n
+    return Profile(records)
+
+def load_profile(path):
+    """A .profdata (indexed, read back through llvm-profdata) or .proftext profile."""
+    with open(path, "rb") as f: data = f.read()
+    if data.startswith(INDEXED_MAGIC):
+        try:
+            data = subprocess.run([PROFDATA, "merge", "-text", "-o", "-", path],
+                                  capture_output=True, check=True).stdout
+        except FileNotFoundError:
+            raise Exception(f"{path} is an indexed profile; reading it needs {PROFDATA}")
+    return parse_proftext(data.decode())
+
+# -------------------------
+# IR instrumentation and annotation
+# -------------------------
+def branches(fn):
+    return [bb.terminator for bb in fn.blocks if isinstance(bb.terminator, ir.ConditionalBranch)]
+
+def cfg_hash(fn):
+    shape = [bb.name for bb in fn.blocks] + [f"{br.operands[1].name}|{br.operands[2].name}" for br in branches(fn)]
+    return zlib.crc32("\n".join(shape).encode())
+
+def pgo_name(fn):
+    # As with clang, local symbols are qualified by their module.
+    return f"{fn.module.name}:{fn.name}" if fn.linkage in ("internal", "private") else fn.name
+
+def _rt(module, name):
+    ret, params = RUNTIME_SIGS[name]
+    return module.globals.get(name) or ir.Function(module, ir.FunctionType(ret, params), name=name)
+
+def instrument_function(fn):
+    """Add counters to fn; returns its (pgo name, hash, counter array)."""
+    module, sites, h = fn.module, branches(fn), cfg_hash(fn)
+    counters = ir.GlobalVariable(module, ir.ArrayType(I64, 1 + 2 * len(sites)), name=f"__prof_cnts.{fn.name}")
+    counters.linkage = "private"; counters.initializer = ir.Constant(counters.value_type, None)
+    def bump(b, idx):
+        slot = b.gep(counters, [ir.Constant(I32, 0), idx])
+        b.store(b.add(b.load(slot), ir.Constant(I64, 1)), slot)
+    b = ir.IRBuilder(fn.entry_basic_block)
+    b.position_before(fn.entry_basic_block.instructions[0])
+    if fn.name == "main": b.call(_rt(module, "plasma_prof_reset"), [])
+    bump(b, ir.Constant(I32, 0))
+    for i, br in enumerate(sites):
+        b.position_before(br)
+        bump(b, b.select(br.operands[0], ir.Constant(I32, 1 + 2 * i), ir.Constant(I32, 2 + 2 * i)))
+    return pgo_name(fn), h, counters
+
+def emit_profile_writer(module, instrumented):
+    """Register an atexit handler that appends this module's counters to the profile."""
+    if not instrumented: return
+    write = _rt(module, "plasma_prof_write")
+    fnty = ir.FunctionType(VOID, [])
+    writer = ir.Function(module, fnty, name=f"__plasma_prof_write.{module.name}")
+    writer.linkage = "internal"
+    b = ir.IRBuilder(writer.append_basic_block("entry"))
+    for i, (name, h, counters) in enumerate(instrumented):
+        data = bytearray(name.encode() + b"\0")
+        gv = ir.GlobalVariable(module, ir.ArrayType(ir.IntType(8), len(data)), name=f"__prof_name.{i}")
+        gv.linkage = "private"; gv.global_constant = True; gv.initializer = ir.Constant(gv.value_type, data)
+        n = counters.value_type.count
+        b.call(write, [gv.bitcast(I8P), ir.Constant(I64, h), ir.Constant(I64, n), b.bitcast(counters, I64.as_pointer())])
+    b.ret_void()
+    atexit = module.globals.get("atexit") or ir.Function(module, ir.FunctionType(I32, [fnty.as_pointer()]), name="atexit")
+    init = ir.Function(module, fnty, name=f"__plasma_prof_init.{module.name}")
+    init.linkage = "internal"
+    b = ir.IRBuilder(init.append_basic_block("entry"))
+    b.call(atexit, [writer])
+    b.ret_void()
+    entry_ty = ir.LiteralStructType([I32, fnty.as_pointer(), I8P])
+    ctors = ir.GlobalVariable(module, ir.ArrayType(entry_ty, 1), name="llvm.global_ctors")
+    ctors.linkage = "appending"
+    ctors.initializer = ir.Constant(ctors.value_type, [ir.Constant(entry_ty, [ir.Constant(I32, 65535), init, ir.Constant(I8P, None)])])
+
+def annotate_function(fn, profile):
+    """Branch weights and entry count for fn from profile; False if it has no usable record."""
+    name = pgo_name(fn)
+    if name not in profile.records: return False
+    h, counts = profile.records[name]
+    sites = branches(fn)
+    if h != cfg_hash(fn) or len(counts) != 1 + 2 * len(sites):
+        print(f"⚠️ profile for {name} is stale (control flow changed), ignoring it")
+        return False
+    module = fn.module
+    fn.set_metadata("prof", module.add_metadata([ir.MetaDataString(module, "function_entry_count"), ir.Constant(I64, counts[0])]))
+    if counts[0] == 0 and fn.name != "main": fn.attributes.add("cold")
+    # Plain scaled counts, as LLVM's IR-level PGO sets them: smoothing every
+    # edge by +1 would turn a single loop exit into two and halve trip counts.
+    scale = max(counts[1:], default=0) // MAX_WEIGHT + 1
+    for i, br in enumerate(sites):
+        taken, not_taken = counts[1 + 2 * i] // scale, counts[2 + 2 * i] // scale
+        if taken or not_taken: br.set_weights([taken, not_taken])
+    return True
+
+def add_profile_summary(module, profile):
+    # With a ProfileSummary, LLVM's ProfileSummaryInfo drives hot call site
+    # inlining, block placement and .text.hot/.text.unlikely function sections.
+    total, max_count, max_internal, max_fn, num_counts, detailed = profile.summary()
+    md = module.add_metadata
+    s = lambda text: ir.MetaDataString(module, text)
+    field = lambda key, val: md([s(key), ir.Constant(I64, val)])
+    summary = md([md([s("ProfileFormat"), s("InstrProf")]), field("TotalCount", total), field("MaxCount", max_count),
+                  field("MaxInternalCount", max_internal), field("MaxFunctionCount", max_fn),
+                  field("NumCounts", num_counts), field("NumFunctions", len(profile.records)),
+                  md([s("DetailedSummary"), md([md([ir.Constant(I32, c), ir.Constant(I64, m), ir.Constant(I32, n)])
+                                                for c, m, n in detailed])])])
+    module.add_named_metadata("llvm.module.flags", md([ir.Constant(I32, 1), s("ProfileSummary"), summary]))
@@ -0,0 +1,239 @@
+# plasmascriptc_runtime.py
+# PlasmaScript native runtime — buffered stdout for Print, arena/bump
+# regions and the profile writer of instrumented builds, built as LLVM IR
+# License: MIT
+
+import llvmlite.ir as ir
+import llvmlite.binding as llvm
+
+# Every definition is linkonce_odr: each compiled module links in its own
+# copy, and the linker (or the JIT) keeps one, so all modules of a program
+# share a single output buffer.
+OUT_BUF_SIZE = 1 << 16
+
+I8, I32, I64 = ir.IntType(8), ir.IntType(32), ir.IntType(64)
+F64, VOID = ir.DoubleType(), ir.VoidType()
+I8P = I8.as_pointer()
+
+# Arenas and bump allocators are both regions: a chain of malloc'd chunks
+# with a bump pointer into the newest one. Chunks start with a 16-byte
+# {next, capacity} header and double in size as the region grows.
+REGION = ir.LiteralStructType([I8P, I8P, I8P, I64])   # cur, end, newest chunk, next chunk size
+REGION_P = REGION.as_pointer()
+CHUNK_HEADER = 16
+MIN_CHUNK = 64
+
+RUNTIME_SIGS = {
+    "plasma_write": (VOID, [I8P, I64]),
+    "plasma_flush": (VOID, []),
+    "plasma_put_str": (VOID, [I8P]),
+    "plasma_put_int": (VOID, [I64]),
+    "plasma_put_float": (VOID, [F64]),
+    "plasma_region_new": (REGION_P, [I64]),
+    "plasma_region_refill": (I8P, [REGION_P, I64]),
+    "plasma_region_reset": (VOID, [REGION_P]),
+    "plasma_prof_reset": (VOID, []),
+    "plasma_prof_write": (VOID, [I8P, I64, I64, I64.as_pointer()]),
+}
+RUNTIME_FUNCS = tuple(RUNTIME_SIGS)
+
+def _func(module, name, ret, args, linkage="linkonce_odr"):
+    fn = ir.Function(module, ir.FunctionType(ret, args), name=name)
+    fn.linkage = linkage
+    return fn, ir.IRBuilder(fn.append_basic_block("entry"))
+
+def _global(module, name, ty):
+    gv = ir.GlobalVariable(module, ty, name=name)
+    gv.linkage = "linkonce_odr"; gv.initializer = ir.Constant(ty, None)
+    return gv
+
+def _cstr(m, name, text):
+    data = bytearray(text.encode() + b"\0")
+    gv = ir.GlobalVariable(m, ir.ArrayType(I8, len(data)), name=name)
+    gv.linkage = "private"; gv.unnamed_addr = True; gv.global_constant = True
+    gv.initializer = ir.Constant(gv.value_type, data)
+    return gv.bitcast(I8P)
+
+def runtime_module(triple, data_layout):
+    m = ir.Module(name="plasma_runtime")
+    m.triple, m.data_layout = triple, data_layout
+    libc = lambda name, ret, args: ir.Function(m, ir.FunctionType(ret, args), name=name)
+    write = libc("write", I64, [I32, I8P, I64])
+    memcpy = libc("memcpy", I8P, [I8P, I8P, I64])
+    strlen = libc("strlen", I64, [I8P])
+    snprintf = ir.Function(m, ir.FunctionType(I32, [I8P, I64, I8P], var_arg=True), name="snprintf")
+    buf = _global(m, "plasma_out_buf", ir.ArrayType(I8, OUT_BUF_SIZE))
+    used = _global(m, "plasma_out_len", I64)
+    zero, one = ir.Constant(I64, 0), ir.Constant(I64, 1)
+
+    # write_all(p, n): write(2) until everything is out or the fd fails
+    write_all, b = _func(m, "plasma_write_all", VOID, [I8P, I64], linkage="internal")
+    p, n = write_all.args
+    loop, body, done = (write_all.append_basic_block(x) for x in ("loop", "body", "done"))
+    entry = b.block
+    b.branch(loop)
+    b.position_at_end(loop)
+    off, left = b.phi(I64), b.phi(I64)
+    off.add_incoming(zero, entry); left.add_incoming(n, entry)
+    b.cbranch(b.icmp_signed(">", left, zero), body, done)
+    b.position_at_end(body)
+    r = b.call(write, [ir.Constant(I32, 1), b.gep(p, [off]), left])
+    off.add_incoming(b.add(off, r), body); left.add_incoming(b.sub(left, r), body)
+    b.cbranch(b.icmp_signed(">", r, zero), loop, done)
+    b.position_at_end(done)
+    b.ret_void()
+
+    flush, b = _func(m, "plasma_flush", VOID, [])
+    b.call(write_all, [b.bitcast(buf, I8P), b.load(used)])
+    b.store(zero, used)
+    b.ret_void()
+
+    # plasma_write(p, n): the fast path is a bounds check and a memcpy
+    pw, b = _func(m, "plasma_write", VOID, [I8P, I64])
+    p, n = pw.args
+    end = b.add(b.load(used), n)
+    with b.if_then(b.icmp_unsigned(">", end, ir.Constant(I64, OUT_BUF_SIZE)), likely=False):
+        b.call(flush, [])
+        with b.if_then(b.icmp_unsigned(">=", n, ir.Constant(I64, OUT_BUF_SIZE))):
+            b.call(write_all, [p, n])
+            b.ret_void()
+    at = b.load(used)
+    b.call(memcpy, [b.gep(buf, [ir.Constant(I32, 0), at]), p, n])
+    b.store(b.add(at, n), used)
+    b.ret_void()
+
+    put_str, b = _func(m, "plasma_put_str", VOID, [I8P])
+    b.call(pw, [put_str.args[0], b.call(strlen, [put_str.args[0]])])
+    b.ret_void()
+
+    # plasma_put_int(v): digits are produced backwards into a stack buffer;
+    # the magnitude is treated as unsigned so INT64_MIN prints correctly.
+    put_int, b = _func(m, "plasma_put_int", VOID, [I64])
+    v = put_int.args[0]
+    tmp = b.alloca(ir.ArrayType(I8, 24))
+    neg = b.icmp_signed("<", v, zero)
+    mag = b.select(neg, b.sub(zero, v), v)
+    entry, digit, sign, out = b.block, put_int.append_basic_block("digit"), put_int.append_basic_block("sign"), put_int.append_basic_block("out")
+    b.branch(digit)
+    b.position_at_end(digit)
+    u, pos = b.phi(I64), b.phi(I64)
+    u.add_incoming(mag, entry); pos.add_incoming(ir.Constant(I64, 24), entry)
+    at = b.sub(pos, one)
+    d = b.trunc(b.urem(u, ir.Constant(I64, 10)), I8)
+    b.store(b.add(d, ir.Constant(I8, ord("0"))), b.gep(tmp, [ir.Constant(I32, 0), at]))
+    q = b.udiv(u, ir.Constant(I64, 10))
+    u.add_incoming(q, digit); pos.add_incoming(at, digit)
+    b.cbranch(b.icmp_unsigned("!=", q, zero), digit, sign)
+    b.position_at_end(sign)
+    minus = b.sub(at, one)
+    with b.if_then(neg):
+        b.store(ir.Constant(I8, ord("-")), b.gep(tmp, [ir.Constant(I32, 0), minus]))
+    start = b.select(neg, minus, at)
+    b.branch(out)
+    b.position_at_end(out)
+    b.call(pw, [b.gep(tmp, [ir.Constant(I32, 0), start]), b.sub(ir.Constant(I64, 24), start)])
+    b.ret_void()
+
+    # Floats keep printf's %g rendering; only the output goes through the buffer.
+    put_float, b = _func(m, "plasma_put_float", VOID, [F64])
+    tmp = b.bitcast(b.alloca(ir.ArrayType(I8, 32)), I8P)
+    n = b.call(snprintf, [tmp, ir.Constant(I64, 32), _cstr(m, "plasma_fmt_g", "%g"), put_float.args[0]])
+    b.call(pw, [tmp, b.zext(n, I64)])
+    b.ret_void()
+    _regions(m)
+    _profiling(m)
+    return m
+
+def _field(b, r, i):
+    return b.gep(r, [ir.Constant(I32, 0), ir.Constant(I32, i)])
+
+def _regions(m):
+    malloc = m.globals.get("malloc") or ir.Function(m, ir.FunctionType(I8P, [I64]), name="malloc")
+    malloc.return_value.add_attribute("noalias")
+
+    # plasma_region_refill(r, size): the slow path behind the inlined bump in
+    # LLVMBackend._region_alloc; chains a fresh chunk and allocates from it.
+    refill, b = _func(m, "plasma_region_refill", I8P, [REGION_P, I64])
+    refill.attributes.add("noinline"); refill.attributes.add("cold")
+    r, size = refill.args
+    want = b.load(_field(b, r, 3))
+    cap = b.select(b.icmp_unsigned(">", size, want), size, want)
+    chunk = b.call(malloc, [b.add(cap, ir.Constant(I64, CHUNK_HEADER))])
+    header = b.bitcast(chunk, I8P.as_pointer())
+    b.store(b.load(_field(b, r, 2)), header)
+    b.store(cap, b.bitcast(b.gep(chunk, [ir.Constant(I64, 8)]), I64.as_pointer()))
+    b.store(chunk, _field(b, r, 2))
+    b.store(b.shl(cap, ir.Constant(I64, 1)), _field(b, r, 3))
+    data = b.gep(chunk, [ir.Constant(I64, CHUNK_HEADER)])
+    b.store(b.gep(data, [size]), _field(b, r, 0))
+    b.store(b.gep(data, [cap]), _field(b, r, 1))
+    b.ret(data)
+
+    new, b = _func(m, "plasma_region_new", REGION_P, [I64])
+    r = b.bitcast(b.call(malloc, [ir.Constant(I64, REGION.get_abi_size(llvm.create_target_data(m.data_layout)))]), REGION_P)
+    b.store(ir.Constant(I8P, None), _field(b, r, 2))
+    size = new.args[0]
+    b.store(b.select(b.icmp_signed(">", size, ir.Constant(I64, MIN_CHUNK)), size, ir.Constant(I64, MIN_CHUNK)), _field(b, r, 3))
+    b.call(refill, [r, ir.Constant(I64, 0)])
+    b.ret(r)
+
+    # O(1): rewind into the newest (largest) chunk. Older chunks stay chained;
+    # together they are smaller than the newest, so a reset region never
+    # needs more memory than one round of its workload already took.
+    reset, b = _func(m, "plasma_region_reset", VOID, [REGION_P])
+    r = reset.args[0]
+    chunk = b.load(_field(b, r, 2))
+    cap = b.load(b.bitcast(b.gep(chunk, [ir.Constant(I64, 8)]), I64.as_pointer()))
+    data = b.gep(chunk, [ir.Constant(I64, CHUNK_HEADER)])
+    b.store(data, _field(b, r, 0))
+    b.store(b.gep(data, [cap]), _field(b, r, 1))
+    b.ret_void()
+
+def _profiling(m):
+    # Counters of --pgo-instrument builds leave the process as text instrprof
+    # records (see plasmascriptc_pgo); main truncates the file on entry and
+    # every module appends its functions at exit.
+    libc = lambda name, ret, args: m.globals.get(name) or ir.Function(m, ir.FunctionType(ret, args), name=name)
+    getenv, fopen = libc("getenv", I8P, [I8P]), libc("fopen", I8P, [I8P, I8P])
+    fclose = libc("fclose", I32, [I8P])
+    fprintf = ir.Function(m, ir.FunctionType(I32, [I8P, I8P], var_arg=True), name="fprintf")
+    null = ir.Constant(I8P, None)
+
+    path, b = _func(m, "plasma_prof_path", I8P, [], linkage="internal")
+    env = b.call(getenv, [_cstr(m, "plasma_prof_env", "LLVM_PROFILE_FILE")])
+    b.ret(b.select(b.icmp_unsigned("==", env, null), _cstr(m, "plasma_prof_default", "default.proftext"), env))
+
+    reset, b = _func(m, "plasma_prof_reset", VOID, [])
+    f = b.call(fopen, [b.call(path, []), _cstr(m, "plasma_prof_w", "w")])
+    with b.if_then(b.icmp_unsigned("!=", f, null)):
+        b.call(fclose, [f])
+    b.ret_void()
+
+    write, b = _func(m, "plasma_prof_write", VOID, [I8P, I64, I64, I64.as_pointer()])
+    name, h, n, counts = write.args
+    f = b.call(fopen, [b.call(path, []), _cstr(m, "plasma_prof_a", "a")])
+    with b.if_then(b.icmp_unsigned("==", f, null), likely=False):
+        b.ret_void()
+    header = "%s\n# Func Hash:\n%llu\n# Num Counters:\n%llu\n# Counter Values:\n"
+    b.call(fprintf, [f, _cstr(m, "plasma_prof_header", header), name, h, n])
+    entry, loop, done = b.block, write.append_basic_block("loop"), write.append_basic_block("done")
+    b.cbranch(b.icmp_unsigned("!=", n, ir.Constant(I64, 0)), loop, done)
+    b.position_at_end(loop)
+    i = b.phi(I64)
+    i.add_incoming(ir.Constant(I64, 0), entry)
+    b.call(fprintf, [f, _cstr(m, "plasma_prof_count", "%llu\n"), b.load(b.gep(counts, [i]))])
+    nxt = b.add(i, ir.Constant(I64, 1))
+    i.add_incoming(nxt, loop)
+    b.cbranch(b.icmp_unsigned("!=", nxt, n), loop, done)
+    b.position_at_end(done)
+    b.call(fprintf, [f, _cstr(m, "plasma_prof_end", "\n")])
+    b.call(fclose, [f])
+    b.ret_void()
+
+_parsed = {}
+
+def runtime_ir(triple, data_layout):
+    """The runtime as a parsed llvm.ModuleRef, ready for link_in (which consumes it)."""
+    key = (triple, data_layout)
+    if key not in _parsed: _parsed[key] = str(runtime_module(triple, data_layout))
+    return llvm.parse_assembly(_parsed[key])
@@ -0,0 +1,444 @@
+# plasmascriptc_x86.py
+# PlasmaScript x86-64 machine layer — instructions over virtual registers,
+# liveness, linear-scan register allocation and NASM printing
+# License: MIT
+
+import sys, tempfile
+
+# Instruction selection (NASMBackend) produces a flat list of Ins in
+# two-address x86 form. Register operands are VRegs or physical register
+# names; physical ones pin a value where the ABI or the instruction demands
+# it (arguments, return value, idiv). allocate() gives every VReg a register
+# or a stack slot with Poletto & Sarkar's linear scan over live intervals,
+# and print_function() renders NASM, routing spilled operands through the
+# two scratch registers.
+
+REGS = ("rax", "rcx", "rdx", "rbx", "rsp", "rbp", "rsi", "rdi",
+        "r8", "r9", "r10", "r11", "r12", "r13", "r14", "r15")
+BYTE_REGS = dict(zip(REGS, ("al", "cl", "dl", "bl", "spl", "bpl", "sil", "dil",
+                            "r8b", "r9b", "r10b", "r11b", "r12b", "r13b", "r14b", "r15b")))
+SCRATCH = ("r10", "r11")   # never allocated; spill code and address fixups go through them
+YMM = tuple(f"ymm{n}" for n in range(16))
+
+class ABI:
+    """A calling convention plus the object format and call form that go with it."""
+    def __init__(self, name, args, caller_saved, callee_saved, shadow, format, varargs_al=False, plt="", vector_regs=YMM):
+        self.name, self.args, self.shadow = name, args, shadow
+        self.caller_saved, self.callee_saved = caller_saved, callee_saved
+        self.format = format            # nasm -f
+        self.varargs_al = varargs_al    # al = vector registers used, before calls into C
+        self.plt = plt                  # suffix on calls the linker resolves
+        self.vector_regs = vector_regs  # ymm registers a function may use without saving them
+        # Caller-saved registers first: they cost nothing unless a call is crossed,
+        # and intervals that cross one are kept out of them by the clobbers.
+        self.allocatable = tuple(r for r in caller_saved + callee_saved if r not in SCRATCH + ("rsp", "rbp"))
+
+WIN64 = ABI("win64", args=("rcx", "rdx", "r8", "r9"),
+            caller_saved=("rax", "rcx", "rdx", "r8", "r9", "r10", "r11"),
+            callee_saved=("rbx", "rsi", "rdi", "r12", "r13", "r14", "r15"), shadow=32, format="win64",
+            vector_regs=YMM[:6])   # xmm6-xmm15 are callee-saved
+# Linux x86-64: no shadow space, rsi/rdi caller-saved; C calls go through the
+# PLT so the default PIE links.
+SYSV = ABI("sysv", args=("rdi", "rsi", "rdx", "rcx", "r8", "r9"),
+           caller_saved=("rax", "rcx", "rdx", "rsi", "rdi", "r8", "r9", "r10", "r11"),
+           callee_saved=("rbx", "r12", "r13", "r14", "r15"), shadow=0, format="elf64", varargs_al=True, plt=" wrt ..plt")
+ABIS = {abi.name: abi for abi in (WIN64, SYSV)}
+HOST_ABI = WIN64 if sys.platform == "win32" else SYSV
+
+# -------------------------
+# Machine instructions
+# -------------------------
+class VReg:
+    __slots__ = ("n",)
+    def __init__(self, n): self.n = n
+    def __repr__(self): return f"%{self.n}"
+class Label:
+    def __init__(self, name): self.name = name
+class Addr:
+    def __init__(self, base=None, index=None, scale=1, disp=0, sym=None):
+        self.base, self.index, self.scale, self.disp, self.sym = base, index, scale, disp, sym
+class Slot:
+    def __init__(self, n): self.n = n
+
+class Ins:
+    __slots__ = ("op", "args")
+    def __init__(self, op, *args): self.op, self.args = op, args
+    def __repr__(self): return f"{self.op} {', '.join(map(repr, self.args))}"
+
+ALU = ("add", "sub", "imul", "and", "or", "xor")
+CC = {"==": "e", "!=": "ne", "<": "l", ">": "g", "<=": "le", ">=": "ge"}   # signed compares
+NEGATE = {"e": "ne", "ne": "e", "l": "ge", "ge": "l", "g": "le", "le": "g",
+          "z": "nz", "nz": "z", "b": "ae", "ae": "b", "a": "be", "be": "a", "s": "ns", "ns": "s"}
+UNARY = ("neg", "not", "shl", "sar", "shr")   # dst [, imm count]
+JUMPS = ("jmp", "jcc", "ret")
+# AVX2 over physical ymm registers, which the allocator never sees:
+# vmov dst, src (vmovdqu; either may be an Addr), vop name, dst, a, b,
+# vshift name, dst, src, count, vbroadcast ymm, value (every 64-bit lane)
+# and vzeroupper.
+VECTOR = ("vmov", "vop", "vshift", "vbroadcast", "vzeroupper")
+
+def is_reg(x): return isinstance(x, (VReg, str))
+
+def fits_imm32(x): return isinstance(x, int) and -2**31 <= x < 2**31
+
+def _regs(x):
+    if isinstance(x, Addr): return [r for r in (x.base, x.index) if r is not None]
+    return [x] if is_reg(x) and x not in YMM else []
+
+def defs_uses(ins, abi):
+    """Registers an instruction writes and reads, implicit ones included."""
+    op, a = ins.op, ins.args
+    if op == "mov": return [a[0]], _regs(a[1])
+    if op in ALU: return [a[0]], [a[0]] + _regs(a[1])
+    if op in UNARY: return [a[0]], [a[0]]
+    if op in ("cmp", "test"): return [], _regs(a[0]) + _regs(a[1])
+    if op == "set": return [a[1]], []                        # set cc, dst (setcc + movzx)
+    if op == "cmov": return [a[1]], [a[1]] + _regs(a[2])     # cmov cc, dst, src
+    if op == "lea": return [a[0]], _regs(a[1])
+    if op == "cqo": return ["rdx"], ["rax"]
+    if op == "idiv": return ["rax", "rdx"], ["rax", "rdx"] + _regs(a[0])
+    if op == "imulh": return ["rax", "rdx"], ["rax"] + _regs(a[0])   # rdx:rax = rax * src
+    if op == "call":                                         # call target, nargs, into C
+        return list(abi.caller_saved), list(abi.args[:a[1]]) + (["rax"] if a[2] and abi.varargs_al else [])
+    if op == "ret": return [], ["rax"]
+    if op == "asm": return list(a[1]), []                    # asm lines, clobbers
+    if op in VECTOR: return [], [r for x in a for r in _regs(x)]   # only addresses and broadcast values
+    return [], []                                            # label, jmp, jcc
+
+def signed_magic(d):
+    """(M, s) with x / d == hi64(M * x) >> s, corrected toward zero, for
+    2 <= d < 2**63 (Hacker's Delight, 10-1). M is a signed 64-bit value; when
+    it comes out negative the caller adds x back after the multiply."""
+    two63 = 1 << 63
+    anc = two63 - 1 - two63 % d   # |nc|, for positive x
+    p, q1, r1, q2, r2 = 63, two63 // anc, two63 % anc, two63 // d, two63 % d
+    while True:
+        p += 1
+        q1, r1 = 2 * q1, 2 * r1
+        if r1 >= anc: q1, r1 = q1 + 1, r1 - anc
+        q2, r2 = 2 * q2, 2 * r2
+        if r2 >= d: q2, r2 = q2 + 1, r2 - d
+        delta = d - r2
+        if not (q1 < delta or (q1 == delta and r1 == 0)): break
+    m = (q2 + 1) & (2 ** 64 - 1)
+    return (m - 2 ** 64 if m >= two63 else m), p - 64
+
+# -------------------------
+# Liveness
+# -------------------------
+def _blocks(code):
+    starts = {0}
+    for i, ins in enumerate(code):
+        if ins.op == "label": starts.add(i)
+        elif ins.op in JUMPS: starts.add(i + 1)
+    starts = sorted(s for s in starts if s < len(code))
+    return list(zip(starts, starts[1:] + [len(code)]))
+
+def liveness(code, abi):
+    """Live intervals [first, last] of every VReg, and the busy segments of
+    every physical register."""
+    blocks = _blocks(code)
+    at_label = {code[b0].args[0].name: i for i, (b0, _) in enumerate(blocks) if code[b0].op == "label"}
+    succs, gen, kill = [], [], []
+    for i, (b0, b1) in enumerate(blocks):
+        last = code[b1 - 1]
+        if last.op == "jmp": succs.append([at_label[last.args[0].name]])
+        elif last.op == "ret": succs.append([])
+        elif last.op == "jcc": succs.append([at_label[last.args[1].name]] + ([i + 1] if i + 1 < len(blocks) else []))
+        else: succs.append([i + 1] if i + 1 < len(blocks) else [])
+        g, k = set(), set()
+        for ins in code[b0:b1]:
+            d, u = defs_uses(ins, abi)
+            g |= {r for r in u if isinstance(r, VReg) and r not in k}
+            k |= {r for r in d if isinstance(r, VReg)}
+        gen.append(g); kill.append(k)
+    live_in, live_out = [set() for _ in blocks], [set() for _ in blocks]
+    changed = True
+    while changed:
+        changed = False
+        for i in reversed(range(len(blocks))):
+            out = set().union(*(live_in[s] for s in succs[i]))
+            inn = gen[i] | (out - kill[i])
+            if out != live_out[i] or inn != live_in[i]:
+                live_out[i], live_in[i], changed = out, inn, True
+    intervals, fixed = {}, {}
+    def extend(v, p):
+        iv = intervals.setdefault(v, [p, p])
+        iv[0], iv[1] = min(iv[0], p), max(iv[1], p)
+    for i, (b0, b1) in enumerate(blocks):
+        for v in live_in[i]: extend(v, b0)
+        for v in live_out[i]: extend(v, b1)   # past the last instruction, so its defs can't share
+        busy = {}
+        for p in range(b0, b1):
+            d, u = defs_uses(code[p], abi)
+            for r in u:
+                if isinstance(r, VReg): extend(r, p)
+                elif r in busy: busy[r][1] = p
+                else: fixed.setdefault(r, []).append([b0 - 1, p])   # parameters arrive live
+            for r in d:
+                if isinstance(r, VReg): extend(r, p)
+                else:
+                    busy[r] = [p, p]
+                    fixed.setdefault(r, []).append(busy[r])
+    return intervals, fixed
+
+# -------------------------
+# Linear-scan register allocation
+# -------------------------
+def allocate(code, abi, spill_all=False):
+    """Map every VReg to a register name or a Slot; returns (locations, slot count)."""
+    intervals, fixed = liveness(code, abi)
+    loc, slots = {}, []
+    def spill(v):
+        loc[v] = Slot(len(slots)); slots.append(v)
+    if spill_all:
+        for v in sorted(intervals, key=lambda v: v.n): spill(v)
+        return loc, len(slots)
+    hints = {}
+    for ins in code:
+        if ins.op == "mov" and is_reg(ins.args[0]) and is_reg(ins.args[1]):
+            d, s = ins.args
+            if isinstance(d, VReg): hints.setdefault(d, s)
+            if isinstance(s, VReg): hints.setdefault(s, d)
+    def fits(r, s, e):
+        return all(not (s < b and a < e) for a, b in fixed.get(r, ()))
+    active = []
+    for v in sorted(intervals, key=lambda v: (intervals[v][0], v.n)):
+        s, e = intervals[v]
+        active = [w for w in active if intervals[w][1] > s]   # an interval ending here frees its register
+        taken = {loc[w] for w in active}
+        free = [r for r in abi.allocatable if r not in taken and fits(r, s, e)]
+        hint = hints.get(v)
+        hint = loc.get(hint) if isinstance(hint, VReg) else hint
+        if free:
+            loc[v] = hint if hint in free else free[0]
+            active.append(v)
+            continue
+        # Spill whichever interval ends last, as long as its register can hold v.
+        victims = [w for w in active if fits(loc[w], s, e)]
+        w = max(victims, key=lambda w: intervals[w][1], default=None)
+        if w is not None and intervals[w][1] > e:
+            loc[v] = loc[w]
+            spill(w)
+            active.remove(w); active.append(v)
+        else:
+            spill(v)
+    return loc, len(slots)
+
+# -------------------------
+# NASM printing
+# -------------------------
+class Frame:
+    def __init__(self, loc, nslots, abi, calls):
+        self.loc, self.abi = loc, abi
+        self.saved = sorted({r for r in loc.values() if r in abi.callee_saved}, key=REGS.index)
+        size = 8 * nslots + (abi.shadow if calls else 0)
+        self.size = size + (8 * len(self.saved) + size) % 16   # rsp stays 16-byte aligned at calls
+    def slot(self, s): return f"qword [rbp-{8 * (len(self.saved) + s.n + 1)}]"
+
+def print_function(name, code, abi, loc, nslots):
+    frame = Frame(loc, nslots, abi, any(ins.op == "call" for ins in code))
+    out = [f"{name}:", "  push rbp", "  mov rbp, rsp"]
+    out += [f"  push {r}" for r in frame.saved]
+    if frame.size: out.append(f"  sub rsp, {frame.size}")
+    for ins in code: out += _render(ins, frame)
+    return out
+
+def _epilogue(frame):
+    if not frame.saved: return ["  leave", "  ret"]
+    return [f"  lea rsp, [rbp-{8 * len(frame.saved)}]"] + [f"  pop {r}" for r in reversed(frame.saved)] + ["  pop rbp", "  ret"]
+
+def _render(ins, frame):
+    op, a = ins.op, ins.args
+    pre, fix = [], {}
+    def val(x):
+        """Operand text; a spilled register reads as its stack slot."""
+        if isinstance(x, VReg): x = frame.loc[x]
+        if isinstance(x, Slot): return frame.slot(x)
+        if isinstance(x, Addr): return "qword " + addr(x)
+        if isinstance(x, Label): return x.name
+        return str(x)
+    def mem(x): return isinstance(x, Addr) or (isinstance(x, VReg) and isinstance(frame.loc[x], Slot))
+    def reg(x, scratch):
+        """x in a register, loading it into scratch if it is spilled."""
+        if isinstance(x, VReg) and isinstance(frame.loc[x], Slot):
+            pre.append(f"  mov {scratch}, {val(x)}")
+            return scratch
+        return frame.loc[x] if isinstance(x, VReg) else x
+    def addr(x):
+        if x.sym: return f"[rel {x.sym}]"
+        if id(x) in fix: return fix[id(x)]
+        parts = []
+        base = reg(x.base, "r10") if x.base is not None else None
+        index = reg(x.index, "r11") if x.index is not None else None
+        if base: parts.append(base)
+        if index: parts.append(f"{index}*{x.scale}" if x.scale != 1 else index)
+        text = "+".join(parts) + (f"{x.disp:+d}" if x.disp else "")
+        fix[id(x)] = f"[{text}]"
+        return fix[id(x)]
+    def through_scratch(dst, body, store=True, load=True):
+        # An instruction whose destination must be a register, with dst spilled
+        if mem(dst):
+            return pre + ([f"  mov r11, {val(dst)}"] if load else []) + [body("r11")] + ([f"  mov {val(dst)}, r11"] if store else [])
+        return pre + [body(val(dst))]
+
+    if op == "label": return [f"{a[0].name}:"]
+    if op == "jmp": return [f"  jmp {a[0].name}"]
+    if op == "jcc": return [f"  j{a[0]} {a[1].name}"]
+    if op == "ret": return _epilogue(frame)
+    if op == "call": return [f"  call {a[0].name}{frame.abi.plt if a[2] else ''}"]
+    if op == "cqo": return ["  cqo"]
+    if op == "asm": return [f"  {line}" for line in a[0]]
+    if op == "mov":
+        d, s = a
+        s_text = val(s)
+        if mem(d) and (mem(s) or (isinstance(s, int) and not fits_imm32(s))):
+            return pre + [f"  mov r11, {s_text}", f"  mov {val(d)}, r11"]
+        if not mem(d) and not mem(s) and val(d) == s_text: return pre   # coalesced
+        return pre + [f"  mov {val(d)}, {s_text}"]
+    if op in ALU or op in ("cmp", "test"):
+        d, s = a
+        s_text = val(s)
+        if op == "imul" or mem(s):
+            return through_scratch(d, lambda r: f"  {op} {r}, {s_text}", store=op not in ("cmp", "test"))
+        return pre + [f"  {op} {val(d)}, {s_text}"]
+    if op in UNARY:
+        return pre + [f"  {op} {val(a[0])}" + (f", {a[1]}" if len(a) > 1 else "")]
+    if op == "set":
+        cc, d = a
+        if mem(d): return [f"  set{cc} r11b", "  movzx r11, r11b", f"  mov {val(d)}, r11"]
+        r = frame.loc[d] if isinstance(d, VReg) else d
+        return [f"  set{cc} {BYTE_REGS[r]}", f"  movzx {r}, {BYTE_REGS[r]}"]
+    if op == "cmov":
+        cc, d, s = a
+        s_text = val(s)
+        return through_scratch(d, lambda r: f"  cmov{cc} {r}, {s_text}")
+    if op == "lea":
+        d, x = a
+        text = addr(x)
+        return through_scratch(d, lambda r: f"  lea {r}, {text}", load=False)   # r11 may be the index
+    if op in ("idiv", "imulh"):
+        return pre + [f"  {op[:4]} {val(a[0])}"]
+    if op in VECTOR: return _render_vector(ins, frame, val, mem, addr, pre)
+    raise NotImplementedError(op)
+
+def _render_vector(ins, frame, val, mem, addr, pre):
+    op, a = ins.op, ins.args
+    def vec(x): return addr(x) if isinstance(x, Addr) else x
+    if op == "vmov":
+        d, s = vec(a[0]), vec(a[1])
+        return pre + [f"  vmovdqu {d}, {s}"]
+    if op == "vop":
+        d, x, y = vec(a[1]), vec(a[2]), vec(a[3])
+        return pre + [f"  {a[0]} {d}, {x}, {y}"]
+    if op == "vshift": return [f"  {a[0]} {a[1]}, {a[2]}, {a[3]}"]
+    if op == "vbroadcast":
+        d, s = a
+        xmm = "x" + d[1:]
+        if mem(s): return pre + [f"  vpbroadcastq {d}, {val(s)}"]
+        if isinstance(s, int): return [f"  mov r11, {s}", f"  vmovq {xmm}, r11", f"  vpbroadcastq {d}, {xmm}"]
+        return [f"  vmovq {xmm}, {val(s)}", f"  vpbroadcastq {d}, {xmm}"]
+    return ["  vzeroupper"]
+
+# -------------------------
+# CPU feature check
+# -------------------------
+# __plasma_avx2() returns 1 when AVX2 code may run: the CPU has AVX and AVX2
+# (CPUID leaves 1 and 7) and the OS saves ymm state (OSXSAVE, XCR0 bits 1-2).
+# The answer is cached in AVX2_STATE (0 unknown, 1 no, 2 yes), so vector
+# loops can ask every time they start. It only clobbers rax, rcx, rdx and r8.
+AVX2_STATE = "__plasma_avx2_state"
+AVX2_CHECK = [
+    "__plasma_avx2:",
+    f"  mov rax, [rel {AVX2_STATE}]",
+    "  test rax, rax",
+    "  jnz .known",
+    "  push rbx",
+    "  xor r8d, r8d",
+    "  xor eax, eax",
+    "  cpuid",
+    "  cmp eax, 7",
+    "  jb .done",
+    "  mov eax, 1",
+    "  cpuid",
+    "  and ecx, 0x18000000",   # OSXSAVE | AVX
+    "  cmp ecx, 0x18000000",
+    "  jne .done",
+    "  xor ecx, ecx",
+    "  xgetbv",
+    "  and eax, 6",            # xmm and ymm state enabled
+    "  cmp eax, 6",
+    "  jne .done",
+    "  mov eax, 7",
+    "  xor ecx, ecx",
+    "  cpuid",
+    "  test ebx, 32",          # AVX2
+    "  jz .done",
+    "  mov r8d, 1",
+    ".done:",
+    "  lea rax, [r8+1]",
+    f"  mov [rel {AVX2_STATE}], rax",
+    "  pop rbx",
+    ".known:",
+    "  dec rax",
+    "  ret",
+]
+
+def db(text):
+    """A NUL-terminated string as NASM db operands."""
+    parts, run = [], ""
+    for b in text.encode("utf8") + b"\0":
+        if 32 <= b < 127 and b != ord('"'):
+            run += chr(b); continue
+        if run: parts.append(f'"{run}"'); run = ""
+        parts.append(str(b))
+    return ", ".join(parts)
+
+def stats(lines):
+    """Instruction count and memory accesses (operands plus push/pop) of printed assembly."""
+    ins = [l.strip() for l in lines if l.startswith("  ")]
+    mem = sum(("[" in l and not l.startswith("lea")) or l.startswith(("push", "pop")) for l in ins)
+    return {"instructions": len(ins), "memory_accesses": mem}
+
+# -------------------------
+# Streaming output
+# -------------------------
+# Backends write each function's assembly as soon as it is allocated and
+# printed instead of keeping the whole program as a list of lines. Sections
+# grow side by side (data labels appear while text is generated), so every
+# part is its own spooled file: in memory up to SPOOL_SIZE, then on disk.
+# Readers get the parts back in order as line-aligned chunks, which the
+# built-in assembler consumes directly.
+SPOOL_SIZE = 1 << 22
+CHUNK_SIZE = 1 << 16
+
+class AsmStream:
+    def __init__(self, parts=("data", "head", "text")):
+        self.parts = {p: tempfile.SpooledTemporaryFile(SPOOL_SIZE, mode="w+", encoding="utf8") for p in parts}
+
+    def write(self, part, lines):
+        if lines: self.parts[part].write("\n".join(lines) + "\n")
+
+    def chunks(self, size=CHUNK_SIZE):
+        """The text of every part in order, in pieces that end at line breaks."""
+        for f in self.parts.values():
+            f.seek(0)
+            carry = ""
+            while True:
+                block = f.read(size)
+                if not block: break
+                block = carry + block
+                cut = block.rfind("\n") + 1
+                if cut: yield block[:cut]
+                carry = block[cut:]
+            if carry: yield carry
+            f.seek(0, 2)   # later writes append
+
+    def getvalue(self):
+        return "".join(self.chunks())
+
+    def write_to(self, f):
+        for chunk in self.chunks(): f.write(chunk)
+
+    def close(self):
+        for f in self.parts.values(): f.close()
@@ -0,0 +1,233 @@
+# test_backends.py
+# End-to-end checks: programs built with the LLVM and NASM backends print
+# what PlasmaScript semantics say they should
+# License: MIT
+
+import os, subprocess, sys
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from plasmascriptc import LLVMBackend, NASMBackend, parse_file
+from plasmascriptc_build import build_program
+from plasmascriptc_x86 import HOST_ABI, SYSV, signed_magic
+
+def run(exe):
+    return subprocess.run([exe], capture_output=True, text=True, check=True).stdout
+
+def build_llvm(path, exe, opt_level=2):
+    LLVMBackend(parse_file(path), opt_level).compile(exe)
+    return run(exe)
+
+def build_nasm(path, exe, opt_level=2):
+    NASMBackend(parse_file(path), opt_level).compile(exe)
+    return run(exe)
+
+BOOL_ORDER = """Prog main() {
+    let a = 3
+    let b = 4
+    Print [(a == b) < (a == a)]
+    Print [(a == a) > (a == b)]
+    Print [(a == a) <= (a == b)]
+    Print [(a == b) >= (a == b)]
+    Print [(a == b) < (a == b)]
+    Print [(a == a) == (b == b)]
+    Print [(a == a) != (a == b)]
+}
+end
+"""
+
+@pytest.mark.parametrize("opt_level", range(4))
+def test_bool_comparisons(tmp_path, opt_level):
+    # false < true, as in the VMs and the NASM backend
+    src = tmp_path / "bools.ps"
+    src.write_text(BOOL_ORDER)
+    expected = "true\ntrue\nfalse\ntrue\nfalse\ntrue\ntrue\n"
+    assert build_llvm(str(src), str(tmp_path / "llvm"), opt_level) == expected
+    if HOST_ABI is SYSV:
+        assert build_nasm(str(src), str(tmp_path / "nasm"), opt_level) == expected
+
+CLOSURE_LOOP = """Func makeAdder(x) {
+    return Func(y) { return x + y }
+}
+
+Func twice(f) {
+    return Func(y) { return f(f(y)) }
+}
+
+Prog main() {
+    let total = 0
+    let i = 0
+    while i < 2000000 {
+        let add = makeAdder(i)
+        let add2 = twice(add)
+        total = total + add2(1) - add(1)
+        i = i + 1
+    }
+    Print [total]
+}
+end
+"""
+
+@pytest.mark.parametrize("opt_level", [0, 2])
+def test_escaping_closures_are_freed(tmp_path, opt_level):
+    # Two million escaping environments would need ~100 MiB if none were freed.
+    resource = pytest.importorskip("resource")
+    src, exe = tmp_path / "closures.ps", str(tmp_path / "closures")
+    src.write_text(CLOSURE_LOOP)
+    LLVMBackend(parse_file(str(src)), opt_level).compile(exe)
+    limit = lambda: resource.setrlimit(resource.RLIMIT_DATA, (32 << 20, 32 << 20))
+    out = subprocess.run([exe], capture_output=True, text=True, check=True, preexec_fn=limit).stdout
+    assert out == "1999999000000\n"
+
+CLOSURE_OWNERSHIP = """Func makeAdder(x) {
+    return Func(y) { return x + y }
+}
+
+Func apply(f, v) { return f(v) }
+
+Prog main() {
+    let g = makeAdder(100)
+    let h = g
+    g = makeAdder(200)
+    Print [h(1)]
+    Print [g(1)]
+    Print [apply(makeAdder(7), 1)]
+    Print [apply(h, 2)]
+    let k = 5
+    let m = Func(y) { return y * k }
+    Print [apply(m, 3)]
+    let p = (1, makeAdder(40))
+    let q = p
+    p = (2, g)
+    makeAdder(9)
+}
+end
+"""
+
+def test_closure_ownership(tmp_path):
+    # Copies, reassignment, temporaries and tuples each keep an environment
+    # alive exactly as long as it is reachable; glibc aborts on a double free.
+    src = tmp_path / "ownership.ps"
+    src.write_text(CLOSURE_OWNERSHIP)
+    assert build_llvm(str(src), str(tmp_path / "ownership"), 0) == "101\n201\n8\n102\n15\n"
+
+SPIN = """Prog main() {
+    Print [1]
+    while true { }
+    Print [2]
+}
+end
+"""
+
+def test_while_loops_may_spin(tmp_path):
+    # Only counted loops are known to terminate; a while loop tagged
+    # llvm.loop.mustprogress lets -O2 delete the spin and fall off main.
+    src, exe = tmp_path / "spin.ps", str(tmp_path / "spin")
+    src.write_text(SPIN)
+    assert "mustprogress" not in LLVMBackend(parse_file(str(src)), 2).build()
+    LLVMBackend(parse_file(str(src)), 2).compile(exe)
+    with pytest.raises(subprocess.TimeoutExpired):
+        subprocess.run([exe], capture_output=True, timeout=1)
+
+def test_nasm_build_closes_its_stream(tmp_path):
+    # build() hands back the text; the spooled parts behind it are not left open
+    src = tmp_path / "bools.ps"
+    src.write_text(BOOL_ORDER)
+    backend = NASMBackend(parse_file(str(src)), 2)
+    assert "section .text" in backend.build()
+    assert all(f.closed for f in backend.out.parts.values())
+
+C_FLOATS = r"""#include <stdio.h>
+void show(float f, double d, int n) { printf("%.2f %.2f %d\n", f, d, n); fflush(stdout); }
+"""
+
+FLOAT_EXTERN = """Import "cfloats"
+
+Extern "C" Func show(f: f32, d: f64, n: number)
+
+Prog main() {
+    let x = 0.25
+    show(x, x + 1.0, 3)
+    show(2, 0.5, 4)
+}
+end
+"""
+
+def test_extern_float_widths(tmp_path, monkeypatch):
+    subprocess.run(["cc", "-shared", "-fPIC", "-o", str(tmp_path / "libcfloats.so"), "-x", "c", "-"],
+                   input=C_FLOATS, text=True, check=True)
+    monkeypatch.setenv("LIBRARY_PATH", str(tmp_path))
+    src, exe = tmp_path / "floats.ps", str(tmp_path / "floats")
+    src.write_text(FLOAT_EXTERN)
+    LLVMBackend(parse_file(str(src)), 2).compile(exe)
+    out = subprocess.run([exe], capture_output=True, text=True, check=True,
+                         env=dict(os.environ, LD_LIBRARY_PATH=str(tmp_path))).stdout
+    assert out == "0.25 1.25 3\n2.00 0.50 4\n"
+
+def test_extern_float_needs_width(tmp_path):
+    src = tmp_path / "nowidth.ps"
+    src.write_text('Extern "C" Func glClearColor(r: number, g: number, b: number, a: number)\n'
+                   'Prog main() {\n    glClearColor(0.2, 0.3, 0.3, 1.0)\n}\nend\n')
+    with pytest.raises(Exception, match="float parameter r needs a C width"):
+        LLVMBackend(parse_file(str(src)), 2).build()
+
+RC_LIB = """Export Func consume(obj: rc) {
+    release(obj)
+    return 0
+}
+end
+"""
+
+RC_MAIN = """Import "lib"
+
+Prog main() {
+    let obj = rc_alloc(16)
+    store(obj, 0, 7)
+    retain(obj)
+    consume(obj)
+    Print [load(obj, 0)]
+    release(obj)
+}
+end
+"""
+
+def test_refcount_pairs_kept_around_imported_calls(tmp_path):
+    # consume() drops the reference the retain took; eliding the pair would
+    # free obj inside the call. Without tcache, glibc fills freed blocks
+    # with the perturb byte, so a load after the free reads 0x55555555.
+    (tmp_path / "lib.ps").write_text(RC_LIB)
+    (tmp_path / "main.ps").write_text(RC_MAIN)
+    exe = str(tmp_path / "main")
+    build_program(str(tmp_path / "main.ps"), exe, 2, cache_dir=str(tmp_path / "cache"))
+    env = dict(os.environ, GLIBC_TUNABLES="glibc.malloc.perturb=85:glibc.malloc.tcache_count=0")
+    assert subprocess.run([exe], capture_output=True, text=True, check=True, env=env).stdout == "7\n"
+
+DIVISORS = [d for n in range(1, 65) for d in (n, -n)] + [1000003, -(2**31 + 1), 2**62 - 1]
+DIVIDENDS = list(range(-300, 301)) + [2**31 - 1, -2**31, 2**62 + 5, 2**63 - 1, -2**63 + 1, -2**63]
+
+def _trunc(x, d, op):
+    q = abs(x) // abs(d) * (1 if (x < 0) == (d < 0) else -1)
+    return q if op == "/" else x - q * d
+
+def test_signed_magic():
+    # hi64(M * x) >> s, plus x when M < 0, plus one for negative quotients
+    for d in list(range(2, 2000)) + [1000003, 2**31 + 1, 2**62 - 1]:
+        m, s = signed_magic(d)
+        near = [k * d + r for k in (-7, 7, 2**62 // d) for r in (-1, 0, 1)]
+        for x in DIVIDENDS + [x for x in near if -2**63 <= x < 2**63]:
+            q = (m * x >> 64) + (x if m < 0 else 0) >> s
+            assert q + (q < 0) == _trunc(x, d, "/"), (x, d)
+
+@pytest.mark.skipif(HOST_ABI is not SYSV, reason="runs NASMBackend output")
+def test_constant_division(tmp_path):
+    # NASMBackend's strength-reduced x / c and x % c against truncating division
+    body = "".join(f"    Print [x {op} {d}]\n" for d in DIVISORS for op in "/%")
+    calls = "".join(f"    check({x if x >= 0 else f'0 - {-x - 1} - 1'})\n" for x in DIVIDENDS[601:])
+    src = tmp_path / "divide.ps"
+    src.write_text(f"Func check(x) {{\n{body}    return 0\n}}\n\n"
+                   f"Prog main() {{\n    for x in range(0 - 300, 301) {{\n        check(x)\n    }}\n{calls}}}\nend\n")
+    expected = [str(_trunc(x, d, op)) for x in DIVIDENDS for d in DIVISORS for op in "/%"]
+    out = build_nasm(str(src), str(tmp_path / "divide")).splitlines()
+    # -2^63 / -1 overflows; idiv would trap, so the result is not checked
+    skip = len(expected) - 2 * len(DIVISORS) + 2 * DIVISORS.index(-1)
+    assert len(out) == len(expected)
+    assert out[:skip] + out[skip + 1:] == expected[:skip] + expected[skip + 1:]
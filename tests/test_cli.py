@@ -0,0 +1,21 @@
+# test_cli.py
+# plasmascriptc command-line validation
+# License: MIT
+
+import os, sys
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from plasmascriptc import main
+
+@pytest.mark.parametrize("argv", [["prog.ps", "--run", "-backend", "nasm"],
+                                  ["--project", "src", "-backend", "nasm"]])
+def test_llvm_only_modes_reject_nasm(argv, capsys):
+    with pytest.raises(SystemExit) as e: main(argv)
+    assert e.value.code == 2
+    assert "drop -backend nasm" in capsys.readouterr().err
+
+def test_nasm_unsupported_is_one_line(tmp_path, capsys):
+    src = os.path.join(os.path.dirname(__file__), "..", "src", "closures.ps")
+    with pytest.raises(SystemExit) as e: main([src, "-backend", "nasm", "-o", str(tmp_path / "out")])
+    assert e.value.code == 1
+    assert capsys.readouterr().err == "plasmascriptc: error: NASM backend: closures need -backend llvm\n"
@@ -0,0 +1,187 @@
+# test_codegen_nasm.py
+# codegen_nasm against a Python reference interpreter: random expressions
+# and nested loops, assembled with the built-in assembler and linked with ld
+# License: MIT
+
+import functools, os, random, shutil, subprocess, sys
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import plasmascriptc_nasm
+from plasmascriptc_elf import write_object
+from plasmascriptc_nasm import UNROLL, block_end, codegen_nasm
+from plasmascriptc_x86 import HOST_ABI, SYSV
+
+pytestmark = pytest.mark.skipif(HOST_ABI is not SYSV or not shutil.which("ld"), reason="runs Linux _start programs")
+
+def num(v): return {"type": "Number", "value": v}
+def var(v): return {"type": "Var", "value": v}
+def op(v): return {"type": "Op", "value": v}
+
+def wrap(v):
+    return (v + 2**63) % 2**64 - 2**63
+
+class Trap(Exception):
+    pass
+
+OPS = {"+": lambda a, b: a + b, "-": lambda a, b: a - b, "*": lambda a, b: a * b,
+       "==": lambda a, b: int(a == b), "!=": lambda a, b: int(a != b), "<": lambda a, b: int(a < b),
+       ">": lambda a, b: int(a > b), "<=": lambda a, b: int(a <= b), ">=": lambda a, b: int(a >= b)}
+
+def divide(a, b, o):
+    # idiv: truncating, and it traps on / 0 and -2^63 / -1
+    if b == 0 or (a == -2**63 and b == -1): raise Trap
+    q = abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1)
+    return q if o == "/" else a - q * b
+
+def evaluate(rpn, env):
+    stack = []
+    for t in rpn:
+        if t["type"] == "Number": stack.append(int(t["value"]))
+        elif t["type"] == "Var": stack.append(env[t["value"]])
+        elif t["value"] == "neg": stack.append(wrap(-stack.pop()))
+        else:
+            b, a = stack.pop(), stack.pop()
+            stack.append(divide(a, b, t["value"]) if t["value"] in ("/", "%") else wrap(OPS[t["value"]](a, b)))
+    return stack[0]
+
+def run(tmp_path, ast, **options):
+    exe = str(tmp_path / "prog")
+    write_object(codegen_nasm(ast, **options), exe + ".o")
+    subprocess.run(["ld", exe + ".o", "-o", exe], check=True)
+    return subprocess.run([exe], capture_output=True, text=True, check=True).stdout
+
+# -------------------------
+# Expressions
+# -------------------------
+VARS = ("a", "b", "c", "d", "e")
+CONSTANTS = (0, 1, 2, 3, 7, -1, -5, 100, 2**31 - 1, -2**31, 2**40 + 3)
+
+def random_expr(rng, depth):
+    if depth == 0 or rng.random() < 0.2:
+        return [var(rng.choice(VARS))] if rng.random() < 0.6 else [num(rng.choice(CONSTANTS))]
+    if rng.random() < 0.1: return random_expr(rng, depth - 1) + [op("neg")]
+    o = rng.choice(list(OPS) + ["/", "%"])
+    return random_expr(rng, depth - 1) + random_expr(rng, rng.randrange(depth)) + [op(o)]
+
+@pytest.mark.parametrize("regs", [plasmascriptc_nasm.EXPR_REGS, ("rcx", "rsi")], ids=["pool", "spill"])
+def test_expressions(tmp_path, monkeypatch, regs):
+    # a two-register pool makes every wide tree wait on the stack
+    monkeypatch.setattr(plasmascriptc_nasm, "lower_tree", functools.partial(plasmascriptc_nasm.lower_tree, regs=regs))
+    rng = random.Random(44)
+    env = {v: rng.choice((-3, 5, 12, -2**62, 2**33 + 1)) for v in VARS}
+    ast = [{"type": "FunctionDecl", "name": "main", "args": []}]
+    ast += [{"type": "AssignExpr", "name": v, "expr": [num(x)]} for v, x in env.items()]
+    expected = []
+    while len(expected) < 300:
+        expr = random_expr(rng, rng.randrange(1, 7))
+        try: expected.append(evaluate(expr, env))
+        except Trap: continue
+        ast += [{"type": "AssignExpr", "name": "r", "expr": expr}, {"type": "Print", "value": "r"}]
+    ast.append({"type": "ReturnExpr", "expr": [num(0)]})
+    assert run(tmp_path, ast, hoist=False).splitlines() == [str(v) for v in expected]
+
+# -------------------------
+# Loops
+# -------------------------
+# Programs are main plus a helper it calls from inside loops, so loop
+# counters held in callee-saved registers have to survive the call. a, b
+# and c are set once and stay invariant; s and t are the accumulators.
+# Bounds are constants, invariants, outer counters or expressions of them.
+LOOP_VARS = ("i", "j", "k", "l", "m", "n")
+
+def loop_expr(rng, names, depth=2):
+    if depth == 0 or rng.random() < 0.3:
+        return [var(rng.choice(names))] if rng.random() < 0.7 else [num(rng.randrange(-3, 10))]
+    o = rng.choice(("+", "-", "*", "+", "%", "/", "<", "=="))
+    right = [num(rng.choice((3, 7, -5)))] if o in ("/", "%") else loop_expr(rng, names, depth - 1)
+    return loop_expr(rng, names, depth - 1) + right + [op(o)]
+
+def bound(rng, counters, small):
+    if small: return str(rng.randrange(0, 3))   # deep nests stay short
+    pick = rng.randrange(4)
+    if pick == 0 and counters: return rng.choice(counters)
+    if pick == 1: return rng.choice(("a", "b"))
+    if pick == 2: return [var(rng.choice(counters or ["a"])), num(rng.randrange(1, 3)), op("+")]
+    return str(rng.randrange(0, 3 if small else 9))
+
+def random_block(rng, depth, counters, helper):
+    names = ["a", "b", "c", "s", "t"] + counters
+    nodes = []
+    for n in range(rng.randrange(2, 5)):
+        kind = "for" if n == 0 and depth > 2 else rng.choice(("assign", "assign", "print", "if", "for", "call"))
+        if kind == "for" and depth and len(counters) < len(LOOP_VARS):
+            v = LOOP_VARS[len(counters)]
+            nodes.append({"type": "ForLoop", "var": v, "start": bound(rng, counters, False),
+                          "end": bound(rng, counters, len(counters) > 2)})
+            nodes += random_block(rng, depth - 1, counters + [v], helper) + [{"type": "BlockEnd"}]
+            if rng.random() < 0.5: nodes.append({"type": "Print", "value": v})   # its final value
+        elif kind == "if":
+            nodes.append({"type": "IfStart", "cond": loop_expr(rng, names)})
+            nodes += random_block(rng, 0, counters, helper)
+            if rng.random() < 0.5: nodes += [{"type": "Else"}] + random_block(rng, 0, counters, helper)
+            nodes.append({"type": "BlockEnd"})
+        elif kind == "call" and helper:
+            nodes.append({"type": "FunctionCall", "name": "helper", "args": [rng.choice(["a", "2"] + counters)]})
+        elif kind == "print":
+            nodes.append({"type": "Print", "value": rng.choice(names)})
+        else:
+            nodes.append({"type": "AssignExpr", "name": rng.choice(("s", "t")), "expr": loop_expr(rng, names, 3)})
+    return nodes
+
+def random_program(rng):
+    depth = rng.choice((2, 3, 6))   # six nested loops run out of counter registers
+    ast = []
+    for name, args in (("helper", ["c"]), ("main", [])):
+        ast.append({"type": "FunctionDecl", "name": name, "args": args})
+        ast += [{"type": "AssignExpr", "name": v, "expr": [num(rng.randrange(1, 6))]}
+                for v in ("a", "b", "c", "s", "t") if v not in args]
+        ast += random_block(rng, depth if name == "main" else 2, [], name == "main")
+        ast += [{"type": "Print", "value": "s"}, {"type": "Print", "value": "t"}, {"type": "ReturnExpr", "expr": [num(0)]}]
+    return ast
+
+def interpret(ast):
+    funcs = {n["name"]: (i, n["args"]) for i, n in enumerate(ast) if n["type"] == "FunctionDecl"}
+    out = []
+
+    def value(v, env):
+        return int(v) if v.lstrip("-").isdigit() else env[v]
+
+    def call(name, args):
+        start, params = funcs[name]
+        end = next((i for i in range(start + 1, len(ast)) if ast[i]["type"] == "FunctionDecl"), len(ast))
+        run_block(ast[start + 1:end], dict(zip(params, args)))
+
+    def run_block(nodes, env):
+        k = 0
+        while k < len(nodes):
+            node = nodes[k]
+            if node["type"] in ("ForLoop", "IfStart"):
+                end, els = block_end(nodes, k)
+                body, other = nodes[k + 1:els if els is not None else end], nodes[els + 1:end] if els is not None else []
+                if node["type"] == "IfStart":
+                    run_block(body if evaluate(node["cond"], env) else other, env)
+                else:
+                    # bodies never assign a bound, so reading it once is enough
+                    env[node["var"]], last = (evaluate(v, env) if isinstance(v, list) else value(v, env)
+                                              for v in (node["start"], node["end"]))
+                    while env[node["var"]] <= last:
+                        run_block(body, env)
+                        env[node["var"]] += 1
+                k = end + 1
+                continue
+            if node["type"] == "AssignExpr": env[node["name"]] = evaluate(node["expr"], env)
+            elif node["type"] == "Print": out.append(value(node["value"], env))
+            elif node["type"] == "FunctionCall": call(node["name"], [value(a, env) for a in node["args"]])
+            elif node["type"] == "ReturnExpr": return
+            k += 1
+
+    call("main", [])
+    return out
+
+@pytest.mark.parametrize("hoist", [False, True], ids=["plain", "hoist"])
+@pytest.mark.parametrize("unroll", range(1, UNROLL + 1))
+def test_loops(tmp_path, unroll, hoist):
+    for seed in range(16):
+        ast = random_program(random.Random(seed))
+        expected = interpret(ast)
+        assert run(tmp_path, ast, unroll=unroll, hoist=hoist).splitlines() == [str(v) for v in expected], seed
@@ -0,0 +1,41 @@
+# test_examples.py
+# Every src/ program with a Prog/Main entry builds with the LLVM backend and
+# prints what its comments document
+# License: MIT
+
+import glob, os, re, subprocess, sys
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from plasmascriptc_build import build_program
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+EXPECTED = {
+    "closures.ps": "18\n",
+    "closures_memory.ps": "18\n",
+    "functions.ps": "7\n",
+    "hello.ps": "Hello Shay\n",
+    "higherorder.ps": "5\n6\n",
+    "lambdas.ps": "7\n7\n",
+    "memorylib.ps": "42\n",
+    "nested.ps": "9\n30\n",
+    "vars.ps": "6\n7\n13\n",
+}
+UNBUILDABLE = {
+    "interop.ps": "links opengl32",
+    "plasmascriptc.ps": "self-hosting sketch, not in the grammar",
+}
+
+def programs():
+    for path in sorted(glob.glob(os.path.join(SRC, "*.ps"))):
+        with open(path) as f:
+            if re.search(r"^\s*(Prog|Main)\b", f.read(), re.M): yield os.path.basename(path)
+
+def test_every_program_is_covered():
+    assert set(programs()) == set(EXPECTED) | set(UNBUILDABLE)
+
+@pytest.mark.parametrize("name", sorted(EXPECTED))
+@pytest.mark.parametrize("opt_level", (0, 2))
+def test_example_output(tmp_path, name, opt_level):
+    exe = str(tmp_path / "prog")
+    build_program(os.path.join(SRC, name), exe, opt_level, cache_dir=str(tmp_path / "cache"))
+    assert subprocess.run([exe], capture_output=True, text=True, check=True).stdout == EXPECTED[name]